@@ -7,9 +7,13 @@
 # It adheres to modularity and securely retrieves database credentials from
 # the user-provided 'config.py' file.
 
+import os
 import pymysql
 import pymysql.cursors
 import sys
+import threading
+import time
+from collections import deque
 
 # Initialize credential variables as None
 DB_HOST = None
@@ -17,6 +21,15 @@ DB_USER = None
 DB_PASSWORD = None
 DB_NAME = None
 
+# Connection pool defaults; each may be overridden in config.py
+DB_POOL_SIZE = 5            # max open connections per worker process
+DB_POOL_TIMEOUT = 10        # seconds to wait for a free connection
+DB_POOL_IDLE_TIMEOUT = 300  # close connections idle longer than this
+DB_POOL_PING_INTERVAL = 30  # ping connections idle longer than this before reuse
+
+# Seconds a cached table list / column list stays valid
+SCHEMA_CACHE_TTL = 300
+
 try:
     import config
 
@@ -38,6 +51,12 @@ try:
     if DB_NAME is None and hasattr(config, 'DATABASE'):
         DB_NAME = config.DATABASE
 
+    DB_POOL_SIZE = getattr(config, 'DB_POOL_SIZE', DB_POOL_SIZE)
+    DB_POOL_TIMEOUT = getattr(config, 'DB_POOL_TIMEOUT', DB_POOL_TIMEOUT)
+    DB_POOL_IDLE_TIMEOUT = getattr(config, 'DB_POOL_IDLE_TIMEOUT', DB_POOL_IDLE_TIMEOUT)
+    DB_POOL_PING_INTERVAL = getattr(config, 'DB_POOL_PING_INTERVAL', DB_POOL_PING_INTERVAL)
+    SCHEMA_CACHE_TTL = getattr(config, 'SCHEMA_CACHE_TTL', SCHEMA_CACHE_TTL)
+
     # Final validation: Ensure all required credentials are set
     if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
         print("Warning: Database credentials are not fully defined in config.py. Using fallbacks.", file=sys.stderr)
@@ -46,11 +65,141 @@ except ImportError:
     print("Error: config.py not found. Database credentials cannot be loaded.", file=sys.stderr)
     exit()
 
+from catalog import catalog_version
+import metrics
+import query_trace
+
+class PoolTimeoutError(pymysql.err.OperationalError):
+    """
+    Raised when no pooled connection becomes free within DB_POOL_TIMEOUT.
+    """
+
+
+class ConnectionPool:
+    """
+    A bounded pool of open connections for one set of credentials.
+
+    MySQL._connect() checks a connection out and MySQL._close() hands it
+    back, so consecutive queries reuse the same TCP session instead of paying
+    for a connect and auth handshake each time. Connections that have sat
+    idle past `idle_timeout` are closed, and ones idle past `ping_interval`
+    are pinged (and reconnected if needed) before being handed out again.
+    """
+    def __init__(self, connect_args, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, ping_interval=DB_POOL_PING_INTERVAL):
+        self.connect_args = connect_args
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, last_used) pairs, most recent on the right
+        self._checked_out = 0
+        self._cond = threading.Condition()
+
+    def _evict_idle(self):
+        """
+        Closes idle connections older than idle_timeout. Caller holds the lock.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.popleft()
+            _close_quietly(conn)
+
+    def acquire(self):
+        """
+        Returns a live connection, opening a new one if the pool has room.
+        Blocks for up to `timeout` seconds when every connection is in use.
+        """
+        deadline = time.monotonic() + self.timeout
+        conn, last_used = None, None
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._checked_out < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"No free database connection after {self.timeout}s")
+                self._cond.wait(remaining)
+            self._checked_out += 1
+
+        # Health check and connect outside the lock so other threads are not held up.
+        try:
+            if conn is not None and time.monotonic() - last_used > self.ping_interval:
+                try:
+                    conn.ping(reconnect=True)
+                except pymysql.Error:
+                    _close_quietly(conn)
+                    conn = None
+            if conn is None:
+                conn = pymysql.connect(**self.connect_args)
+            return conn
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool, or closes it if it is broken or
+        `discard` is set.
+        """
+        with self._cond:
+            self._checked_out -= 1
+            if discard or not conn.open:
+                _close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._evict_idle()
+            self._cond.notify()
+
+    def close_all(self):
+        """
+        Closes every idle connection held by the pool.
+        """
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+# Pools are kept per process: gunicorn forks its workers after import, and a
+# socket inherited from the parent must never be shared between processes.
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(connect_args):
+    """
+    Returns the pool for these credentials in the current process, creating it
+    on first use.
+    """
+    key = (os.getpid(),) + tuple(sorted((k, str(v)) for k, v in connect_args.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect_args)
+            _pools[key] = pool
+        return pool
+
+
 class MySQL:
     """
     A class for managing connections and queries to a MySQL database.
+    Connections come from a per-process ConnectionPool and are returned to it
+    after every query, so creating many MySQL objects stays cheap.
     """
-    def __init__(self, host=None, user=None, password=None, database=None):
+    def __init__(self, host=None, user=None, password=None, database=None, port=None, charset=None):
         """
         Initializes the MySQL class with database credentials.
         Prefers arguments, falls back to global config variables.
@@ -59,53 +208,75 @@ class MySQL:
         self.user = user or DB_USER
         self.password = password or DB_PASSWORD
         self.database = database or DB_NAME
+        self.port = port or 3306
+        self.charset = charset or 'utf8mb4'
         self.conn = None
+        # The error of the last get_data/put_data call, or None if it worked
+        self.last_error = None
 
         if not all([self.host, self.user, self.password, self.database]):
             print("Error: MySQL credentials are not fully configured.", file=sys.stderr)
             exit()
 
+        self.pool = get_pool({
+            'host': self.host,
+            'user': self.user,
+            'password': self.password,
+            'database': self.database,
+            'port': int(self.port),
+            'charset': self.charset,
+            'autocommit': True,
+            'cursorclass': pymysql.cursors.DictCursor,
+        })
+
     def _connect(self):
         """
-        Establishes a connection to the database.
+        Checks a connection out of the pool.
         """
         if self.conn and self.conn.open:
             return self.conn
+        started = time.perf_counter()
         try:
-            self.conn = pymysql.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            self.conn = self.pool.acquire()
+            metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
             return self.conn
         except pymysql.Error as e:
             print(f"Connection error: {e}", file=sys.stderr)
+            metrics.DB_ERRORS.inc(operation='connect')
+            self.last_error = e
             return None
 
-    def _close(self):
+    def _close(self, discard=False):
         """
-        Closes the database connection.
+        Returns the connection to the pool (or closes it when `discard` is set).
         """
         if self.conn:
-            self.conn.close()
+            self.pool.release(self.conn, discard=discard)
             self.conn = None
 
     def get_data(self, query, params=None):
         """
         Executes a SELECT query and returns the results as a list of dictionaries.
         """
+        self.last_error = None
         conn = self._connect()
         if not conn:
             return []
+        started = time.perf_counter()
         try:
             with conn.cursor() as cursor:
                 cursor.execute(query, params)
                 results = cursor.fetchall()
+                duration = time.perf_counter() - started
+                metrics.DB_QUERY_SECONDS.observe(duration, operation='get_data')
+                if query_trace.ENABLED:
+                    query_trace.record(cursor, query, params, duration, len(results))
                 return results
         except pymysql.Error as e:
             print(f"Query execution error: {e}", file=sys.stderr)
+            metrics.DB_ERRORS.inc(operation='get_data')
+            self.last_error = e
+            self._close(discard=_is_connection_error(e))
             return []
         finally:
             self._close()
@@ -113,34 +284,49 @@ class MySQL:
     def put_data(self, query, params=None):
         """
         Executes an INSERT, UPDATE, or DELETE query and returns the number of
-        affected rows.
+        affected rows. Errors are printed and return 0; check `last_error` to
+        tell a failed write from one that matched no rows.
         """
+        self.last_error = None
         conn = self._connect()
         if not conn:
             return 0
+        started = time.perf_counter()
         try:
             with conn.cursor() as cursor:
                 affected_rows = cursor.execute(query, params)
                 conn.commit()
+                duration = time.perf_counter() - started
+                metrics.DB_QUERY_SECONDS.observe(duration, operation='put_data')
+                if query_trace.ENABLED:
+                    query_trace.record(cursor, query, params, duration, affected_rows)
                 return affected_rows
         except pymysql.Error as e:
             print(f"Query execution error: {e}", file=sys.stderr)
-            conn.rollback()
+            metrics.DB_ERRORS.inc(operation='put_data')
+            self.last_error = e
+            if _is_connection_error(e):
+                self._close(discard=True)
+            else:
+                conn.rollback()
             return 0
         finally:
             self._close()
 
-    def get_field_names(self, table):
+    def _describe(self, table):
         """
-        Retrieves the field (column) names for a given table.
+        Runs DESCRIBE on a table and returns its column names.
         """
         field_names = []
         conn = None
         try:
             conn = self._connect()
             with conn.cursor() as cursor:
+                started = time.perf_counter()
                 cursor.execute(f"DESCRIBE `{table}`")
                 columns = cursor.fetchall()
+                if query_trace.ENABLED:
+                    query_trace.record(cursor, f"DESCRIBE `{table}`", None, time.perf_counter() - started, len(columns))
                 field_names = [col['Field'] for col in columns]
         except pymysql.Error as e:
             print(f"Error getting field names for table '{table}': {e}", file=sys.stderr)
@@ -149,23 +335,115 @@ class MySQL:
                 self._close()
         return field_names
 
+    def get_field_names(self, table):
+        """
+        Retrieves the field (column) names for a given table.
+        Served from the process-wide schema cache after the first call.
+        """
+        return list(SCHEMA_CACHE.get_columns(self, table))
+
     def get_num_fields(self, table):
         """
         Retrieves the number of fields (columns) in a given table.
         """
-        num_fields = -1
-        conn = None
-        try:
-            conn = self._connect()
-            with conn.cursor() as cursor:
-                cursor.execute(f"DESCRIBE `{table}`")
-                num_fields = cursor.rowcount
-        except pymysql.Error as e:
-            print(f"Error getting number of fields for table '{table}': {e}", file=sys.stderr)
-        finally:
-            if conn:
-                self._close()
-        return num_fields
+        columns = SCHEMA_CACHE.get_columns(self, table)
+        return len(columns) if columns else -1
+
+    def get_table_features(self, table):
+        """
+        Returns a dict telling which optional columns (album, track_number,
+        resume_position, last_played, folder, parent_dir) exist in a given table.
+        """
+        columns = SCHEMA_CACHE.get_columns(self, table)
+        return {feature: feature in columns for feature in SchemaCache.OPTIONAL_FEATURES}
+
+    def get_table_names(self):
+        """
+        Retrieves the names of all tables in the database (cached).
+        """
+        return list(SCHEMA_CACHE.get_tables(self))
+
+
+class SchemaCache:
+    """
+    Process-wide cache of the table list and each table's columns.
+
+    Entries expire after `ttl` seconds and the whole cache is dropped when
+    the sync scripts bump the catalog stamp, so OV can ask for column names
+    on every request without running DESCRIBE each time.
+    """
+    OPTIONAL_FEATURES = ('album', 'track_number', 'resume_position', 'last_played', 'folder', 'parent_dir')
+
+    def __init__(self, ttl=SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._columns = {}    # table -> (tuple of columns, loaded_at)
+        self._tables = None   # (tuple of table names, loaded_at)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, loaded_at):
+        return time.monotonic() - loaded_at < self.ttl
+
+    def _check_version(self):
+        """
+        Drops everything if the catalog stamp moved. Caller holds the lock.
+        """
+        version = catalog_version()
+        if version != self._version:
+            self._columns.clear()
+            self._tables = None
+            self._version = version
+
+    def get_columns(self, db, table):
+        """
+        Returns the column names of a table, loading it through `db`
+        on a miss. Failed lookups are not cached.
+        """
+        with self._lock:
+            self._check_version()
+            entry = self._columns.get(table)
+            if entry and self._fresh(entry[1]):
+                return entry[0]
+        columns = tuple(db._describe(table))
+        if columns:
+            with self._lock:
+                self._columns[table] = (columns, time.monotonic())
+        return columns
+
+    def get_tables(self, db):
+        """
+        Returns the names of all tables in the database.
+        """
+        with self._lock:
+            self._check_version()
+            if self._tables and self._fresh(self._tables[1]):
+                return self._tables[0]
+        rows = db.get_data("SHOW TABLES")
+        tables = tuple(list(row.values())[0] for row in rows)
+        if tables:
+            with self._lock:
+                self._tables = (tables, time.monotonic())
+        return tables
+
+    def invalidate(self, table=None):
+        """
+        Forgets one table's columns, or everything when no table is given.
+        """
+        with self._lock:
+            if table is None:
+                self._columns.clear()
+                self._tables = None
+            else:
+                self._columns.pop(table, None)
+
+
+SCHEMA_CACHE = SchemaCache()
+
+def _is_connection_error(error):
+    """
+    True when an error means the connection itself is unusable.
+    """
+    return isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
 
 # Global helper functions (add_quotes_double, add_quotes_single)
 # are now largely redundant due to parameterized queries, but kept for direct translation reference.
@@ -8,10 +8,21 @@
 #  Definitive Version: Correctly implements track number sorting
 #                      AND the resume playback functionality.
 
-from flask import render_template, jsonify, request, Response, stream_with_context
-import os
-import re
-from MySql import MySQL
+from flask import render_template, jsonify, request, Response, stream_with_context, url_for
+from werkzeug.wsgi import wrap_file
+from datetime import datetime
+from MySql import MySQL, SCHEMA_CACHE
+import bandwidth
+import block_cache
+import http_range
+import media_stream
+import metrics
+import prefetch
+import recent_playback
+import resume_buffer
+from catalog import DIRECTORY_TABLE, bump_catalog_version
+from playlist import PLAYLISTS
+from search_index import SearchIndex
 import config
 
 def _get_db_connection():
@@ -23,89 +34,139 @@ def _get_item_details(table_name, item_id):
     results = db.get_data(query, (item_id,))
     return results[0] if results else None
 
+# Resume position updates are coalesced here and written in batches
+RESUME_BUFFER = resume_buffer.ResumeWriteBuffer(_get_db_connection)
+
+# Resolves /stream requests to a file without a query on repeat requests
+STREAM_ITEMS = media_stream.StreamItemCache(_get_item_details)
+
+# Title/album/artist/folder search over all media tables; see search_index.py
+SEARCH_INDEX = SearchIndex(_get_db_connection)
+SEARCH_INDEX.refresh()
+
+def _overlay_resume(table_name, rows):
+    """
+    Applies unflushed resume positions to rows read from one media table.
+    """
+    pending = RESUME_BUFFER.pending()
+    if pending:
+        for row in rows:
+            entry = pending.get((table_name, row.get('id')))
+            if entry:
+                row['resume_position'] = entry[0]
+    return rows
+
 def get_resume_items():
+    # Served from the incrementally maintained recent_playback table; see
+    # recent_playback.py for how it is kept in step with resume positions.
     db = _get_db_connection()
-    all_tables_raw = db.get_data("SHOW TABLES")
-    if not all_tables_raw:
-        return []
-
-    # Filter tables to only include those in config.table_list
-    config_tables = [row[1] for row in config.table_list]
-    all_tables = [list(t.values())[0] for t in all_tables_raw if list(t.values())[0] in config_tables]
-    union_queries = []
-
-    for table in all_tables:
-        columns = db.get_field_names(table)
-        if 'resume_position' in columns and 'last_played' in columns:
-
-            # CRITICAL FIX: Check if 'album' exists.
-            # If not, use CAST(NULL AS CHAR) with COLLATE to create a valid, collated placeholder.
-            if 'album' in columns:
-                # If column exists, select it and apply collation
-                album_select = "album COLLATE utf8mb4_unicode_ci"
-            else:
-                # If column is missing, cast NULL as a collated character field
-                # This fixes the SQL syntax error (Error 1064)
-                album_select = "CAST(NULL AS CHAR) COLLATE utf8mb4_unicode_ci"
-
-            # Apply consistent collation to other string columns (title, file_path)
-            query_part = f"""
-            (SELECT
-                id,
-                title COLLATE utf8mb4_unicode_ci as title,
-                file_path COLLATE utf8mb4_unicode_ci as file_path,
-                {album_select} as album,
-                '{table}' as category,
-                last_played,
-                resume_position
-            FROM `{table}`
-            WHERE resume_position > 0.1)
-            """
-            union_queries.append(query_part.strip())
-
-    if not union_queries:
-        return []
-
-    full_query = " UNION ALL ".join(union_queries) + " ORDER BY last_played DESC LIMIT 20"
-    return db.get_data(full_query)
+    pending = RESUME_BUFFER.pending()
+    if not pending:
+        return recent_playback.get_recent(db)
+
+    # Read a little extra so items cleared in the buffer do not shorten the
+    # list, then lay the unflushed positions over the stored rows.
+    rows = recent_playback.get_recent(db, recent_playback.RECENT_LIMIT + len(pending))
+    items = {(row['category'], row['id']): row for row in rows}
+    for (table_name, item_id), (position, played_at) in pending.items():
+        key = (table_name, item_id)
+        if position <= 0.1:
+            items.pop(key, None)
+            continue
+        row = items.get(key)
+        if row is None:
+            details = _get_item_details(table_name, item_id)
+            if not details:
+                continue
+            row = {'id': item_id, 'title': details.get('title'), 'file_path': details.get('file_path'),
+                   'album': details.get('album'), 'category': table_name,
+                   'last_played': details.get('last_played')}
+            items[key] = row
+        row['resume_position'] = position
+        if played_at is not None:
+            row['last_played'] = datetime.fromtimestamp(played_at)
+    ordered = sorted(items.values(), key=lambda r: r['last_played'] or datetime.min, reverse=True)
+    return ordered[:recent_playback.RECENT_LIMIT]
 
 def update_resume_position(table_name, item_id, position, duration):
-    db = _get_db_connection()
     position_to_save = float(position)
     if (float(duration) - position_to_save) < 15:
         position_to_save = 0
+    if RESUME_BUFFER.enabled:
+        RESUME_BUFFER.put(table_name, item_id, position_to_save)
+        return jsonify(status='success')
+    db = _get_db_connection()
     query = f"UPDATE `{table_name}` SET resume_position = %s, last_played = NOW() WHERE id = %s"
     db.put_data(query, (position_to_save, item_id))
+    recent_playback.record(db, table_name, item_id, position_to_save)
     return jsonify(status='success')
 
 def clear_resume_position(table_name, item_id):
-    db = _get_db_connection()
-    query = f"UPDATE `{table_name}` SET resume_position = 0 WHERE id = %s"
-    db.put_data(query, (item_id,))
+    # Written through at once, buffered or not; see resume_buffer.py
+    RESUME_BUFFER.clear(_get_db_connection(), table_name, item_id)
+    return jsonify(status='success')
+
+def stream_stats():
+    # Counters of this worker process only
+    return jsonify(dict(bandwidth.SCHEDULER.stats(), block_cache=block_cache.BLOCK_CACHE.stats()))
+
+def refresh_schema_cache():
+    # The stamp reaches the caches of every worker; this one refreshes now
+    bump_catalog_version()
+    SCHEMA_CACHE.invalidate()
+    STREAM_ITEMS.invalidate()
+    PLAYLISTS.invalidate()
     return jsonify(status='success')
 
+def search_stats():
+    return jsonify(SEARCH_INDEX.stats())
+
+def render_metrics():
+    # Totals of every process writing to METRICS_DIR; see metrics.py
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 def render_index_page():
     db = _get_db_connection()
-    all_tables_raw = db.get_data("SHOW TABLES")
+    all_tables_raw = db.get_table_names()
 
     # --- START OF CATEGORY FIX ---
     # Ensure config.table_list is passed to the template for the category selection logic
     if not all_tables_raw:
         return render_template('index.html', categories=[], resume_items=[], table_list=config.table_list)
 
-    all_tables = [list(t.values())[0] for t in all_tables_raw]
+    all_tables = list(all_tables_raw)
     categories = [t for t in all_tables if t in [row[1] for row in config.table_list]]
     categories.sort()
 
     resume_items = get_resume_items()
+    # Picks up a catalog change before the search box is used
+    SEARCH_INDEX.refresh()
 
     # Pass the table_list to the template
     return render_template('index.html', categories=categories, resume_items=resume_items, table_list=config.table_list)
     # --- END OF CATEGORY FIX ---
 
+def _directory_index_names(db, table_name, kind):
+    """
+    Returns the folder or album names of a table from the directory index the
+    sync scripts maintain, or None if the index has not been built for it.
+    """
+    if DIRECTORY_TABLE not in db.get_table_names():
+        return None
+    query = f"SELECT name FROM `{DIRECTORY_TABLE}` WHERE table_name = %s AND kind = %s ORDER BY name ASC"
+    results = db.get_data(query, (table_name, kind))
+    return [row['name'] for row in results] if results else None
+
 def get_folders_for_table(table_name):
     db = _get_db_connection()
-    query = f"SELECT DISTINCT SUBSTRING_INDEX(SUBSTRING_INDEX(file_path, '/', 6), '/', -1) AS folder FROM `{table_name}`"
+    folders = _directory_index_names(db, table_name, 'folder')
+    if folders is not None:
+        return jsonify(folders)
+    if db.get_table_features(table_name)['folder']:
+        # Indexed column filled by the sync scripts / migrate_catalog.py
+        query = f"SELECT DISTINCT folder FROM `{table_name}` WHERE folder <> ''"
+    else:
+        query = f"SELECT DISTINCT SUBSTRING_INDEX(SUBSTRING_INDEX(file_path, '/', 6), '/', -1) AS folder FROM `{table_name}`"
     results = db.get_data(query)
     folders = [row['folder'] for row in results if row['folder']]
     folders.sort()
@@ -113,12 +174,19 @@ def get_folders_for_table(table_name):
 
 def get_videos_for_folder(table_name, folder):
     db = _get_db_connection()
-    query = f"SELECT id, title, file_path, resume_position FROM `{table_name}` WHERE file_path LIKE %s ORDER BY title ASC"
-    videos = db.get_data(query, (f'%/{folder}/%',))
-    return jsonify(videos)
+    if db.get_table_features(table_name)['folder']:
+        query = f"SELECT id, title, file_path, resume_position FROM `{table_name}` WHERE folder = %s ORDER BY title ASC"
+        videos = db.get_data(query, (folder,))
+    else:
+        query = f"SELECT id, title, file_path, resume_position FROM `{table_name}` WHERE file_path LIKE %s ORDER BY title ASC"
+        videos = db.get_data(query, (f'%/{folder}/%',))
+    return jsonify(_overlay_resume(table_name, videos))
 
 def get_albums_for_table(table_name):
     db = _get_db_connection()
+    albums = _directory_index_names(db, table_name, 'album')
+    if albums is not None:
+        return jsonify(albums)
     #query = f"SELECT DISTINCT album FROM `{table_name}` WHERE album IS NOT NULL ORDER BY album ASC"
     query = f"SELECT DISTINCT album FROM `{table_name}` ORDER BY album ASC"
     results = db.get_data(query)
@@ -127,100 +195,201 @@ def get_albums_for_table(table_name):
 
 def get_tracks_for_album(table_name, album):
     db = _get_db_connection()
-    columns = db.get_field_names(table_name)
+    features = db.get_table_features(table_name)
     # FIX: Only order by track_number if the column exists in the table.
-    order_by_clause = "track_number, title ASC" if 'track_number' in columns else "title ASC"
+    order_by_clause = "track_number, title ASC" if features['track_number'] else "title ASC"
     query = f"SELECT id, title, resume_position FROM `{table_name}` WHERE album = %s ORDER BY {order_by_clause}"
     tracks = db.get_data(query, (album,))
-    return jsonify(tracks)
+    return jsonify(_overlay_resume(table_name, tracks))
+
+def search_catalog(query, limit=None, category=None):
+    query = (query or '').strip()
+    if not query:
+        return jsonify(items=[])
+    try:
+        limit = int(limit) if limit else None
+    except ValueError:
+        limit = None
+    tables = {category} if category else None
+    items = SEARCH_INDEX.search(query, limit, tables)
+    if items is None:
+        return jsonify(items=[], error='The search index is not ready yet.'), 503
+
+    # Resume positions change while playing, so they are read fresh for the
+    # few matches rather than kept in the index
+    db = _get_db_connection()
+    by_table = {}
+    for item in items:
+        by_table.setdefault(item['category'], []).append(item)
+    for table_name, rows in by_table.items():
+        if not db.get_table_features(table_name)['resume_position']:
+            continue
+        placeholders = ', '.join(['%s'] * len(rows))
+        positions_query = f"SELECT id, resume_position FROM `{table_name}` WHERE id IN ({placeholders})"
+        results = db.get_data(positions_query, [row['id'] for row in rows])
+        positions = {row['id']: row['resume_position'] for row in results}
+        for row in rows:
+            row['resume_position'] = positions.get(row['id'])
+        _overlay_resume(table_name, rows)
+    return jsonify(items=items)
 
 def render_player_page(table_name, item_id):
     current_item = _get_item_details(table_name, item_id)
     if not current_item:
         return "Media item not found", 404
 
-    db = _get_db_connection()
-    playlist, current_track_index = [], -1
-    columns = db.get_field_names(table_name) # Get column names for conditional ordering
-
-    # Logic to build playlist based on media type
-    if 'album' in current_item and current_item['album'] is not None:
-        # FIX: Only order by track_number if the column exists in the table.
-        order_by_clause = "track_number, title ASC" if 'track_number' in columns else "title ASC"
-        query = f"SELECT id, title FROM `{table_name}` WHERE album = %s ORDER BY {order_by_clause}"
-        playlist = db.get_data(query, (current_item['album'],))
-    elif 'file_path' in current_item:
-        folder = os.path.basename(os.path.dirname(current_item['file_path']))
-        query = f"SELECT id, title, file_path FROM `{table_name}` WHERE file_path LIKE %s ORDER BY title ASC"
-        playlist = db.get_data(query, (f'%/{folder}/%',))
-
-    if playlist:
-        for i, track in enumerate(playlist):
-            if track['id'] == item_id:
-                current_track_index = i
-                break
+    # Cached album/folder playlist; only a window around this item is sent
+    view = PLAYLISTS.view(_get_db_connection(), table_name, current_item)
+
+    # Warm the start of the next item and of the Random button's pick
+    prefetch.PREFETCHER.request(view.next_path, view.random_path)
 
     file_path = current_item.get('file_path', '')
-    is_audio = file_path.endswith(('.mp3', '.m4a', '.wav', '.flac'))
+    # MIME type and duration come from the sync probe when it has run
+    mime_type = media_stream.item_mime_type(current_item)
+    if current_item.get('mime_type'):
+        is_audio = mime_type.startswith('audio/')
+    else:
+        is_audio = file_path.endswith(media_stream.AUDIO_EXTENSIONS)
 
     return render_template('player.html',
                            item=current_item,
                            category=table_name,
-                           playlist=playlist,
-                           current_track_index=current_track_index,
-                           is_audio=is_audio)
+                           playlist=view.entries,
+                           playlist_offset=view.offset,
+                           playlist_total=view.total,
+                           current_track_index=view.index,
+                           prev_id=view.prev_id,
+                           next_id=view.next_id,
+                           random_id=view.random_id,
+                           is_audio=is_audio,
+                           stream_url=(media_stream.stream_url(table_name, item_id)
+                                       or url_for('stream', table_name=table_name, item_id=item_id)),
+                           source_type=media_stream.player_source_type(mime_type),
+                           duration=float(current_item.get('duration') or 0))
+
+def _read_chunks(file, start, length, close=True, shaper=None):
+    """
+    Reads a range through the shared block cache when it is enabled, else
+    straight from the file.
+    """
+    if block_cache.BLOCK_CACHE.enabled:
+        return block_cache.BLOCK_CACHE.read_chunks(file, start, length, close=close, shaper=shaper)
+    return media_stream.read_chunks(file, start, length, close=close, shaper=shaper)
+
+def _paced_chunks(file, start, length, bitrate, table_name):
+    """
+    _read_chunks() paced by a bandwidth shaper for the response.
+    """
+    shaper = bandwidth.SCHEDULER.open(bitrate)
+    sent = 0
+    try:
+        for data in _read_chunks(file, start, length, shaper=shaper):
+            sent += len(data)
+            yield data
+    finally:
+        shaper.close()
+        metrics.STREAM_BYTES.inc(sent, server='app', category=table_name)
+
+def _file_response(path, start, length, status, mime_type, bitrate=None, table_name=None):
+    """
+    Builds a response carrying `length` bytes of `path` from `start`. When the
+    server offers wsgi.file_wrapper (gunicorn does) and neither a bandwidth
+    limit for this stream nor the block cache is enabled, the open file is handed over as-is
+    so the kernel can sendfile() it; otherwise it is read in paced chunks.
+    """
+    file = open(path, 'rb')
+    prefetch.advise_sequential(file, start, length)
+    handed_over = (media_stream.STREAM_MODE == 'auto' and not bandwidth.SCHEDULER.paces(bitrate)
+                   and not block_cache.BLOCK_CACHE.enabled and 'wsgi.file_wrapper' in request.environ)
+    if handed_over:
+        # PEP 3333 servers stop at Content-Length, so only the range is sent
+        file.seek(start)
+        body = wrap_file(request.environ, file, media_stream.STREAM_CHUNK_SIZE)
+        bandwidth.SCHEDULER.record_sendfile(length)
+    else:
+        body = stream_with_context(_paced_chunks(file, start, length, bitrate, table_name))
+    resp = Response(body, status, mimetype=mime_type, direct_passthrough=True)
+    resp.headers['Content-Length'] = str(length)
+    if handed_over:
+        # The server does not report how much of the file it sent, so the
+        # whole range is counted once the response is closed
+        resp.call_on_close(lambda: metrics.STREAM_BYTES.inc(length, server='app', category=table_name))
+    return resp
+
+def _multipart_response(path, ranges, file_size, mime_type, bitrate=None, table_name=None):
+    """
+    Builds a multipart/byteranges response for a request with several ranges.
+    """
+    boundary = http_range.new_boundary()
+    parts, trailer, total = http_range.multipart_layout(ranges, file_size, mime_type, boundary)
+
+    def generate_parts():
+        shaper = bandwidth.SCHEDULER.open(bitrate)
+        sent = 0
+        try:
+            with open(path, 'rb') as file:
+                for header, start, length in parts:
+                    yield header
+                    prefetch.advise_sequential(file, start, length)
+                    for data in _read_chunks(file, start, length, close=False, shaper=shaper):
+                        sent += len(data)
+                        yield data
+                yield trailer
+        finally:
+            shaper.close()
+            metrics.STREAM_BYTES.inc(sent, server='app', category=table_name)
+
+    resp = Response(stream_with_context(generate_parts()), 206,
+                    mimetype=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
+    resp.headers['Content-Length'] = str(total)
+    return resp
 
 def stream_with_range_support(table_name, item_id):
-    item = _get_item_details(table_name, item_id)
-    if not (item and item.get('file_path')):
-        return "File path not found", 404
-    path = item['file_path']
-    if not os.path.exists(path):
+    try:
+        item = STREAM_ITEMS.get(table_name, item_id)
+    except OSError:
         return "File on disk not found", 404
-    file_size = os.path.getsize(path)
-    range_header = request.headers.get('Range', None)
-
-    file_extension = os.path.splitext(path)[1].lower()
-    if file_extension in ['.mp3', '.m4a', '.wav', '.flac']:
-        mime_type = 'audio/mpeg'
-    elif file_extension in ['.mp4', '.mkv', '.avi', '.mov']:
-        mime_type = 'video/mp4'
-    else:
-        mime_type = 'application/octet-stream'
-
-    def generate_chunks(file, start, length):
-        with file:
-            file.seek(start)
-            remaining = length
-            while remaining > 0:
-                chunk_size = min(remaining, 1024 * 1024)
-                data = file.read(chunk_size)
-                if not data: break
-                yield data
-                remaining -= len(data)
-
-    if range_header:
-        byte1, byte2 = 0, None
-        m = re.search(r'(\d+)-(\d*)', range_header)
-        g = m.groups()
-        if g[0]: byte1 = int(g[0])
-        if g[1]: byte2 = int(g[1])
-        if byte2 is None: byte2 = file_size - 1
-        length = byte2 - byte1 + 1
-        resp = Response(
-            stream_with_context(generate_chunks(open(path, 'rb'), byte1, length)),
-            206,
-            mimetype=mime_type,
-            direct_passthrough=True
-        )
-        resp.headers.add('Content-Range', f'bytes {byte1}-{byte2}/{file_size}')
+    if item is None:
+        return "File path not found", 404
+    path, mime_type, st, bitrate = item
+
+    # Let the front proxy send the file (and handle Range) when configured
+    offload = media_stream.offload_headers(path)
+    if offload:
+        return Response(b'', 200, mimetype=mime_type, headers=offload)
+
+    file_size = st.st_size
+    etag = http_range.make_etag(st)
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_range.http_date(st.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+    if media_stream.STREAM_CACHE_CONTROL:
+        validators['Cache-Control'] = media_stream.STREAM_CACHE_CONTROL
+
+    decision = http_range.evaluate(request.method, request.headers, file_size, st.st_mtime, etag)
+
+    if decision.status in (304, 412):
+        return Response(status=decision.status, headers=validators)
+    if decision.status == 416:
+        resp = Response(status=416, headers=validators)
+        resp.headers['Content-Range'] = f'bytes */{file_size}'
         return resp
+    if decision.is_multipart:
+        resp = _multipart_response(path, decision.ranges, file_size, mime_type, bitrate, table_name)
+    elif decision.status == 206:
+        start, end = decision.ranges[0]
+        resp = _file_response(path, start, end - start + 1, 206, mime_type, bitrate, table_name)
+        resp.headers['Content-Range'] = http_range.content_range(start, end, file_size)
     else:
-        resp = Response(
-            stream_with_context(generate_chunks(open(path, 'rb'), 0, file_size)),
-            200,
-            mimetype=mime_type,
-            direct_passthrough=True
-        )
-        resp.headers.add('Content-Length', file_size)
-        return resp
+        resp = _file_response(path, 0, file_size, 200, mime_type, bitrate, table_name)
+    resp.headers.extend(validators)
+    metrics.STREAMS_ACTIVE.inc(server='app')
+
+    def stream_finished():
+        metrics.STREAMS_ACTIVE.dec(server='app')
+    resp.call_on_close(stream_finished)
+    return resp
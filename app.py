@@ -7,8 +7,12 @@
 
 from flask import Flask, render_template, request, url_for
 import OV
+import metrics
+import query_trace
 
 app = Flask(__name__, static_folder='static')
+metrics.instrument(app)
+query_trace.instrument(app)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -48,5 +52,25 @@ def player(table_name, item_id):
 def stream(table_name, item_id):
     return OV.stream_with_range_support(table_name, item_id)
 
+@app.route('/search', methods=['GET'])
+def search():
+    return OV.search_catalog(request.args.get('q'), request.args.get('limit'), request.args.get('category'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_page():
+    return OV.render_metrics()
+
+@app.route('/admin/stream_stats', methods=['GET'])
+def stream_stats():
+    return OV.stream_stats()
+
+@app.route('/admin/refresh_schema', methods=['POST'])
+def refresh_schema():
+    return OV.refresh_schema_cache()
+
+@app.route('/admin/search_stats', methods=['GET'])
+def search_stats():
+    return OV.search_stats()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   bandwidth.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Bandwidth shaping for media streams. Every stream gets a token bucket.
+#  Its rate is the smaller of the per-client limit and the item's own
+#  bitrate times STREAM_BITRATE_FACTOR, and the global limit is divided
+#  among the active streams max-min fairly: streams that need less than an
+#  equal share keep their rate and the rest is split evenly between the
+#  others. The bucket tells the sender how long to wait before each chunk;
+#  it does not sleep itself, so the Flask generators (time.sleep) and
+#  stream_server.py (asyncio.sleep) share it. Chunk sizes follow each
+#  stream's rate or measured throughput.
+#
+#  The split above only sees the streams of one process. So that the global
+#  limit holds for the gunicorn workers and stream_server.py together,
+#  every chunk is also reserved from one token bucket kept in
+#  STREAM_RATE_STATE_FILE, a small private file (see private_files.py)
+#  mapped into each process.
+
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import config
+from private_files import RUNTIME_DIR, open_private
+
+# Bytes per second for all streams together; 0 = unlimited
+STREAM_RATE_LIMIT = getattr(config, 'STREAM_RATE_LIMIT', 0)
+
+# Where the processes keep the shared bucket of STREAM_RATE_LIMIT; '' makes
+# the limit apply to each process separately
+STREAM_RATE_STATE_FILE = getattr(config, 'STREAM_RATE_STATE_FILE', os.path.join(RUNTIME_DIR, 'bandwidth'))
+
+# Bytes per second for a single stream; 0 = unlimited
+STREAM_CLIENT_RATE_LIMIT = getattr(config, 'STREAM_CLIENT_RATE_LIMIT', 0)
+
+# A stream whose bitrate is known is capped at bitrate * factor, enough to
+# stay ahead of playback without pre-buffering the whole file. Opt-in (0 =
+# off): a capped stream is paced in Python and holds its worker throughout,
+# where an unlimited one goes out via sendfile
+STREAM_BITRATE_FACTOR = getattr(config, 'STREAM_BITRATE_FACTOR', 0)
+
+# Seconds of a stream's rate it may send at once (the start-up burst)
+STREAM_BURST_SECONDS = getattr(config, 'STREAM_BURST_SECONDS', 10)
+
+# Chunk sizes adapt between these, aiming at one chunk per CHUNK_INTERVAL
+STREAM_MIN_CHUNK = 64 * 1024
+STREAM_MAX_CHUNK = getattr(config, 'STREAM_MAX_CHUNK', 1024 * 1024)
+CHUNK_INTERVAL = 0.25
+
+
+class TokenBucket:
+    """
+    A token bucket that may go into debt: reserve(n) always succeeds and
+    returns the seconds to wait before sending the n bytes.
+    """
+    def __init__(self, rate, burst_seconds=STREAM_BURST_SECONDS):
+        self.burst_seconds = burst_seconds
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+        self.capacity = rate * self.burst_seconds
+        self.tokens = min(self.tokens, self.capacity)
+
+    def reserve(self, n):
+        self._refill()
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SharedTokenBucket:
+    """
+    A TokenBucket whose state (tokens, stamp) lives in a file mapped into
+    every process that uses it, updated under flock. time.monotonic() is
+    the same clock in all processes of the host.
+    """
+    _STATE = struct.Struct('dd')
+
+    def __init__(self, path, rate, burst_seconds=STREAM_BURST_SECONDS):
+        self.path = path
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self._fd = None
+        self._map = None
+        self._pid = None
+
+    def _open(self):
+        # A forked child shares the parent's open file, and so its lock;
+        # each process opens its own
+        if self._pid == os.getpid():
+            return
+        fd = open_private(self.path)
+        if os.fstat(fd).st_size < self._STATE.size:
+            os.ftruncate(fd, self._STATE.size)
+        self._fd, self._map, self._pid = fd, mmap.mmap(fd, self._STATE.size), os.getpid()
+
+    def reserve(self, n):
+        """
+        Like TokenBucket.reserve(). Callers in one process must not call it
+        concurrently (flock does not exclude threads sharing the file).
+        """
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            tokens, stamp = self._STATE.unpack_from(self._map)
+            now = time.monotonic()
+            if not stamp or stamp > now:
+                # New file, or one left from before a reboot
+                tokens, stamp = self.capacity, now
+            tokens = min(self.capacity, tokens + (now - stamp) * self.rate) - n
+            self._STATE.pack_into(self._map, 0, tokens, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return -tokens / self.rate if tokens < 0 else 0.0
+
+
+class Shaper:
+    """
+    The pacing state of one stream. Get one from StreamScheduler.open() and
+    close() it when the response ends.
+    """
+    def __init__(self, scheduler, cap):
+        self.scheduler = scheduler
+        self.cap = cap             # this stream's own limit in bytes/s, 0 = none
+        self.rate = 0              # effective limit after sharing, 0 = none
+        self.bucket = None
+        self.throughput = None     # EWMA of measured bytes/s
+        self.closed = False
+
+    def _set_rate(self, rate):
+        # Caller holds the scheduler lock
+        self.rate = rate
+        if not rate:
+            self.bucket = None
+        elif self.bucket is None:
+            self.bucket = TokenBucket(rate)
+        else:
+            self.bucket.set_rate(rate)
+
+    def chunk_size(self):
+        """
+        Returns the size of the next chunk: about CHUNK_INTERVAL seconds of
+        the stream's rate, or of its measured throughput when unlimited.
+        """
+        basis = self.rate or self.throughput
+        if not basis:
+            return STREAM_MAX_CHUNK
+        return int(min(STREAM_MAX_CHUNK, max(STREAM_MIN_CHUNK, basis * CHUNK_INTERVAL)))
+
+    def delay(self, n):
+        """
+        Reserves n bytes and returns the seconds to wait before sending them.
+        """
+        scheduler = self.scheduler
+        with scheduler._lock:
+            wait = self.bucket.reserve(n) if self.bucket is not None else 0.0
+            if scheduler.shared_bucket is not None:
+                wait = max(wait, scheduler._reserve_shared(n))
+            scheduler.throttle_seconds += wait
+        return wait
+
+    def sent(self, n, elapsed):
+        """
+        Records n bytes written in `elapsed` seconds (time spent waiting in
+        delay() excluded).
+        """
+        with self.scheduler._lock:
+            self.scheduler.bytes_served += n
+        if elapsed > 0:
+            sample = n / elapsed
+            self.throughput = sample if self.throughput is None else 0.7 * self.throughput + 0.3 * sample
+
+    def close(self):
+        self.scheduler._close(self)
+
+
+class StreamScheduler:
+    """
+    Hands out Shapers and keeps the per-process counters: bytes served,
+    seconds streams spent throttled, and active/total streams.
+    """
+    def __init__(self, global_rate=STREAM_RATE_LIMIT, client_rate=STREAM_CLIENT_RATE_LIMIT,
+                 bitrate_factor=STREAM_BITRATE_FACTOR, state_file=STREAM_RATE_STATE_FILE):
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.bitrate_factor = bitrate_factor
+        self.shared_bucket = SharedTokenBucket(state_file, global_rate) if global_rate and state_file else None
+        self._streams = set()
+        self._lock = threading.Lock()
+        self.bytes_served = 0
+        self.sendfile_bytes = 0
+        self.throttle_seconds = 0.0
+        self.streams_total = 0
+
+    @property
+    def enabled(self):
+        """
+        True when a global or per-client limit is configured, i.e. every body
+        must be paced in Python rather than handed to sendfile in one go.
+        """
+        return bool(self.global_rate or self.client_rate)
+
+    def paces(self, bitrate=None):
+        """
+        True when a stream of this bitrate is limited: by enabled, or by the
+        bitrate cap alone.
+        """
+        return self.enabled or bool(bitrate and self.bitrate_factor)
+
+    def open(self, bitrate=None):
+        """
+        Starts a stream. `bitrate` is the item's bits per second, if known.
+        """
+        cap = self.client_rate
+        if bitrate and self.bitrate_factor:
+            bitrate_cap = bitrate / 8 * self.bitrate_factor
+            cap = min(cap, bitrate_cap) if cap else bitrate_cap
+        shaper = Shaper(self, cap)
+        with self._lock:
+            self._streams.add(shaper)
+            self.streams_total += 1
+            self._rebalance()
+        return shaper
+
+    def _reserve_shared(self, n):
+        # Caller holds the lock
+        try:
+            return self.shared_bucket.reserve(n)
+        except OSError as e:
+            print(f"Warning: shared bandwidth state {self.shared_bucket.path} unusable, "
+                  f"limiting this process on its own: {e}", file=sys.stderr)
+            self.shared_bucket = None
+            return 0.0
+
+    def record_sendfile(self, n):
+        """
+        Counts a body handed to the server's file wrapper unshaped.
+        """
+        with self._lock:
+            self.sendfile_bytes += n
+
+    def _close(self, shaper):
+        with self._lock:
+            if shaper.closed:
+                return
+            shaper.closed = True
+            self._streams.discard(shaper)
+            self._rebalance()
+
+    def _rebalance(self):
+        """
+        Max-min fair split of the global limit. Caller holds the lock.
+        """
+        if not self.global_rate:
+            for shaper in self._streams:
+                shaper._set_rate(shaper.cap)
+            return
+        remaining = self.global_rate
+        streams = sorted(self._streams, key=lambda s: s.cap or float('inf'))
+        for i, shaper in enumerate(streams):
+            share = remaining / (len(streams) - i)
+            rate = min(shaper.cap, share) if shaper.cap else share
+            shaper._set_rate(rate)
+            remaining -= rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams_active': len(self._streams),
+                'streams_total': self.streams_total,
+                'bytes_served': self.bytes_served,
+                'sendfile_bytes': self.sendfile_bytes,
+                'throttle_seconds': round(self.throttle_seconds, 3),
+                'global_rate_limit': self.global_rate,
+                'global_rate_shared': self.shared_bucket is not None,
+                'client_rate_limit': self.client_rate,
+                'stream_rates': sorted((round(s.rate) for s in self._streams), reverse=True),
+            }
+
+
+SCHEDULER = StreamScheduler()
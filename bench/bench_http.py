@@ -0,0 +1,568 @@
+#!/home/al/miniconda3/envs/py/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2025 AL Haines <alfredhaines@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   filename: bench/bench_http.py
+#
+"""
+HTTP load test of the mediaplayer app against a synthetic library.
+
+Creates a scratch MySQL/MariaDB database with a video and an audio table
+of the requested size (see synthetic.py), sparse media files for a subset
+of the items, and serves the real Flask app from app.py on a local port,
+either with werkzeug's threaded server or with gunicorn workers. Client
+threads then run a weighted mix of:
+
+    folders / albums     GET /get_folders, /get_albums
+    folder / album       GET /get_videos/<folder>, /get_tracks/<album>
+    player               GET /player/<table>/<id>
+    resume               POST /update_resume/<table>/<id>
+    search               GET /search?q=<word prefix>
+    seek                 GET /stream with Range: bytes=N-, read --seek-bytes
+                         and drop the connection, as a browser does on seek
+    range                GET /stream with a bounded Range, read in full
+
+Items are picked with an 80/20 skew, the way a real library is played.
+Latency is the time from sending the request to reading the last body
+byte read. Requests made during --warmup are not counted.
+
+The report lists p50/p95/p99 latency, requests per second and bytes per
+second for each kind of request. --save NAME stores the results under
+bench/baselines/NAME.json; --compare NAME prints the change against a saved
+run and exits with status 1 if any p95 got worse by more than --tolerance.
+
+Examples:
+    python3 bench/bench_http.py --items 50000 --clients 16 --duration 60 --save before
+    python3 bench/bench_http.py --reuse --server gunicorn --workers 3 --compare before
+    python3 bench/bench_http.py --reuse --set STREAM_MODE=chunked --mix seek=1
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote, urlencode
+
+import synthetic
+
+DEFAULT_MIX = 'folders=5,folder=15,albums=5,album=10,player=20,resume=15,search=5,seek=20,range=5'
+
+VIDEO_TABLE = 'bench_videos'
+AUDIO_TABLE = 'bench_music'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown request kind '{name}'; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# --- library ---
+
+class Library:
+    """
+    What the clients pick from: table names, folder/album names, the id
+    range of each table and the ids that have media files.
+    """
+    def __init__(self, manifest):
+        self.counts = manifest['counts']
+        self.folders = manifest['folders']
+        self.albums = manifest['albums']
+        self.streamable = manifest['streamable']
+        self.words = manifest['words']
+        self.file_size = manifest['file_size']
+
+    def skewed(self, rng, count):
+        # 80% of picks go to the first 20% of ids
+        hot = max(1, count // 5)
+        if rng.random() < 0.8:
+            return rng.randint(1, hot)
+        return rng.randint(1, count)
+
+    def item(self, rng):
+        table = rng.choice(list(self.counts))
+        return table, self.skewed(rng, self.counts[table])
+
+
+def setup_library(config, args, workdir):
+    """
+    Creates (or with --reuse, checks) the scratch catalog and media files.
+    Returns the manifest describing them.
+    """
+    manifest_path = os.path.join(workdir, 'http_manifest.json')
+    wanted = {'items': args.items, 'audio_items': args.audio_items, 'per_folder': args.per_folder,
+              'stream_files': args.stream_files, 'file_size': args.file_size, 'seed': args.seed,
+              'database': config.mysql_config['database']}
+    if args.reuse and os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get('parameters') == wanted:
+            print("Reusing the synthetic library from the previous run", file=sys.stderr)
+            return manifest
+        print("Library parameters changed; rebuilding it", file=sys.stderr)
+
+    started = time.monotonic()
+    connection = synthetic.connect(config)
+    synthetic.create_tables(connection, config.table_list, config.audio_table_list)
+    paths = {}
+    for (root, table), count, audio in ((config.table_list[0], args.items, False),
+                                         (config.audio_table_list[0], args.audio_items, True)):
+        paths[table] = synthetic.populate(connection, root, table, count, args.per_folder,
+                                          audio=audio, seed=args.seed)
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT DISTINCT folder FROM `{VIDEO_TABLE}`")
+    folders = sorted(row[0] for row in cursor.fetchall())
+    cursor.execute(f"SELECT DISTINCT album FROM `{AUDIO_TABLE}`")
+    albums = sorted(row[0] for row in cursor.fetchall())
+    connection.close()
+
+    # Media files for the first ids of each table, which the skew favours
+    streamable = {}
+    for table, table_paths in paths.items():
+        subset = table_paths[:args.stream_files]
+        synthetic.make_sparse_files(subset, args.file_size)
+        streamable[table] = len(subset)
+
+    rng = random.Random(args.seed)
+    words = sorted({w.lower()[:rng.randint(2, 5)] for p in rng.sample(paths[VIDEO_TABLE], min(500, len(paths[VIDEO_TABLE])))
+                    for w in os.path.basename(p).split()[1:2]})
+    manifest = {
+        'parameters': wanted,
+        'counts': {VIDEO_TABLE: args.items, AUDIO_TABLE: args.audio_items},
+        'folders': folders, 'albums': albums, 'streamable': streamable,
+        'words': words or ['ka'], 'file_size': args.file_size,
+    }
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file)
+    print(f"Built the synthetic library in {time.monotonic() - started:.1f} s", file=sys.stderr)
+    return manifest
+
+
+# --- server ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"The app did not start listening on port {port}")
+
+
+def start_server(args, port):
+    """
+    Serves app.app on 127.0.0.1:port. Returns a function that stops it.
+    """
+    import app
+
+    if args.server == 'gunicorn':
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise SystemExit("gunicorn is not installed; use --server thread")
+
+        class Application(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'127.0.0.1:{port}')
+                self.cfg.set('workers', args.workers)
+                self.cfg.set('threads', args.threads)
+                self.cfg.set('worker_class', 'gthread' if args.threads > 1 else 'sync')
+                self.cfg.set('timeout', 120)
+                self.cfg.set('loglevel', 'warning')
+
+            def load(self):
+                return app.app
+
+        # The workers are forked from here and inherit the benchmark config
+        pid = os.fork()
+        if pid == 0:
+            try:
+                Application().run()
+            finally:
+                os._exit(0)
+        wait_for_port(port)
+
+        def stop():
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        return stop
+
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)   # no per-request lines
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='bench-server', daemon=True)
+    thread.start()
+    wait_for_port(port)
+
+    def stop():
+        server.shutdown()
+    return stop
+
+
+# --- clients ---
+
+class Client:
+    """
+    One simulated user with a keep-alive connection.
+    """
+    def __init__(self, port, library, args, seed):
+        self.port = port
+        self.library = library
+        self.args = args
+        self.rng = random.Random(seed)
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        return self.conn
+
+    def drop(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self, method, path, body=None, headers=None, read_limit=None):
+        """
+        Returns (status, body bytes read). With `read_limit` the rest of the
+        body is abandoned and the connection closed.
+        """
+        headers = dict(headers or {})
+        if body is not None:
+            body = urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            received = 0
+            while True:
+                wanted = 65536 if read_limit is None else min(65536, read_limit - received)
+                if wanted <= 0:
+                    break
+                data = response.read(wanted)
+                if not data:
+                    break
+                received += len(data)
+            if read_limit is not None and not response.isclosed():
+                self.drop()
+            return response.status, received
+        except (OSError, http.client.HTTPException):
+            self.drop()
+            raise
+
+    # Each scenario returns (status, bytes)
+
+    def folders(self):
+        return self.request('GET', f'/get_folders/{VIDEO_TABLE}')
+
+    def folder(self):
+        folder = self.rng.choice(self.library.folders)
+        return self.request('GET', f'/get_videos/{VIDEO_TABLE}/{quote(folder, safe="")}')
+
+    def albums(self):
+        return self.request('GET', f'/get_albums/{AUDIO_TABLE}')
+
+    def album(self):
+        album = self.rng.choice(self.library.albums)
+        return self.request('GET', f'/get_tracks/{AUDIO_TABLE}/{quote(album, safe="")}')
+
+    def player(self):
+        table, item_id = self.library.item(self.rng)
+        return self.request('GET', f'/player/{table}/{item_id}')
+
+    def resume(self):
+        table, item_id = self.library.item(self.rng)
+        duration = 3600.0
+        return self.request('POST', f'/update_resume/{table}/{item_id}',
+                            body={'position': round(self.rng.uniform(0, duration), 1), 'duration': duration})
+
+    def search(self):
+        return self.request('GET', '/search?' + urlencode({'q': self.rng.choice(self.library.words)}))
+
+    def _streamable(self):
+        table = self.rng.choice([t for t, n in self.library.streamable.items() if n])
+        return table, self.library.skewed(self.rng, self.library.streamable[table])
+
+    def seek(self):
+        table, item_id = self._streamable()
+        offset = self.rng.randrange(0, self.library.file_size)
+        return self.request('GET', f'/stream/{table}/{item_id}', headers={'Range': f'bytes={offset}-'},
+                            read_limit=self.args.seek_bytes)
+
+    def range(self):
+        table, item_id = self._streamable()
+        length = self.args.range_bytes
+        offset = self.rng.randrange(0, max(1, self.library.file_size - length))
+        return self.request('GET', f'/stream/{table}/{item_id}',
+                            headers={'Range': f'bytes={offset}-{offset + length - 1}'})
+
+
+SCENARIOS = ('folders', 'folder', 'albums', 'album', 'player', 'resume', 'search', 'seek', 'range')
+
+
+def run_clients(port, library, args, mix):
+    """
+    Runs the clients for warmup + duration seconds and returns
+    {kind: {'latencies': [...], 'bytes': n, 'errors': n}} for the measured part.
+    """
+    results = defaultdict(lambda: {'latencies': [], 'bytes': 0, 'errors': 0})
+    lock = threading.Lock()
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    start = time.monotonic()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+
+    def worker(index):
+        client = Client(port, library, args, f"{args.seed}:{index}")
+        local = defaultdict(lambda: {'latencies': [], 'bytes': 0, 'errors': 0})
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            kind = client.rng.choices(kinds, weights)[0]
+            began = time.perf_counter()
+            try:
+                status, received = getattr(client, kind)()
+                failed = status >= 400
+            except Exception:
+                status, received, failed = None, 0, True
+            elapsed = time.perf_counter() - began
+            if now < measure_from:
+                continue
+            entry = local[kind]
+            entry['latencies'].append(elapsed)
+            entry['bytes'] += received
+            if failed:
+                entry['errors'] += 1
+            if args.think:
+                time.sleep(client.rng.expovariate(1 / args.think))
+        client.drop()
+        with lock:
+            for kind, entry in local.items():
+                target = results[kind]
+                target['latencies'] += entry['latencies']
+                target['bytes'] += entry['bytes']
+                target['errors'] += entry['errors']
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(results)
+
+
+# --- report ---
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, duration):
+    summary = {}
+    total = {'requests': 0, 'errors': 0, 'bytes': 0}
+    for kind in SCENARIOS:
+        entry = results.get(kind)
+        if not entry or not entry['latencies']:
+            continue
+        values = sorted(entry['latencies'])
+        summary[kind] = {
+            'requests': len(values),
+            'errors': entry['errors'],
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'rps': len(values) / duration,
+            'bytes_per_s': entry['bytes'] / duration,
+        }
+        total['requests'] += len(values)
+        total['errors'] += entry['errors']
+        total['bytes'] += entry['bytes']
+    summary['total'] = {'requests': total['requests'], 'errors': total['errors'],
+                        'rps': total['requests'] / duration, 'bytes_per_s': total['bytes'] / duration}
+    return summary
+
+
+def _rate(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f"{value:.1f} {unit}/s"
+        value /= 1024
+
+
+def _change(new, old, lower_is_better=True):
+    if not old:
+        return ''
+    delta = (new - old) / old * 100
+    worse = delta > 0 if lower_is_better else delta < 0
+    colour = 'red' if worse and abs(delta) >= 5 else 'green' if abs(delta) >= 5 else 'dim'
+    return f" [{colour}]({delta:+.0f}%)[/{colour}]"
+
+
+def print_report(summary, baseline=None):
+    from rich.console import Console
+    from rich.table import Table
+    from rich import box
+
+    previous = (baseline or {}).get('summary', {})
+    table = Table(title="HTTP benchmark", box=box.ROUNDED, header_style="bold magenta")
+    for column in ("Request", "Count", "Errors", "p50 ms", "p95 ms", "p99 ms", "Req/s", "Bytes/s"):
+        table.add_column(column, justify="left" if column == "Request" else "right")
+    for kind in SCENARIOS:
+        row = summary.get(kind)
+        if not row:
+            continue
+        old = previous.get(kind, {})
+        table.add_row(
+            kind, str(row['requests']),
+            f"[red]{row['errors']}[/red]" if row['errors'] else "0",
+            f"{row['p50_ms']:.1f}" + _change(row['p50_ms'], old.get('p50_ms')),
+            f"{row['p95_ms']:.1f}" + _change(row['p95_ms'], old.get('p95_ms')),
+            f"{row['p99_ms']:.1f}" + _change(row['p99_ms'], old.get('p99_ms')),
+            f"{row['rps']:.1f}" + _change(row['rps'], old.get('rps'), lower_is_better=False),
+            _rate(row['bytes_per_s']) if row['bytes_per_s'] else "-")
+    total = summary['total']
+    old = previous.get('total', {})
+    table.add_row("[bold]total[/bold]", str(total['requests']), str(total['errors']), "", "", "",
+                  f"{total['rps']:.1f}" + _change(total['rps'], old.get('rps'), lower_is_better=False),
+                  _rate(total['bytes_per_s']))
+    Console().print(table)
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for kind, row in summary.items():
+        old = baseline.get('summary', {}).get(kind)
+        if kind == 'total' or not old or not old.get('p95_ms'):
+            continue
+        if row['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            found.append(f"{kind}: p95 {old['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    library = parser.add_argument_group("synthetic library")
+    library.add_argument('--items', type=int, default=20000, help="Rows in the video table (default: 20000)")
+    library.add_argument('--audio-items', type=int, default=20000, help="Rows in the audio table (default: 20000)")
+    library.add_argument('--per-folder', type=int, default=40,
+                         help="Items per folder/album, the folder fan-out (default: 40)")
+    library.add_argument('--stream-files', type=int, default=200,
+                         help="Sparse media files created per table for /stream (default: 200)")
+    library.add_argument('--file-size', type=int, default=512 * 1024 * 1024,
+                         help="Size of each sparse media file in bytes (default: 512 MiB)")
+    library.add_argument('--workdir', default=os.path.join(synthetic.BENCH_DIR, 'work'),
+                         help="Where the media files and state are kept (default: bench/work)")
+    library.add_argument('--database', default='mediaplayer_bench', help="Scratch database (default: mediaplayer_bench)")
+    library.add_argument('--db-host', help="MySQL host (default: from config.py)")
+    library.add_argument('--db-user', help="MySQL user (default: from config.py)")
+    library.add_argument('--db-password', help="MySQL password (default: from config.py)")
+    library.add_argument('--reuse', action='store_true', help="Keep the library of the previous run if it matches")
+    library.add_argument('--set', action='append', metavar='NAME=VALUE',
+                         help="Override an app setting, e.g. --set DB_POOL_SIZE=10 (repeatable)")
+
+    load = parser.add_argument_group("load")
+    load.add_argument('--server', choices=('thread', 'gunicorn'), default='thread',
+                      help="werkzeug threaded server in this process, or forked gunicorn workers")
+    load.add_argument('--workers', type=int, default=3, help="gunicorn workers (default: 3)")
+    load.add_argument('--threads', type=int, default=1, help="Threads per gunicorn worker (default: 1)")
+    load.add_argument('--clients', type=int, default=16, help="Concurrent clients (default: 16)")
+    load.add_argument('--duration', type=float, default=30, help="Seconds measured (default: 30)")
+    load.add_argument('--warmup', type=float, default=5, help="Seconds run before measuring (default: 5)")
+    load.add_argument('--think', type=float, default=0, help="Mean pause between a client's requests, seconds")
+    load.add_argument('--mix', default=DEFAULT_MIX, help=f"Request weights (default: {DEFAULT_MIX})")
+    load.add_argument('--seek-bytes', type=int, default=2 * 1024 * 1024,
+                      help="Bytes read after a seek before dropping the connection (default: 2 MiB)")
+    load.add_argument('--range-bytes', type=int, default=1024 * 1024,
+                      help="Length of bounded Range requests (default: 1 MiB)")
+    load.add_argument('--seed', type=int, default=1, help="Seed for the library and the clients (default: 1)")
+
+    output = parser.add_argument_group("results")
+    output.add_argument('--save', metavar='NAME', help="Save the results as a baseline")
+    output.add_argument('--compare', metavar='NAME', help="Compare with a saved baseline")
+    output.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed p95 slowdown against the baseline before failing (default: 0.2)")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = os.path.abspath(args.workdir)
+    video_root = os.path.join(workdir, 'media', 'videos')
+    audio_root = os.path.join(workdir, 'media', 'music')
+    overrides = synthetic.parse_overrides(args.set)
+    config = synthetic.install_config(
+        workdir, args.database, [(video_root, VIDEO_TABLE)], [(audio_root, AUDIO_TABLE)],
+        mysql={'host': args.db_host, 'user': args.db_user, 'password': args.db_password},
+        overrides=overrides)
+
+    manifest = setup_library(config, args, workdir)
+    if not manifest['folders'] or not manifest['albums']:
+        raise SystemExit("The synthetic library is empty")
+    port = free_port()
+    stop = start_server(args, port)
+    try:
+        print(f"Running {args.clients} clients for {args.warmup:g} + {args.duration:g} s "
+              f"against {args.server} server", file=sys.stderr)
+        results = run_clients(port, Library(manifest), args, mix)
+    finally:
+        stop()
+
+    summary = summarize(results, args.duration)
+    baseline = None
+    if args.compare:
+        baseline = synthetic.load_baseline(args.compare)
+        if baseline.get('parameters') != manifest['parameters']:
+            print("Warning: the baseline was recorded with a different library", file=sys.stderr)
+    print_report(summary, baseline)
+
+    if args.save:
+        record = {
+            'saved': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'parameters': manifest['parameters'],
+            'load': {k: getattr(args, k) for k in ('server', 'workers', 'threads', 'clients', 'duration',
+                                                   'warmup', 'think', 'mix', 'seek_bytes', 'range_bytes')},
+            'settings': overrides,
+            'summary': summary,
+        }
+        print(f"Saved baseline {synthetic.save_baseline(args.save, record)}", file=sys.stderr)
+
+    if baseline is not None:
+        found = regressions(summary, baseline, args.tolerance)
+        if found:
+            print("Regressions beyond tolerance:\n  " + "\n  ".join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
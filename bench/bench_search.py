@@ -0,0 +1,215 @@
+#!/home/al/miniconda3/envs/py/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2025 AL Haines <alfredhaines@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   filename: bench/bench_search.py
+#
+"""
+Benchmark of the /search index (search_index.py) on a synthetic library.
+
+Builds the index in process, without a database, from --items video and
+--audio-items audio rows laid out as synthetic.py lays out the libraries of
+the other benchmarks: titles, folders, and for audio albums and artists,
+all made from the same syllable list. Every syllable is therefore a very
+common word prefix, the worst case for a trigram index. Then each kind of
+query runs --repeat times:
+
+    prefix2     one two-letter prefix, e.g. "ka" (tens of thousands of hits)
+    prefix3     one three-letter prefix, e.g. "sho"
+    word        a whole word, e.g. "kalo"
+    two         two short prefixes, e.g. "an is"
+    three       three short prefixes, e.g. "tri el ju"
+    miss        prefixes that match nothing
+
+The report lists p50/p95/max latency per kind, plus the build time and the
+posting list sizes. --save and --compare work as in bench_http.py and
+compare p95.
+
+Examples:
+    python3 bench/bench_search.py --items 100000 --audio-items 100000 --save search-before
+    python3 bench/bench_search.py --items 100000 --audio-items 100000 --compare search-before
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import synthetic
+
+KINDS = ('prefix2', 'prefix3', 'word', 'two', 'three', 'miss')
+
+
+def synthetic_rows(count, per_folder, audio, seed):
+    """
+    Yields (title, album, artist, folder) like the rows populate() writes.
+    """
+    rng = random.Random(f"{seed}:{'audio' if audio else 'video'}")
+    extensions = ('.mp3',) if audio else ('.mp4',)
+    artists = [synthetic.phrase(rng, (1, 2)) for _ in range(max(1, count // (per_folder * 4)))]
+    album = artist = None
+    for file_path, folder_title in synthetic.library_paths('/media', count, per_folder, extensions, rng):
+        title = os.path.splitext(os.path.basename(file_path))[0]
+        if not audio:
+            yield title, '', '', folder_title
+            continue
+        if album != folder_title:
+            album, artist = folder_title, rng.choice(artists)
+        yield title, album, artist, folder_title
+
+
+def queries(rng, count):
+    """
+    Returns {kind: [query, ...]}.
+    """
+    short = [s for s in synthetic.SYLLABLES if len(s) == 2]
+    long = [s for s in synthetic.SYLLABLES if len(s) == 3]
+    return {
+        'prefix2': [rng.choice(short) for _ in range(count)],
+        'prefix3': [rng.choice(long) for _ in range(count)],
+        'word': [synthetic.word(rng) for _ in range(count)],
+        'two': [f"{rng.choice(short)} {rng.choice(short)}" for _ in range(count)],
+        'three': [' '.join(rng.choice(short + long) for _ in range(3)) for _ in range(count)],
+        'miss': [rng.choice(short) + 'xq' for _ in range(count)],
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_queries(index, workload, limit):
+    summary = {}
+    for kind in KINDS:
+        latencies, hits = [], 0
+        for query in workload[kind]:
+            started = time.perf_counter()
+            hits += len(index.search(query, limit))
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        summary[kind] = {
+            'queries': len(latencies),
+            'hits': hits / len(latencies),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'max_ms': latencies[-1] * 1000,
+        }
+    return summary
+
+
+def _change(new, old):
+    if not old:
+        return ''
+    delta = (new - old) / old * 100
+    colour = 'red' if delta >= 5 else 'green' if delta <= -5 else 'dim'
+    return f" [{colour}]({delta:+.0f}%)[/{colour}]"
+
+
+def print_report(summary, baseline=None):
+    from rich.console import Console
+    from rich.table import Table
+    from rich import box
+
+    previous = (baseline or {}).get('summary', {})
+    table = Table(title="Search benchmark", box=box.ROUNDED, header_style="bold magenta")
+    for column in ("Query", "Count", "Hits", "p50 ms", "p95 ms", "max ms"):
+        table.add_column(column, justify="left" if column == "Query" else "right")
+    for kind in KINDS:
+        row, old = summary[kind], previous.get(kind, {})
+        table.add_row(kind, str(row['queries']), f"{row['hits']:.0f}",
+                      f"{row['p50_ms']:.2f}" + _change(row['p50_ms'], old.get('p50_ms')),
+                      f"{row['p95_ms']:.2f}" + _change(row['p95_ms'], old.get('p95_ms')),
+                      f"{row['max_ms']:.2f}")
+    Console().print(table)
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for kind, row in summary.items():
+        old = baseline.get('summary', {}).get(kind)
+        if old and old.get('p95_ms') and row['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            found.append(f"{kind}: p95 {old['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    library = parser.add_argument_group("synthetic library")
+    library.add_argument('--items', type=int, default=100000, help="Video rows (default: 100000)")
+    library.add_argument('--audio-items', type=int, default=100000, help="Audio rows (default: 100000)")
+    library.add_argument('--per-folder', type=int, default=40, help="Files per folder/album (default: 40)")
+    library.add_argument('--seed', type=int, default=1, help="Seed for the library and the queries (default: 1)")
+    library.add_argument('--workdir', default=os.path.join(synthetic.BENCH_DIR, 'work'),
+                         help="Where state files are kept (default: bench/work)")
+    library.add_argument('--set', action='append', metavar='NAME=VALUE',
+                         help="Override a setting, e.g. --set SEARCH_LIMIT=100 (repeatable)")
+
+    run = parser.add_argument_group("queries")
+    run.add_argument('--repeat', type=int, default=200, help="Queries of each kind (default: 200)")
+    run.add_argument('--limit', type=int, help="Results per query (default: SEARCH_LIMIT)")
+
+    output = parser.add_argument_group("results")
+    output.add_argument('--save', metavar='NAME', help="Save the results as a baseline")
+    output.add_argument('--compare', metavar='NAME', help="Compare with a saved baseline")
+    output.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed p95 slowdown against the baseline before failing (default: 0.2)")
+    args = parser.parse_args()
+
+    overrides = synthetic.parse_overrides(args.set)
+    synthetic.install_config(os.path.abspath(args.workdir), None,
+                             [('/media', 'bench_videos')], [('/media', 'bench_music')],
+                             overrides=overrides, require_mysql=False)
+    import search_index
+
+    started = time.perf_counter()
+    index = search_index._Index()
+    for table_index, (table_name, count, audio) in enumerate((('bench_videos', args.items, False),
+                                                              ('bench_music', args.audio_items, True))):
+        index.tables.append(table_name)
+        for item_id, values in enumerate(synthetic_rows(count, args.per_folder, audio, args.seed), 1):
+            index.add(table_index, item_id, values)
+    index.finish()
+    build_seconds = time.perf_counter() - started
+    sizes = sorted((len(posting) for posting in index.postings.values()), reverse=True)
+    print(f"Indexed {len(index.doc_id)} items in {build_seconds:.1f} s; {len(sizes)} trigrams, "
+          f"longest posting list {sizes[0] if sizes else 0}", file=sys.stderr)
+
+    limit = args.limit or search_index.SEARCH_LIMIT
+    summary = run_queries(index, queries(random.Random(args.seed), args.repeat), limit)
+
+    baseline = synthetic.load_baseline(args.compare) if args.compare else None
+    parameters = {'items': args.items, 'audio_items': args.audio_items, 'per_folder': args.per_folder,
+                  'seed': args.seed, 'limit': limit}
+    if baseline is not None and baseline.get('parameters') != parameters:
+        print("Warning: the baseline was recorded with a different library", file=sys.stderr)
+    print_report(summary, baseline)
+
+    if args.save:
+        path = synthetic.save_baseline(args.save, {
+            'saved': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'parameters': parameters,
+            'settings': overrides,
+            'build_seconds': build_seconds,
+            'summary': summary,
+        })
+        print(f"Saved baseline {path}", file=sys.stderr)
+
+    if baseline is not None:
+        found = regressions(summary, baseline, args.tolerance)
+        if found:
+            print("Regressions beyond tolerance:\n  " + "\n  ".join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+#!/home/al/miniconda3/envs/py/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2025 AL Haines <alfredhaines@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   filename: bench/bench_sync.py
+#
+"""
+Benchmark of sync_media.py and read_audio_to_mysql.py on a synthetic tree.
+
+Builds a video tree and an audio tree of stub files (see synthetic.py):
+--depth levels of --fan-out directories each, with --files-per-dir files in
+every leaf directory. The extensions are drawn from --video-ext and
+--audio-ext, with a --junk share of non-media files that must be skipped.
+Audio stubs are tagged MP3 frames, so the importer reads real tags. Use a
+tmpfs path such as /dev/shm/synctree for --root to take the disk out of the
+numbers, or a local disk to include it. With the defaults each tree holds
+20 000 files. Use --depth 3 --fan-out 50 --files-per-dir 8 for a million.
+
+Both scripts then run against a scratch database in three phases:
+
+    cold    empty tables, no scan snapshots and no metadata cache
+    warm    the same tree again, nothing changed
+    delta   after --delta of the files were added, deleted or renamed
+
+For each phase the time spent in each stage is reported:
+
+    scan    walking the tree and saving scan snapshots
+    diff    reading the paths already in the table and comparing them
+    write   inserts, deletes and directory index updates
+    probe   the sync_media.py probe stage (only with --probe)
+    other   everything else; for the audio importer this is mostly time
+            spent waiting for the tag-reading processes
+
+Stage times are exclusive: a write made inside a diff step counts as write.
+The row count of each table is checked against the files on disk after
+every phase. read_audio_to_mysql.py only inserts, so renamed and deleted
+files stay in its table. --save and --compare work as in bench_http.py and
+compare the total time of each phase.
+
+Examples:
+    python3 bench/bench_sync.py --root /dev/shm/synctree --save sync-before
+    python3 bench/bench_sync.py --root /dev/shm/synctree --reuse-tree --compare sync-before
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import synthetic
+
+VIDEO_TABLE = 'bench_sync_videos'
+AUDIO_TABLE = 'bench_sync_music'
+
+STAGES = ('scan', 'diff', 'write', 'probe', 'other')
+PHASES = ('cold', 'warm', 'delta')
+
+
+class StageTimer:
+    """
+    Attributes the time spent in patched functions to stages. Times are
+    exclusive: a patched call made inside another counts only towards its
+    own stage.
+    """
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._local = threading.local()
+        self._patched = []
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def timed(self, stage, function):
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = stack.pop()
+                self.totals[stage] += elapsed - children
+                if stack:
+                    stack[-1] += elapsed
+        return wrapper
+
+    def timed_iter(self, stage, function):
+        # Only the time spent producing items counts, not the consumer's
+        def wrapper(*args, **kwargs):
+            iterator = iter(function(*args, **kwargs))
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - started
+                    self.totals[stage] += elapsed
+                    stack = self._stack()
+                    if stack:
+                        stack[-1] += elapsed
+                yield item
+        return wrapper
+
+    def patch(self, owner, name, stage, iterator=False):
+        original = getattr(owner, name)
+        self._patched.append((owner, name, original))
+        setattr(owner, name, (self.timed_iter if iterator else self.timed)(stage, original))
+
+    def restore(self):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched.clear()
+
+
+class Trees:
+    """
+    The video and audio trees, with their media file counts kept up to date
+    as the delta changes them.
+    """
+    def __init__(self, args):
+        self.root = os.path.abspath(args.root)
+        shape = (args.depth, args.fan_out, args.files_per_dir)
+        self.video = synthetic.MediaTree(os.path.join(self.root, 'videos'), *shape,
+                                         synthetic.parse_mix(args.video_ext), junk=args.junk, seed=args.seed)
+        self.audio = synthetic.MediaTree(os.path.join(self.root, 'music'), *shape,
+                                         synthetic.parse_mix(args.audio_ext), audio=True, junk=args.junk,
+                                         seed=args.seed)
+        self.parameters = {'depth': args.depth, 'fan_out': args.fan_out, 'files_per_dir': args.files_per_dir,
+                           'video_ext': args.video_ext, 'audio_ext': args.audio_ext, 'junk': args.junk,
+                           'seed': args.seed}
+        self.manifest_path = os.path.join(self.root, 'tree.json')
+        self.media = {}
+
+    def prepare(self, reuse):
+        """
+        Builds the trees, or keeps them when --reuse-tree is given and an
+        unmodified tree with the same parameters exists.
+        """
+        if reuse and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+            if manifest.get('parameters') == self.parameters and not manifest.get('modified'):
+                self.media = manifest['media']
+                print(f"Reusing the tree in {self.root}", file=sys.stderr)
+                return 0.0
+            print("The tree was changed or has other parameters; rebuilding it", file=sys.stderr)
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        started = time.monotonic()
+        for name, tree in (('video', self.video), ('audio', self.audio)):
+            print(f"Building the {name} tree ({tree.leaf_count * tree.files_per_dir} files)...", file=sys.stderr)
+            self.media[name] = tree.build(
+                lambda done, total: print(f"  {done}/{total} directories", file=sys.stderr))
+        self._save_manifest(modified=False)
+        return time.monotonic() - started
+
+    def _save_manifest(self, modified):
+        with open(self.manifest_path, 'w') as file:
+            json.dump({'parameters': self.parameters, 'media': self.media, 'modified': modified}, file)
+
+    def apply_delta(self, fraction, seed):
+        """
+        Adds, deletes and renames about `fraction` of the media files of each
+        tree, in equal parts. Returns {tree: (added, deleted, renamed)}.
+        """
+        self._save_manifest(modified=True)
+        changes = {}
+        for name, tree in (('video', self.video), ('audio', self.audio)):
+            rng = random.Random(f"{seed}:delta:{name}")
+            count = max(3, round(self.media[name] * fraction))
+            done = {'add': 0, 'delete': 0, 'rename': 0}
+            for i in range(count):
+                operation = ('add', 'delete', 'rename')[i % 3]
+                directory, names = tree.leaf(rng.randrange(tree.leaf_count))
+                media = sorted(n for n in os.listdir(directory) if tree.is_media(n))
+                if operation == 'add':
+                    number = 900 + len(os.listdir(directory))
+                    file_name = f"{number:03d} {synthetic.phrase(rng)}{rng.choices(tree.extensions, tree.weights)[0]}"
+                    tree.write_file(os.path.join(directory, file_name), names, number)
+                elif not media:
+                    continue
+                elif operation == 'delete':
+                    os.unlink(os.path.join(directory, rng.choice(media)))
+                else:
+                    old = rng.choice(media)
+                    new = f"{old[:4]}{synthetic.phrase(rng)}{os.path.splitext(old)[1]}"
+                    if new in media:
+                        continue
+                    os.rename(os.path.join(directory, old), os.path.join(directory, new))
+                done[operation] += 1
+            self.media[name] += done['add'] - done['delete']
+            changes[name] = (done['add'], done['delete'], done['rename'])
+        self._save_manifest(modified=True)
+        return changes
+
+
+def drop_page_cache():
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as file:
+            file.write('3\n')
+        return True
+    except OSError as e:
+        print(f"Warning: could not drop the page cache: {e}", file=sys.stderr)
+        return False
+
+
+def reset_state(config):
+    """
+    Empties the tables and removes scan snapshots and the metadata cache,
+    so the next run starts cold.
+    """
+    connection = synthetic.connect(config)
+    synthetic.create_tables(connection, config.table_list, config.audio_table_list)
+    connection.close()
+    shutil.rmtree(config.SYNC_STATE_DIR, ignore_errors=True)
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(config.METADATA_CACHE_FILE + suffix)
+
+
+def table_rows(config, table):
+    connection = synthetic.connect(config)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+            return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def run_sync_media(args):
+    """
+    Runs sync_media.sync_media_folders() once. Returns (seconds, stages,
+    inserted, deleted, errors).
+    """
+    import sync_media
+    from rich.console import Console
+
+    timer = StageTimer()
+    timer.patch(sync_media, 'scan_tables', 'scan')
+    timer.patch(sync_media.DirectorySnapshot, 'save', 'scan')
+    for name in ('get_existing_file_paths', 'filter_known_paths', 'delete_stale_files'):
+        timer.patch(sync_media, name, 'diff')
+    for name in ('insert_new_files', 'delete_files', 'bulk_delete', 'forget_recent_playback',
+                 'rebuild_directory_index'):
+        timer.patch(sync_media, name, 'write')
+    timer.patch(sync_media, 'probe_media', 'probe')
+
+    counts = {'inserted': 0, 'deleted': 0}
+    errors = []
+    sync_table = sync_media.sync_table
+
+    def counted_sync_table(*a, **k):
+        try:
+            result = sync_table(*a, **k)
+        except Exception as e:
+            errors.append(str(e))
+            raise
+        counts['inserted'] += result[1]
+        counts['deleted'] += result[2]
+        return result
+
+    console = sync_media.console
+    sync_media.sync_table = counted_sync_table
+    if not args.verbose:
+        sync_media.console = Console(quiet=True)
+    started = time.perf_counter()
+    try:
+        sync_media.sync_media_folders(full=False, probe=args.probe)
+    finally:
+        seconds = time.perf_counter() - started
+        sync_media.sync_table = sync_table
+        sync_media.console = console
+        timer.restore()
+    return seconds, dict(timer.totals), counts['inserted'], counts['deleted'], errors
+
+
+def run_audio_import(args):
+    """
+    Runs read_audio_to_mysql.import_audio_folders() once. Returns (seconds,
+    stages, inserted, deleted, errors).
+    """
+    import read_audio_to_mysql as importer
+    from metadata_cache import MetadataCache
+
+    timer = StageTimer()
+    timer.patch(importer, 'iter_files', 'scan', iterator=True)
+    timer.patch(importer, 'get_existing_file_paths', 'diff')
+    timer.patch(importer, 'bulk_insert', 'write')
+    timer.patch(importer, 'rebuild_directory_index', 'write')
+
+    inserted, errors = 0, []
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    try:
+        with output:
+            cache = MetadataCache()
+            try:
+                inserted = importer.import_audio_folders(workers=args.workers, cache=cache)
+            finally:
+                cache.close()
+        if inserted is None:
+            errors.append("Could not connect to the scratch database")
+            inserted = 0
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        seconds = time.perf_counter() - started
+        timer.restore()
+    return seconds, dict(timer.totals), inserted, 0, errors
+
+
+def record(seconds, stages, inserted, deleted, errors, files, rows, expected_rows):
+    result = {'seconds': seconds, 'files': files, 'inserted': inserted, 'deleted': deleted,
+              'rows': rows, 'expected_rows': expected_rows, 'errors': errors}
+    for stage in STAGES[:-1]:
+        result[stage] = stages.get(stage, 0.0)
+    result['other'] = max(0.0, seconds - sum(result[s] for s in STAGES[:-1]))
+    return result
+
+
+def print_report(results, baseline=None):
+    from rich.console import Console
+    from rich.table import Table
+    from rich import box
+
+    previous = (baseline or {}).get('results', {})
+    table = Table(title="Sync benchmark", box=box.ROUNDED, header_style="bold magenta")
+    for column in ("Phase", "Script", "Files", "Inserted", "Deleted", "Rows", "Total s",
+                   "Scan", "Diff", "Write", "Probe", "Other", "Files/s"):
+        table.add_column(column, justify="left" if column in ("Phase", "Script") else "right")
+    for phase, scripts in results.items():
+        for script, row in scripts.items():
+            rows = str(row['rows'])
+            if row['expected_rows'] is not None and row['rows'] != row['expected_rows']:
+                rows = f"[red]{row['rows']} (expected {row['expected_rows']})[/red]"
+            total = f"{row['seconds']:.2f}"
+            old = previous.get(phase, {}).get(script)
+            if old and old.get('seconds'):
+                delta = (row['seconds'] - old['seconds']) / old['seconds'] * 100
+                colour = 'red' if delta >= 5 else 'green' if delta <= -5 else 'dim'
+                total += f" [{colour}]({delta:+.0f}%)[/{colour}]"
+            if row['errors']:
+                total += f" [red]{len(row['errors'])} error(s)[/red]"
+            table.add_row(phase, script, str(row['files']), str(row['inserted']), str(row['deleted']), rows,
+                          total, *(f"{row[s]:.2f}" for s in STAGES),
+                          f"{row['files'] / row['seconds']:.0f}" if row['seconds'] else "-")
+    Console().print(table)
+    for phase, scripts in results.items():
+        for script, row in scripts.items():
+            for error in row['errors'][:3]:
+                print(f"{phase}/{script}: {error}", file=sys.stderr)
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for phase, scripts in results.items():
+        for script, row in scripts.items():
+            old = baseline.get('results', {}).get(phase, {}).get(script)
+            if old and old.get('seconds') and row['seconds'] > old['seconds'] * (1 + tolerance):
+                found.append(f"{phase}/{script}: {old['seconds']:.2f} -> {row['seconds']:.2f} s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    tree = parser.add_argument_group("synthetic tree")
+    tree.add_argument('--root', default=os.path.join(synthetic.BENCH_DIR, 'work', 'synctree'),
+                      help="Where the trees are built, e.g. on tmpfs (default: bench/work/synctree)")
+    tree.add_argument('--depth', type=int, default=2, help="Directory levels (default: 2)")
+    tree.add_argument('--fan-out', type=int, default=20, help="Subdirectories per level (default: 20)")
+    tree.add_argument('--files-per-dir', type=int, default=50, help="Files per leaf directory (default: 50)")
+    tree.add_argument('--video-ext', default='mp4=6,mkv=3,avi=1', help="Video extension mix (default: mp4=6,mkv=3,avi=1)")
+    tree.add_argument('--audio-ext', default='mp3=1', help="Audio extension mix; only mp3 stubs are tagged (default: mp3=1)")
+    tree.add_argument('--junk', type=float, default=0.02, help="Share of non-media files (default: 0.02)")
+    tree.add_argument('--delta', type=float, default=0.01, help="Share of files changed before the delta phase (default: 0.01)")
+    tree.add_argument('--reuse-tree', action='store_true', help="Keep an unmodified tree from an earlier run")
+    tree.add_argument('--seed', type=int, default=1, help="Seed for the trees and the delta (default: 1)")
+
+    run = parser.add_argument_group("runs")
+    run.add_argument('--phases', default=','.join(PHASES), help="Phases to run, in order (default: cold,warm,delta)")
+    run.add_argument('--scripts', default='sync_media,read_audio',
+                     help="Scripts to run (default: sync_media,read_audio)")
+    run.add_argument('--probe', action='store_true', help="Run the sync_media.py probe stage too")
+    run.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Tag reading processes for the importer")
+    run.add_argument('--drop-caches', action='store_true', help="Drop the page cache before the cold phase (root only)")
+    run.add_argument('--verbose', action='store_true', help="Show the scripts' own output")
+    run.add_argument('--workdir', default=os.path.join(synthetic.BENCH_DIR, 'work'),
+                     help="Where state files are kept (default: bench/work)")
+    run.add_argument('--database', default='mediaplayer_bench', help="Scratch database (default: mediaplayer_bench)")
+    run.add_argument('--db-host', help="MySQL host (default: from config.py)")
+    run.add_argument('--db-user', help="MySQL user (default: from config.py)")
+    run.add_argument('--db-password', help="MySQL password (default: from config.py)")
+    run.add_argument('--set', action='append', metavar='NAME=VALUE',
+                     help="Override a setting, e.g. --set SCAN_THREADS=16 or BULK_CHUNK_SIZE=5000 (repeatable)")
+
+    output = parser.add_argument_group("results")
+    output.add_argument('--save', metavar='NAME', help="Save the results as a baseline")
+    output.add_argument('--compare', metavar='NAME', help="Compare with a saved baseline")
+    output.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown of a phase against the baseline before failing (default: 0.2)")
+    args = parser.parse_args()
+
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    scripts = [s.strip() for s in args.scripts.split(',') if s.strip()]
+    for phase in phases:
+        if phase not in PHASES:
+            raise SystemExit(f"Unknown phase '{phase}'; choose from {', '.join(PHASES)}")
+    for script in scripts:
+        if script not in ('sync_media', 'read_audio'):
+            raise SystemExit(f"Unknown script '{script}'; choose from sync_media, read_audio")
+
+    trees = Trees(args)
+    overrides = synthetic.parse_overrides(args.set)
+    config = synthetic.install_config(
+        os.path.abspath(args.workdir), args.database,
+        [(trees.video.root, VIDEO_TABLE)], [(trees.audio.root, AUDIO_TABLE)],
+        mysql={'host': args.db_host, 'user': args.db_user, 'password': args.db_password},
+        overrides=overrides)
+
+    build_seconds = trees.prepare(args.reuse_tree)
+    if build_seconds:
+        print(f"Built the trees in {build_seconds:.1f} s", file=sys.stderr)
+
+    results = {}
+    # Rows the importer's table should hold; unknown until a cold phase ran
+    audio_expected = None
+    for phase in phases:
+        if phase == 'cold':
+            reset_state(config)
+            audio_expected = trees.media['audio']
+            if args.drop_caches:
+                drop_page_cache()
+        elif phase == 'delta':
+            changes = trees.apply_delta(args.delta, args.seed)
+            for name, (added, deleted, renamed) in changes.items():
+                print(f"Delta on the {name} tree: {added} added, {deleted} deleted, {renamed} renamed",
+                      file=sys.stderr)
+            # The importer never deletes, so a renamed file adds a row
+            if audio_expected is not None:
+                audio_expected += changes['audio'][0] + changes['audio'][2]
+        print(f"Running the {phase} phase...", file=sys.stderr)
+        results[phase] = {}
+        if 'sync_media' in scripts:
+            outcome = run_sync_media(args)
+            results[phase]['sync_media'] = record(*outcome, trees.media['video'],
+                                                  table_rows(config, VIDEO_TABLE), trees.media['video'])
+        if 'read_audio' in scripts:
+            outcome = run_audio_import(args)
+            results[phase]['read_audio'] = record(*outcome, trees.media['audio'],
+                                                  table_rows(config, AUDIO_TABLE), audio_expected)
+
+    baseline = synthetic.load_baseline(args.compare) if args.compare else None
+    if baseline is not None and baseline.get('parameters') != trees.parameters:
+        print("Warning: the baseline was recorded with a different tree", file=sys.stderr)
+    print_report(results, baseline)
+
+    if args.save:
+        path = synthetic.save_baseline(args.save, {
+            'saved': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'parameters': trees.parameters,
+            'run': {'root': trees.root, 'delta': args.delta, 'probe': args.probe, 'workers': args.workers,
+                    'phases': phases, 'scripts': scripts},
+            'settings': overrides,
+            'results': results,
+        })
+        print(f"Saved baseline {path}", file=sys.stderr)
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print("Regressions beyond tolerance:\n  " + "\n  ".join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
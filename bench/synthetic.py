@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   bench/synthetic.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Synthetic libraries for the benchmarks in this directory.
+#
+#  The app and the sync scripts read their settings with `import config`,
+#  so a benchmark builds a config module of its own (the real config.py's
+#  settings with the database, media tables and state files pointed at a
+#  scratch location) and installs it in sys.modules before importing any
+#  of them. The real library and database are never touched: the scratch
+#  database must have a different name from the one in config.py.
+#
+#  Media tables are created with the columns the sync scripts fill plus
+#  everything migrate_catalog.py adds, so the app sees the same schema as
+#  an upgraded installation. Titles are built from a fixed syllable list and
+#  a seed, so a run with the same options produces the same library.
+#
+#  Media trees for the sync benchmarks are real directories of stub files:
+#  audio stubs are one MPEG frame behind an ID3v2.4 tag, enough for mutagen
+#  to read title, artist, album and track; video stubs are empty.
+
+import json
+import os
+import random
+import sys
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+BASELINE_DIR = os.path.join(BENCH_DIR, 'baselines')
+
+# One MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, 417 bytes
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+SYLLABLES = ('ka', 'lo', 'mi', 'ra', 'ten', 'sho', 'vel', 'dor', 'an', 'is', 'qua', 'ber',
+             'nox', 'tri', 'el', 'ju', 'pan', 'sol', 'mar', 'din', 'ost', 'ly', 'zen', 'cor')
+
+VIDEO_SCHEMA = """
+    CREATE TABLE `{table}` (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        title VARCHAR(512) NULL,
+        file_path VARCHAR(1024) NULL,
+        resume_position DOUBLE NOT NULL DEFAULT 0,
+        last_played DATETIME NULL,
+        KEY idx_file_path (file_path(255))
+    ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+AUDIO_SCHEMA = """
+    CREATE TABLE `{table}` (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        title VARCHAR(512) NULL,
+        file_path VARCHAR(1024) NULL,
+        category VARCHAR(64) NULL,
+        artist VARCHAR(255) NULL,
+        album VARCHAR(255) NULL,
+        track_number INT NULL,
+        resume_position DOUBLE NOT NULL DEFAULT 0,
+        last_played DATETIME NULL,
+        KEY idx_file_path (file_path(255))
+    ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+
+def word(rng, syllables=(2, 3)):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables)))
+
+
+def phrase(rng, words=(1, 4)):
+    return ' '.join(word(rng).capitalize() for _ in range(rng.randint(*words)))
+
+
+def _load_real_config():
+    try:
+        import config
+    except ImportError:
+        return None
+    finally:
+        sys.modules.pop('config', None)
+    return config
+
+
+def install_config(workdir, database=None, video_tables=(), audio_tables=(), mysql=None, overrides=None,
+                   require_mysql=True):
+    """
+    Builds the benchmark's config module and installs it as `config`.
+
+    Args:
+        workdir (str): Scratch directory; the catalog stamp, scan snapshots,
+            metadata cache and query log are kept here.
+        database (str): Scratch database name.
+        video_tables, audio_tables: (root, table) pairs for table_list and
+            audio_table_list.
+        mysql (dict): Connection settings that override config.py's.
+        overrides (dict): Any other settings, e.g. {'DB_POOL_SIZE': 10}.
+        require_mysql (bool): False for benchmarks that never connect.
+
+    Returns:
+        module: The installed config module.
+    """
+    if 'MySql' in sys.modules or 'OV' in sys.modules:
+        raise RuntimeError("install_config() must run before the app modules are imported")
+    real = _load_real_config()
+    module = types.ModuleType('config')
+    if real is not None:
+        for name, value in vars(real).items():
+            if not name.startswith('__'):
+                setattr(module, name, value)
+
+    os.makedirs(workdir, exist_ok=True)
+    mysql_config = dict(getattr(module, 'mysql_config', {}) or {})
+    mysql_config.update({k: v for k, v in (mysql or {}).items() if v is not None})
+    real_database = mysql_config.get('database')
+    if database:
+        if real is not None and database == real_database:
+            raise SystemExit(f"Refusing to use the app's own database '{database}'; pick another name.")
+        mysql_config['database'] = database
+    missing = [k for k in ('host', 'user', 'password', 'database') if not mysql_config.get(k)]
+    if missing and require_mysql:
+        raise SystemExit(f"MySQL settings missing ({', '.join(missing)}); add them to config.py or pass them.")
+
+    module.__file__ = os.path.join(workdir, 'config.py')
+    module.mysql_config = mysql_config
+    module.table_list = list(video_tables)
+    module.audio_table_list = list(audio_tables)
+    module.Media = getattr(module, 'Media', None)
+    module.CATALOG_STAMP_FILE = os.path.join(workdir, '.catalog_stamp')
+    module.SYNC_STATE_DIR = os.path.join(workdir, '.sync_state')
+    module.METADATA_CACHE_FILE = os.path.join(workdir, 'metadata_cache.sqlite3')
+    module.QUERY_LOG = os.path.join(workdir, 'queries.log')
+    module.RUNTIME_DIR = os.path.join(workdir, 'runtime')
+    module.METRICS_DIR = os.path.join(module.RUNTIME_DIR, 'metrics')
+    module.RESUME_SPOOL_FILE = os.path.join(module.RUNTIME_DIR, 'resume.json')
+    module.STREAM_RATE_STATE_FILE = os.path.join(module.RUNTIME_DIR, 'bandwidth')
+    for name, value in (overrides or {}).items():
+        setattr(module, name, value)
+    sys.modules['config'] = module
+    return module
+
+
+def parse_overrides(items):
+    """
+    Turns ['DB_POOL_SIZE=10', 'STREAM_MODE=chunked'] into a dict; values
+    are read as Python literals where possible.
+    """
+    import ast
+    overrides = {}
+    for item in items or []:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit(f"--set expects NAME=VALUE, got {item!r}")
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+
+def connect(config):
+    """
+    Connects to the scratch database, creating it first if needed.
+    """
+    import pymysql
+    settings = dict(config.mysql_config)
+    database = settings.pop('database')
+    connection = pymysql.connect(**settings)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}` "
+                       "DEFAULT CHARSET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    connection.select_db(database)
+    return connection
+
+
+def create_tables(connection, video_tables=(), audio_tables=()):
+    """
+    (Re)creates empty media tables with the upgraded schema.
+    """
+    from migrate_catalog import add_catalog_columns
+    cursor = connection.cursor()
+    for schema, tables in ((VIDEO_SCHEMA, video_tables), (AUDIO_SCHEMA, audio_tables)):
+        for _, table in tables:
+            cursor.execute(f"DROP TABLE IF EXISTS `{table}`")
+            cursor.execute(schema.format(table=table))
+            add_catalog_columns(connection, table)
+    connection.commit()
+
+
+def library_paths(root, count, per_folder, extensions, rng, depth=1):
+    """
+    Yields (file_path, folder_title) for `count` files spread over folders of
+    `per_folder` files, nested `depth` levels below `root`.
+    """
+    folders = max(1, -(-count // per_folder))
+    produced = 0
+    for f in range(folders):
+        parts = [f"{phrase(rng, (1, 3))} {f:05d}"]
+        for level in range(1, depth):
+            parts.append(f"Part {rng.randint(1, 9)}")
+        directory = os.path.join(root, *parts)
+        for i in range(min(per_folder, count - produced)):
+            name = f"{i + 1:03d} {phrase(rng)}{rng.choice(extensions)}"
+            yield os.path.join(directory, name), parts[0]
+            produced += 1
+
+
+def populate(connection, root, table, count, per_folder, audio=False, seed=1, played=0.05):
+    """
+    Fills a media table with `count` synthetic rows under `root`. About
+    `played` of them get a resume position and a last_played time.
+
+    Returns:
+        list: The file paths, in id order.
+    """
+    from bulk_db import bulk_insert
+    from catalog import folder_values, rebuild_directory_index
+    rng = random.Random(f"{seed}:{table}")
+    extensions = ('.mp3', '.flac', '.ogg') if audio else ('.mp4', '.mkv', '.avi')
+    columns = ('title', 'file_path', 'folder', 'parent_dir', 'duration', 'resume_position', 'last_played')
+    if audio:
+        columns += ('category', 'artist', 'album', 'track_number')
+    rows, paths = [], []
+    artists = [phrase(rng, (1, 2)) for _ in range(max(1, count // (per_folder * 4)))]
+    track = 0
+    album = None
+    for file_path, folder_title in library_paths(root, count, per_folder, extensions, rng):
+        duration = rng.uniform(120, 420) if audio else rng.uniform(1200, 7200)
+        position, last_played = 0, None
+        if rng.random() < played:
+            position = round(rng.uniform(10, duration - 30), 1)
+            last_played = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 20:00:00"
+        title = os.path.splitext(os.path.basename(file_path))[0]
+        row = (title, file_path) + folder_values(root, file_path) + (round(duration, 1), position, last_played)
+        if audio:
+            if album != folder_title:
+                album, track, artist = folder_title, 0, rng.choice(artists)
+            track += 1
+            row += (table, artist, album, track)
+        rows.append(row)
+        paths.append(file_path)
+    bulk_insert(connection, table, columns, rows)
+    connection.commit()
+    rebuild_directory_index(connection, table)
+    return paths
+
+
+def make_sparse_files(paths, size):
+    """
+    Creates each path as a sparse file of `size` bytes (no disk blocks are
+    used until written). Existing files of the right size are kept.
+    """
+    for path in paths:
+        try:
+            if os.path.getsize(path) == size:
+                continue
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.truncate(size)
+
+
+def _syncsafe(size):
+    return bytes(((size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f))
+
+
+def id3_tag(title, artist, album, track):
+    """
+    Returns an ID3v2.4 tag with UTF-8 title, artist, album and track frames.
+    """
+    frames = b''
+    for frame_id, text in (('TIT2', title), ('TPE1', artist), ('TALB', album), ('TRCK', str(track))):
+        data = b'\x03' + text.encode('utf-8')
+        frames += frame_id.encode('ascii') + _syncsafe(len(data)) + b'\x00\x00' + data
+    return b'ID3\x04\x00\x00' + _syncsafe(len(frames)) + frames
+
+
+def parse_mix(text):
+    """
+    Turns 'mp4=6,mkv=3,avi=1' into ([extensions], [weights]).
+    """
+    extensions, weights = [], []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lstrip('.')
+        if name:
+            extensions.append('.' + name)
+            weights.append(float(weight or 1))
+    return extensions, weights
+
+
+class MediaTree:
+    """
+    A directory tree `depth` levels deep with `fan_out` subdirectories per
+    level and `files_per_dir` files in each leaf directory. For audio trees
+    the leaf is the album and its parent the artist. Leaf directories are
+    numbered, so any of them can be found again without walking the tree.
+    """
+    def __init__(self, root, depth, fan_out, files_per_dir, extensions, audio=False, junk=0.0, seed=1):
+        self.root = root
+        self.depth = max(1, depth)
+        self.fan_out = fan_out
+        self.files_per_dir = files_per_dir
+        self.extensions, self.weights = extensions
+        self.audio = audio
+        self.junk = junk
+        self.seed = seed
+
+    @property
+    def leaf_count(self):
+        return self.fan_out ** self.depth
+
+    def _dir_name(self, level, digits):
+        rng = random.Random(f"{self.seed}:{level}:{digits}")
+        label = ('Artist', 'Album', 'Disc')[min(level, 2)] if self.audio else ('Show', 'Season', 'Part')[min(level, 2)]
+        return f"{phrase(rng, (1, 2))} {label} {digits[-1]:03d}"
+
+    def leaf(self, index):
+        """
+        Returns (directory, names of its levels) of leaf number `index`.
+        """
+        digits = []
+        for _ in range(self.depth):
+            index, digit = divmod(index, self.fan_out)
+            digits.insert(0, digit)
+        names = [self._dir_name(level, tuple(digits[:level + 1])) for level in range(self.depth)]
+        return os.path.join(self.root, *names), names
+
+    def file_name(self, rng, number):
+        if self.junk and rng.random() < self.junk:
+            return f"{number:03d} {word(rng)}{rng.choice(('.txt', '.jpg', '.nfo'))}"
+        extension = rng.choices(self.extensions, self.weights)[0]
+        return f"{number:03d} {phrase(rng)}{extension}"
+
+    def write_file(self, path, names, number):
+        with open(path, 'wb') as file:
+            if self.audio and path.endswith('.mp3'):
+                title = os.path.splitext(os.path.basename(path))[0][4:]
+                artist = names[-2] if len(names) > 1 else names[-1]
+                file.write(id3_tag(title, artist, names[-1], number))
+                file.write(MP3_FRAME * 3)
+
+    def build(self, progress=None):
+        """
+        Creates the whole tree. Returns the number of media files (junk
+        files excluded).
+        """
+        media = 0
+        for index in range(self.leaf_count):
+            directory, names = self.leaf(index)
+            os.makedirs(directory, exist_ok=True)
+            rng = random.Random(f"{self.seed}:leaf:{index}")
+            for number in range(1, self.files_per_dir + 1):
+                name = self.file_name(rng, number)
+                self.write_file(os.path.join(directory, name), names, number)
+                media += self.is_media(name)
+            if progress and index % 1000 == 999:
+                progress(index + 1, self.leaf_count)
+        return media
+
+    def is_media(self, name):
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def count_media(self):
+        return sum(self.is_media(name) for _, _, names in os.walk(self.root) for name in names)
+
+
+def baseline_path(name):
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, record):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, 'w') as file:
+        json.dump(record, file, indent=2)
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name)) as file:
+        return json.load(file)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   block_cache.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Optional in-memory cache of file blocks for /stream. Files are read in
+#  aligned blocks of BLOCK_CACHE_BLOCK_SIZE bytes, keyed by device, inode,
+#  mtime and offset, and kept in an LRU bounded by BLOCK_CACHE_SIZE bytes.
+#  When several clients play the same episode or album at once, each block
+#  is read from disk once: a reader that asks for a block another thread is
+#  already loading waits for that read instead of issuing its own. The
+#  cache lives in one process, so it is shared by the clients of
+#  stream_server.py or of a threaded gunicorn worker.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import config
+
+# Memory cap in bytes; 0 disables the cache
+BLOCK_CACHE_SIZE = getattr(config, 'BLOCK_CACHE_SIZE', 0)
+
+BLOCK_CACHE_BLOCK_SIZE = getattr(config, 'BLOCK_CACHE_BLOCK_SIZE', 1024 * 1024)
+
+
+class BlockCache:
+    """
+    LRU of (dev, inode, mtime_ns, offset) -> bytes with single-flight loads.
+    """
+    def __init__(self, size=BLOCK_CACHE_SIZE, block_size=BLOCK_CACHE_BLOCK_SIZE):
+        self.size = size
+        self.block_size = block_size
+        self._blocks = OrderedDict()
+        self._loading = {}   # key -> Future of the read in progress
+        self._held = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0      # reads served by waiting on another thread's load
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def peek(self, st, offset):
+        """
+        Returns a cached block without reading the file, or None.
+        """
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, offset)
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def block(self, file, st, offset):
+        """
+        Returns the block of an open file starting at `offset` (a multiple
+        of block_size); `st` is the file's os.fstat() result.
+        """
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, offset)
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return data
+            flight = self._loading.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._loading[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            data = os.pread(file.fileno(), self.block_size, offset)
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            self._loading.pop(key, None)
+            if data:
+                self._blocks[key] = data
+                self._held += len(data)
+                while self._held > self.size and self._blocks:
+                    _, old = self._blocks.popitem(last=False)
+                    self._held -= len(old)
+        flight.set_result(data)
+        return data
+
+    def pieces(self, file, start, length):
+        """
+        Yields (block, begin, end) covering `length` bytes from `start`, so
+        that block[begin:end] are the bytes in order.
+        """
+        st = os.fstat(file.fileno())
+        position, end = start, start + length
+        while position < end:
+            offset = position - position % self.block_size
+            data = self.block(file, st, offset)
+            begin = position - offset
+            stop = min(len(data), end - offset)
+            if stop <= begin:
+                break  # the file is shorter than expected
+            yield data, begin, stop
+            position = offset + stop
+
+    def read_chunks(self, file, start, length, close=True, shaper=None):
+        """
+        Drop-in for media_stream.read_chunks() that reads through the cache.
+        """
+        try:
+            for data, begin, stop in self.pieces(file, start, length):
+                if shaper:
+                    wait = shaper.delay(stop - begin)
+                    if wait:
+                        time.sleep(wait)
+                sent_at = time.monotonic()
+                yield data[begin:stop] if (begin, stop) != (0, len(data)) else data
+                if shaper:
+                    shaper.sent(stop - begin, time.monotonic() - sent_at)
+        finally:
+            if close:
+                file.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size_limit': self.size,
+                'bytes_held': self._held,
+                'blocks': len(self._blocks),
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_loads': self.shared,
+            }
+
+
+BLOCK_CACHE = BlockCache()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   bulk_db.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Batched writes for the sync scripts. Rows go to the server in chunks:
+#  multi-row INSERTs through executemany, keyed UPDATEs through executemany,
+#  and DELETEs as chunked IN lists or a join against a temporary staging
+#  table. Each chunk is its own
+#  transaction. If a chunk fails it is rolled back and retried row by row, so
+#  the caller still learns exactly which rows were rejected.
+
+import re
+import pymysql
+import config
+
+BULK_CHUNK_SIZE = getattr(config, 'BULK_CHUNK_SIZE', 1000)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _row_by_row(connection, query, rows, on_error):
+    """
+    Runs `query` once per row in one transaction, reporting failures through
+    on_error(row, error). Returns the number of rows that succeeded.
+    """
+    cursor = connection.cursor()
+    succeeded = 0
+    for row in rows:
+        try:
+            cursor.execute(query, row)
+            succeeded += 1
+        except pymysql.Error as e:
+            if on_error:
+                on_error(row, e)
+    connection.commit()
+    return succeeded
+
+
+def bulk_insert(connection, table_name, columns, rows, chunk_size=BULK_CHUNK_SIZE, on_error=None):
+    """
+    Inserts rows in multi-row INSERT statements.
+
+    Args:
+        connection (pymysql.Connection): A connection object to the database.
+        table_name (str): The table to insert into.
+        columns (sequence): Column names, in the order of each row's values.
+        rows (list): Tuples of values.
+        chunk_size (int): Rows per statement/transaction.
+        on_error (callable): Called as on_error(row, error) for each row that
+            is rejected when a chunk has to be retried row by row.
+
+    Returns:
+        tuple: (inserted_count, failed_count)
+    """
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+    column_list = ", ".join(f"`{c}`" for c in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    query = f"INSERT INTO `{table_name}` ({column_list}) VALUES ({placeholders})"
+    cursor = connection.cursor()
+    inserted = 0
+    for chunk in _chunks(rows, chunk_size):
+        try:
+            cursor.executemany(query, chunk)
+            connection.commit()
+            inserted += len(chunk)
+        except pymysql.Error:
+            connection.rollback()
+            inserted += _row_by_row(connection, query, chunk, on_error)
+    return inserted, len(rows) - inserted
+
+
+def bulk_update(connection, table_name, key_column, columns, rows, chunk_size=BULK_CHUNK_SIZE, on_error=None):
+    """
+    Updates rows by key, one transaction per chunk.
+
+    Args:
+        connection (pymysql.Connection): A connection object to the database.
+        table_name (str): The table to update.
+        key_column (str): The column identifying a row, e.g. 'id'.
+        columns (sequence): The columns to set.
+        rows (list): Tuples of the new values in `columns` order followed by
+            the key value.
+        chunk_size (int): Rows per transaction.
+        on_error (callable): Called as on_error(row, error) for each row that
+            is rejected when a chunk has to be retried row by row.
+
+    Returns:
+        tuple: (updated_count, failed_count), counting rows sent rather than
+        rows whose values actually changed.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+    assignments = ", ".join(f"`{c}` = %s" for c in columns)
+    query = f"UPDATE `{table_name}` SET {assignments} WHERE `{key_column}` = %s"
+    cursor = connection.cursor()
+    updated = 0
+    for chunk in _chunks(rows, chunk_size):
+        try:
+            cursor.executemany(query, chunk)
+            connection.commit()
+            updated += len(chunk)
+        except pymysql.Error:
+            connection.rollback()
+            updated += _row_by_row(connection, query, chunk, on_error)
+    return updated, len(rows) - updated
+
+
+def bulk_delete(connection, table_name, column, values, chunk_size=BULK_CHUNK_SIZE, on_error=None):
+    """
+    Deletes rows whose `column` is in `values` with chunked IN lists. Best for
+    an indexed column such as the primary key.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    values = list(values)
+    cursor = connection.cursor()
+    deleted = 0
+    for chunk in _chunks(values, chunk_size):
+        placeholders = ", ".join(["%s"] * len(chunk))
+        try:
+            deleted += cursor.execute(f"DELETE FROM `{table_name}` WHERE `{column}` IN ({placeholders})", chunk)
+            connection.commit()
+        except pymysql.Error:
+            connection.rollback()
+            deleted += _row_by_row(connection, f"DELETE FROM `{table_name}` WHERE `{column}` = %s",
+                                   [(value,) for value in chunk], on_error)
+    return deleted
+
+
+def _column_collation(cursor, table_name, column):
+    """
+    Returns the (character set, collation) of a text column, so a staging
+    column can be declared to compare with it without a collation mix, or
+    ('utf8mb4', None) if the column is not text or cannot be looked up.
+    """
+    cursor.execute(
+        "SELECT CHARACTER_SET_NAME AS charset, COLLATION_NAME AS collation FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table_name, column))
+    row = cursor.fetchone()
+    if isinstance(row, dict):
+        row = (row['charset'], row['collation'])
+    if not row or not all(row) or not all(re.fullmatch(r'\w+', name) for name in row):
+        return 'utf8mb4', None
+    return row
+
+
+def bulk_delete_by_join(connection, table_name, column, values, chunk_size=BULK_CHUNK_SIZE, on_error=None):
+    """
+    Deletes rows whose `column` is in `values` by loading the values into a
+    temporary staging table and running one DELETE ... JOIN. Scales to large
+    value sets on unindexed columns, where IN lists would rescan the table
+    for every chunk. Falls back to bulk_delete() if the staging step fails.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    values = list(values)
+    if not values:
+        return 0
+    cursor = connection.cursor()
+    try:
+        # Declared like the target column: a staging column in another
+        # collation fails the join with "Illegal mix of collations"
+        charset, collation = _column_collation(cursor, table_name, column)
+        collate = f" COLLATE {collation}" if collation else ""
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS `_bulk_delete_keys`")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE `_bulk_delete_keys` "
+            f"(v VARCHAR(1024) CHARACTER SET {charset}{collate} NOT NULL, INDEX (v(255)))")
+        for chunk in _chunks(values, chunk_size):
+            cursor.executemany("INSERT INTO `_bulk_delete_keys` (v) VALUES (%s)", [(v,) for v in chunk])
+        deleted = cursor.execute(
+            f"DELETE t FROM `{table_name}` t JOIN `_bulk_delete_keys` k ON t.`{column}` = k.v")
+        connection.commit()
+    except pymysql.Error:
+        connection.rollback()
+        deleted = bulk_delete(connection, table_name, column, values, chunk_size, on_error)
+    finally:
+        try:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS `_bulk_delete_keys`")
+        except pymysql.Error:
+            pass
+    return deleted
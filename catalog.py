@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   catalog.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Helpers shared by the web app and the sync scripts. The sync scripts run
+#  as separate processes, so they signal "the catalog changed" by touching a
+#  stamp file; caches inside the gunicorn workers compare its mtime and
+#  refresh themselves when it moves. The folder helpers define how a file's
+#  path maps onto the indexed folder columns.
+
+import os
+import sys
+import config
+
+CATALOG_STAMP_FILE = getattr(
+    config, 'CATALOG_STAMP_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(config.__file__)), '.catalog_stamp'))
+
+def bump_catalog_version():
+    """
+    Marks the catalog as changed so that caches in the running app refresh.
+    """
+    try:
+        with open(CATALOG_STAMP_FILE, 'a'):
+            pass
+        os.utime(CATALOG_STAMP_FILE, None)
+    except OSError as e:
+        print(f"Warning: could not update catalog stamp {CATALOG_STAMP_FILE}: {e}", file=sys.stderr)
+
+def catalog_version():
+    """
+    Returns an opaque value that changes whenever bump_catalog_version() runs.
+    """
+    try:
+        return os.stat(CATALOG_STAMP_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+# Columns that let the app find a directory's items with an indexed equality
+# lookup instead of a LIKE '%/folder/%' scan:
+#   folder     - first directory below the table's root (library browser)
+#   parent_dir - full path of the directory holding the file (playlists)
+FOLDER_COLUMNS = ('folder', 'parent_dir')
+
+def browse_folder(root, file_path):
+    """
+    Returns the first directory below `root` that contains `file_path`, or
+    '' for files that sit directly in the root.
+    """
+    relative = os.path.relpath(file_path, root)
+    head, sep, _ = relative.partition(os.sep)
+    if not sep or head in ('', '.', '..'):
+        return ''
+    return head
+
+def parent_dir(file_path):
+    """
+    Returns the directory that holds `file_path`.
+    """
+    return os.path.dirname(file_path)
+
+def folder_values(root, file_path):
+    """
+    Returns the (folder, parent_dir) pair stored for a file.
+    """
+    return browse_folder(root, file_path), parent_dir(file_path)
+
+def table_columns(cursor, table_name):
+    """
+    Returns the set of column names of a table, using a plain pymysql cursor.
+    """
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
+    return {row[0] if isinstance(row, (tuple, list)) else row['Field'] for row in cursor.fetchall()}
+
+# Per-table directory index read by /get_folders and /get_albums: one row per
+# folder or album with its item count, rebuilt by the sync scripts whenever
+# they change a table.
+DIRECTORY_TABLE = 'media_directory'
+DIRECTORY_KINDS = ('folder', 'album')
+
+def ensure_directory_table(cursor):
+    """
+    Creates the directory index table if it does not exist yet.
+    """
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{DIRECTORY_TABLE}` (
+            table_name VARCHAR(64) NOT NULL,
+            kind VARCHAR(8) NOT NULL,
+            name VARCHAR(512) NOT NULL,
+            item_count INT NOT NULL,
+            last_modified DATETIME NOT NULL,
+            PRIMARY KEY (table_name, kind, name)
+        ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+def rebuild_directory_index(connection, table_name):
+    """
+    Recounts the folders and albums of one media table and brings its rows in
+    the directory index up to date. Entries whose count did not change keep
+    their last_modified time.
+
+    Returns:
+        int: The number of index rows inserted, updated or deleted.
+    """
+    cursor = connection.cursor()
+    ensure_directory_table(cursor)
+    columns = table_columns(cursor, table_name)
+    changes = 0
+    for kind in DIRECTORY_KINDS:
+        if kind not in columns:
+            continue
+        cursor.execute(
+            f"SELECT {kind}, COUNT(*) FROM `{table_name}` "
+            f"WHERE {kind} IS NOT NULL AND {kind} <> '' GROUP BY {kind}")
+        current = {name: count for name, count in cursor.fetchall()}
+        cursor.execute(
+            f"SELECT name, item_count FROM `{DIRECTORY_TABLE}` WHERE table_name = %s AND kind = %s",
+            (table_name, kind))
+        indexed = {name: count for name, count in cursor.fetchall()}
+
+        upserts = [(table_name, kind, name, count) for name, count in current.items()
+                   if indexed.get(name) != count]
+        removed = [(table_name, kind, name) for name in indexed if name not in current]
+        if removed:
+            cursor.executemany(
+                f"DELETE FROM `{DIRECTORY_TABLE}` WHERE table_name = %s AND kind = %s AND name = %s",
+                removed)
+        if upserts:
+            cursor.executemany(
+                f"INSERT INTO `{DIRECTORY_TABLE}` (table_name, kind, name, item_count, last_modified) "
+                "VALUES (%s, %s, %s, %s, NOW()) "
+                "ON DUPLICATE KEY UPDATE item_count = VALUES(item_count), last_modified = NOW()",
+                upserts)
+        changes += len(upserts) + len(removed)
+    connection.commit()
+    return changes
@@ -60,6 +60,169 @@ Media = {}
 # Optional settings
 DEBUG = False
 
+# Database connection pool (per gunicorn worker). MySql.MySQL reuses these
+# connections instead of opening a new one for every query.
+DB_POOL_SIZE = 5            # max open connections per worker process
+DB_POOL_TIMEOUT = 10        # seconds to wait for a free connection
+DB_POOL_IDLE_TIMEOUT = 300  # close connections idle longer than this
+DB_POOL_PING_INTERVAL = 30  # ping connections idle longer than this before reuse
+
+# Seconds the web app caches table/column lists before re-running DESCRIBE.
+# The sync scripts also invalidate the cache by touching CATALOG_STAMP_FILE
+# (defaults to .catalog_stamp next to config.py), and POST
+# /admin/refresh_schema clears it on demand.
+SCHEMA_CACHE_TTL = 300
+
+# How /stream sends file bodies:
+#   'auto'             - zero-copy via the server's wsgi.file_wrapper (gunicorn
+#                        uses sendfile) when available, else chunked reads
+#   'generator'        - always chunked reads in Python
+#   'x-accel-redirect' - nginx sends the file; map media roots to an
+#                        `internal` nginx location in STREAM_ACCEL_ROOTS
+#   'x-sendfile'       - Apache (mod_xsendfile) / lighttpd sends the file
+STREAM_MODE = 'auto'
+STREAM_ACCEL_ROOTS = [
+    # ['/media/videos', '/protected/videos'],
+]
+
+# Cache-Control for /stream responses. Responses also carry ETag and
+# Last-Modified, so browsers/Cloudflare can revalidate with a cheap 304.
+STREAM_CACHE_CONTROL = 'public, max-age=86400'
+
+# stream_server.py: an asyncio server for the /stream URLs that can hold
+# hundreds of open streams in one process. Set STREAM_BASE_URL to the URL
+# it is reachable at so the player loads media from it; leave it None to
+# stream from the Flask app (or to route /stream/ to it in the proxy).
+STREAM_SERVER_HOST = '0.0.0.0'
+STREAM_SERVER_PORT = 5052
+STREAM_SERVER_KEEPALIVE = 75   # seconds an idle connection is kept open
+STREAM_BASE_URL = None         # e.g. 'https://stream.example.com'
+
+# Bandwidth shaping for streams (bandwidth.py), so one client pre-buffering
+# a film cannot saturate the tunnel uplink. Limits are in bytes per second
+# and 0 means unlimited. The global limit covers the gunicorn workers and
+# stream_server.py together, through a token bucket they share in
+# STREAM_RATE_STATE_FILE (defaults to bandwidth in RUNTIME_DIR; '' applies
+# the limit to each process separately), and
+# is split fairly between the streams of each process. With
+# STREAM_BITRATE_FACTOR set, a stream whose bitrate is known is also capped
+# at bitrate * STREAM_BITRATE_FACTOR, even with no other limit set (0, the
+# default, turns that off). Streams without any limit go out via sendfile;
+# a paced stream keeps its sync gunicorn worker busy while it plays. Each
+# stream may burst STREAM_BURST_SECONDS worth of its rate at start-up.
+# Counters: GET /admin/stream_stats (per worker) and /stats on
+# stream_server.py.
+STREAM_RATE_LIMIT = 0            # e.g. 4 * 1024 * 1024
+STREAM_CLIENT_RATE_LIMIT = 0     # e.g. 2 * 1024 * 1024
+STREAM_BITRATE_FACTOR = 0        # e.g. 1.5
+STREAM_BURST_SECONDS = 10
+
+# When the player page opens, the first PREFETCH_BYTES of the next playlist
+# item and of the Random button's pick are read ahead into the page cache
+# (posix_fadvise WILLNEED), so auto-advance does not wait for a spinning
+# disk or NAS. So that it is not hinted on every page view, each worker
+# remembers a warmed file for PREFETCH_TTL seconds, within PREFETCH_BUDGET
+# bytes, then warms it again the next time it is queued; the kernel evicts
+# pages as usual. 0 for PREFETCH_BYTES or PREFETCH_BUDGET disables
+# prefetching.
+PREFETCH_BYTES = 16 * 1024 * 1024
+PREFETCH_BUDGET = 256 * 1024 * 1024
+PREFETCH_TTL = 600
+
+# Shared in-memory block cache for /stream (block_cache.py). Blocks of
+# BLOCK_CACHE_BLOCK_SIZE bytes are kept up to BLOCK_CACHE_SIZE bytes per
+# process, and concurrent readers of one block share a single disk read.
+# Useful with stream_server.py or threaded gunicorn workers when several
+# devices play the same files; 0 disables it (bodies then use sendfile).
+BLOCK_CACHE_SIZE = 0             # e.g. 512 * 1024 * 1024
+BLOCK_CACHE_BLOCK_SIZE = 1024 * 1024
+
+# The player page gets PLAYLIST_WINDOW playlist entries on each side of the
+# current item instead of the whole album/folder. Playlists are cached per
+# worker (PLAYLIST_CACHE_SIZE of them, for PLAYLIST_CACHE_TTL seconds) and
+# dropped when a sync run changes the catalog.
+PLAYLIST_WINDOW = 25
+PLAYLIST_CACHE_SIZE = 256
+PLAYLIST_CACHE_TTL = 300
+
+# GET /search?q=...&category=... matches words of the query against the
+# start of words in title, album, artist and folder of every media table.
+# Each worker keeps the index in memory (under 1 KB per item), builds it in
+# the background at worker start and rebuilds it after sync_media.py
+# changes the catalog. Status: GET /admin/search_stats.
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+
+# GET /metrics serves Prometheus metrics: request latency per route, DB
+# connect/query time, open streams and bytes streamed, and the results of
+# sync_media.py runs. Each process (gunicorn workers, stream_server.py,
+# sync runs) writes its values to a file in METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds them up, so the numbers
+# cover all workers. All processes must use the same directory, which
+# defaults to metrics in RUNTIME_DIR and must be private to the service
+# user; set it to '' to report only the worker that answers.
+# METRICS_DIR = '/run/mediaplayer/metrics'
+METRICS_FLUSH_INTERVAL = 5
+
+# Query tracing (query_trace.py), off by default. With QUERY_TRACE on, the
+# queries of each request are counted and timed; requests over the query
+# count or DB time budget, or repeating one query QUERY_TRACE_REPEAT times,
+# are written to QUERY_LOG with a per-query breakdown, and responses carry
+# a Server-Timing header. Queries slower than SLOW_QUERY_SECONDS (0 = off)
+# are logged with their EXPLAIN plan. QUERY_LOG is rotated at
+# QUERY_LOG_BYTES, keeping QUERY_LOG_BACKUPS old files.
+QUERY_TRACE = False
+QUERY_TRACE_MAX_QUERIES = 20
+QUERY_TRACE_MAX_SECONDS = 0.25
+QUERY_TRACE_REPEAT = 5
+SLOW_QUERY_SECONDS = 0         # e.g. 0.1
+QUERY_LOG = 'queries.log'
+QUERY_LOG_BYTES = 5 * 1024 * 1024
+QUERY_LOG_BACKUPS = 3
+
+# /stream keeps the file path, MIME type and stat() of recently streamed
+# items per worker, so the range requests a player sends while seeking do
+# not each query the database. Entries are re-checked with stat() on every
+# use and expire after STREAM_ITEM_CACHE_TTL seconds; 0 disables the cache.
+STREAM_ITEM_CACHE_SIZE = 1024
+STREAM_ITEM_CACHE_TTL = 60
+
+# Resume positions posted by the player are buffered and written
+# in batches every RESUME_FLUSH_INTERVAL seconds (and at worker shutdown).
+# Set to 0 to write every update straight to the database.
+RESUME_FLUSH_INTERVAL = 5
+
+# Private directory for the state the app's processes share (the resume
+# spool, the bandwidth bucket and metrics). It must be owned by the service
+# user and writable by nobody else, and is created with mode 0700 if missing
+# (defaults to .runtime next to config.py).
+# RUNTIME_DIR = '/run/mediaplayer'
+
+# File the workers share the unflushed positions through, so every worker
+# serves the latest one (defaults to resume.json in RUNTIME_DIR). '' keeps
+# them per worker: pages served by another worker then show the stored
+# position until the next flush.
+# RESUME_SPOOL_FILE = '/run/mediaplayer/resume.json'
+
+# Where sync_media.py keeps the per-directory state of the last run, used
+# to skip unchanged directories (defaults to .sync_state next to config.py).
+# SYNC_STATE_DIR = '/var/lib/mediaplayer/sync_state'
+
+# Number of directories the sync scripts list concurrently
+SCAN_THREADS = 8
+
+# Rows per batched INSERT/DELETE (and per transaction) in the sync scripts
+BULK_CHUNK_SIZE = 1000
+
+# SQLite file caching audio tags / media probe results between sync runs,
+# keyed by path + size/mtime/inode (defaults to metadata_cache.sqlite3 next
+# to config.py).
+# METADATA_CACHE_FILE = '/var/lib/mediaplayer/metadata_cache.sqlite3'
+
+
+# Files sync_media.py probes concurrently with pymediainfo (libmediainfo)
+# for duration, codecs, bitrate and MIME type
+PROBE_THREADS = 4
 
 # Notes for secure deployment:
 # - Keep `config.py` out of version control (add it to .gitignore).
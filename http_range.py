@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   http_range.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Conditional request and byte range handling for /stream (RFC 7232 and
+#  RFC 7233). Nothing here touches Flask, so the same rules can be used by
+#  any server that streams media files.
+
+import email.utils
+import os
+
+# Ranges closer together than this are merged into one part
+RANGE_COALESCE_GAP = 80
+# More ranges than this (after merging) and the Range header is ignored
+MAX_RANGES = 16
+
+
+class RangeDecision:
+    """
+    The outcome of evaluate(): the status to answer with and, for a 206, the
+    inclusive (start, end) byte ranges to send.
+    """
+    def __init__(self, status, ranges=None):
+        self.status = status
+        self.ranges = ranges or []
+
+    @property
+    def is_multipart(self):
+        return self.status == 206 and len(self.ranges) > 1
+
+
+def make_etag(st):
+    """
+    Returns a strong ETag for a file built from its inode, size and mtime.
+    """
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def http_date(timestamp):
+    """
+    Formats a Unix timestamp as an IMF-fixdate (Last-Modified style).
+    """
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def parse_http_date(value):
+    """
+    Parses an HTTP date into a Unix timestamp, or None if it is not valid.
+    """
+    if not value:
+        return None
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None:
+        return None
+    return parsed.timestamp()
+
+def _etag_list(value):
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+def _weak_equal(a, b):
+    return a.removeprefix('W/') == b.removeprefix('W/')
+
+def etag_matches(header_value, etag, weak=True):
+    """
+    True if an If-Match / If-None-Match style header matches `etag`.
+    If-None-Match uses weak comparison, If-Match strong comparison.
+    """
+    tags = _etag_list(header_value)
+    if '*' in tags:
+        return True
+    if weak:
+        return any(_weak_equal(tag, etag) for tag in tags)
+    return not etag.startswith('W/') and etag in tags
+
+def parse_range_header(value, size):
+    """
+    Parses a Range header against a representation of `size` bytes.
+
+    Returns None when the header should be ignored (not a bytes range,
+    malformed, or too many pieces), an empty list when no range is
+    satisfiable (416), or the sorted, merged list of inclusive ranges.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the final N bytes
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - suffix), size - 1))
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        return []
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1 + RANGE_COALESCE_GAP:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+def _if_range_holds(value, etag, mtime):
+    """
+    True if an If-Range validator still matches the current representation.
+    """
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        # Strong comparison only: a weak tag never matches
+        return not value.startswith('W/') and value == etag
+    since = parse_http_date(value)
+    return since is not None and int(since) == int(mtime)
+
+def evaluate(method, headers, size, mtime, etag):
+    """
+    Applies the conditional headers and Range header of a request, in the
+    order RFC 7232 section 6 prescribes, and returns a RangeDecision with
+    status 200, 206, 304, 412 or 416.
+    """
+    if_match = headers.get('If-Match')
+    if if_match is not None:
+        if not etag_matches(if_match, etag, weak=False):
+            return RangeDecision(412)
+    else:
+        since = parse_http_date(headers.get('If-Unmodified-Since'))
+        if since is not None and int(mtime) > int(since):
+            return RangeDecision(412)
+
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag, weak=True):
+            return RangeDecision(304 if method in ('GET', 'HEAD') else 412)
+    elif method in ('GET', 'HEAD'):
+        since = parse_http_date(headers.get('If-Modified-Since'))
+        if since is not None and int(mtime) <= int(since):
+            return RangeDecision(304)
+
+    if method != 'GET':
+        return RangeDecision(200)
+    range_header = headers.get('Range')
+    if not range_header:
+        return RangeDecision(200)
+    if_range = headers.get('If-Range')
+    if if_range is not None and not _if_range_holds(if_range, etag, mtime):
+        return RangeDecision(200)
+
+    ranges = parse_range_header(range_header, size)
+    if ranges is None:
+        return RangeDecision(200)
+    if not ranges:
+        return RangeDecision(416)
+    return RangeDecision(206, ranges)
+
+def content_range(start, end, size):
+    return f'bytes {start}-{end}/{size}'
+
+def new_boundary():
+    return os.urandom(12).hex()
+
+def multipart_layout(ranges, size, mime_type, boundary):
+    """
+    Lays out a multipart/byteranges body.
+
+    Returns (parts, trailer, total_length) where parts is a list of
+    (part_header_bytes, start, length) and trailer is the closing delimiter.
+    """
+    parts = []
+    total = 0
+    for start, end in ranges:
+        header = (f'\r\n--{boundary}\r\n'
+                  f'Content-Type: {mime_type}\r\n'
+                  f'Content-Range: {content_range(start, end, size)}\r\n\r\n').encode('latin-1')
+        length = end - start + 1
+        parts.append((header, start, length))
+        total += len(header) + length
+    trailer = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    return parts, trailer, total + len(trailer)
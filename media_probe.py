@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   media_probe.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Media probing for sync_media.py. Each file is parsed once with
+#  pymediainfo (libmediainfo) for its duration, container, codecs and
+#  overall bitrate, and the MIME type is derived from the container rather
+#  than the file extension. Results are kept in the metadata cache, so only
+#  new or changed files are parsed again. libmediainfo does its work in C
+#  and releases the GIL, so a thread pool is enough to probe files in
+#  parallel.
+
+from concurrent.futures import ThreadPoolExecutor
+import config
+import media_stream
+from metadata_cache import file_key
+
+try:
+    from pymediainfo import MediaInfo
+except ImportError:  # the probe stage is skipped without it
+    MediaInfo = None
+
+# Files probed concurrently by the sync scripts
+PROBE_THREADS = getattr(config, 'PROBE_THREADS', 4)
+
+PROBE_CACHE_KIND = 'mediainfo'
+
+# Catalog columns filled by the probe (see migrate_catalog.py)
+PROBE_COLUMNS = ('duration', 'container', 'video_codec', 'audio_codec', 'bitrate', 'mime_type')
+
+# libmediainfo's General "Format" -> (MIME type with video, MIME type audio-only)
+CONTAINER_MIME_TYPES = {
+    'MPEG-4': ('video/mp4', 'audio/mp4'),
+    'QuickTime': ('video/quicktime', 'audio/mp4'),
+    'Matroska': ('video/x-matroska', 'audio/x-matroska'),
+    'WebM': ('video/webm', 'audio/webm'),
+    'AVI': ('video/x-msvideo', 'audio/x-wav'),
+    'Flash Video': ('video/x-flv', 'video/x-flv'),
+    'Windows Media': ('video/x-ms-wmv', 'audio/x-ms-wma'),
+    'MPEG-PS': ('video/mpeg', 'audio/mpeg'),
+    'MPEG-TS': ('video/mp2t', 'video/mp2t'),
+    'Ogg': ('video/ogg', 'audio/ogg'),
+    'MPEG Audio': ('audio/mpeg', 'audio/mpeg'),
+    'FLAC': ('audio/flac', 'audio/flac'),
+    'Wave': ('audio/wav', 'audio/wav'),
+    'ADTS': ('audio/aac', 'audio/aac'),
+}
+
+
+def available():
+    """
+    Returns True if pymediainfo and the libmediainfo library are installed.
+    """
+    return MediaInfo is not None and MediaInfo.can_parse()
+
+
+def mime_type_for(container, has_video, path):
+    """
+    Returns the MIME type for a probed container, falling back to the file
+    extension when libmediainfo reports a format not listed above.
+    """
+    types = CONTAINER_MIME_TYPES.get(container)
+    if types:
+        return types[0] if has_video else types[1]
+    return media_stream.guess_mime_type(path)
+
+
+def probe_file(path):
+    """
+    Probes one file.
+
+    Returns:
+        dict: The PROBE_COLUMNS values (duration in seconds, bitrate in bits
+        per second), plus an 'error' key if the file could not be parsed;
+        every column is then None.
+    """
+    metadata = {column: None for column in PROBE_COLUMNS}
+    try:
+        info = MediaInfo.parse(path)
+    except Exception as e:
+        metadata['error'] = str(e)
+        return metadata
+
+    general = next(iter(info.general_tracks), None)
+    video = next(iter(info.video_tracks), None)
+    audio = next(iter(info.audio_tracks), None)
+    if general is not None:
+        if general.duration:
+            metadata['duration'] = round(float(general.duration) / 1000, 3)
+        if general.overall_bit_rate:
+            metadata['bitrate'] = int(float(general.overall_bit_rate))
+        container = general.format
+        # QuickTime files are reported as MPEG-4 with a QuickTime profile
+        if container == 'MPEG-4' and general.format_profile == 'QuickTime':
+            container = 'QuickTime'
+        metadata['container'] = container
+    if video is not None:
+        metadata['video_codec'] = video.format
+    if audio is not None:
+        metadata['audio_codec'] = audio.format
+    metadata['mime_type'] = mime_type_for(metadata['container'], video is not None, path)
+    return metadata
+
+
+def _probe(path):
+    key = file_key(path)
+    return path, key, probe_file(path)
+
+
+def probe_files(paths, cache=None, workers=PROBE_THREADS):
+    """
+    Probes many files on a thread pool, answering from `cache` (a
+    metadata_cache.MetadataCache) where the file is unchanged.
+
+    Yields:
+        tuple: (path, metadata), cached files first, then probed files in
+        the order given.
+    """
+    to_probe = []
+    for path in paths:
+        cached = cache.get(PROBE_CACHE_KIND, path, file_key(path)) if cache is not None else None
+        if cached is not None:
+            yield path, cached
+        else:
+            to_probe.append(path)
+    if not to_probe:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path, key, metadata in executor.map(_probe, to_probe):
+            # Failed probes are not cached, so the next run tries them again
+            if cache is not None and 'error' not in metadata:
+                cache.put(PROBE_CACHE_KIND, path, key, metadata)
+            yield path, metadata
+    if cache is not None:
+        cache.commit()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   media_scanner.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Directory scanning for the sync scripts. A DirectorySnapshot remembers,
+#  per directory, its mtime together with the matching files and the
+#  subdirectories it held at the last run. A directory's mtime only changes
+#  when entries are added, removed or renamed directly inside it, so on the
+#  next run any directory whose mtime is unchanged is taken from the
+#  snapshot instead of being listed again; only its subdirectories are
+#  stat()ed to keep descending. Directories are visited on a thread pool so
+#  listings on slow network storage overlap.
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import config
+
+SYNC_STATE_DIR = getattr(
+    config, 'SYNC_STATE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(config.__file__)), '.sync_state'))
+
+# Directories listed concurrently while scanning
+SCAN_THREADS = getattr(config, 'SCAN_THREADS', 8)
+
+
+class DirectorySnapshot:
+    """
+    The per-directory state of one scanned tree, persisted as JSON.
+
+    `dirs` maps a directory path to {'mtime': ns, 'files': [...], 'subdirs': [...]}
+    with file and subdirectory names relative to that directory.
+    """
+    def __init__(self, root, dirs=None, path=None):
+        self.root = root
+        self.dirs = dirs or {}
+        self.path = path
+
+    @classmethod
+    def for_table(cls, table_name, root):
+        """
+        Loads the snapshot saved for a table, or an empty one if there is
+        none or it was taken of a different root.
+        """
+        path = os.path.join(SYNC_STATE_DIR, f"{table_name}.json")
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('root') == root:
+                return cls(root, data.get('dirs', {}), path)
+        except (OSError, ValueError):
+            pass
+        return cls(root, {}, path)
+
+    @property
+    def is_empty(self):
+        return not self.dirs
+
+    def files(self):
+        """
+        Returns the set of matching file paths recorded in the snapshot.
+        """
+        return {os.path.join(directory, name)
+                for directory, entry in self.dirs.items() for name in entry['files']}
+
+    def save(self):
+        """
+        Writes the snapshot atomically so an interrupted run never leaves a
+        truncated file behind.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'root': self.root, 'dirs': self.dirs}, f)
+        os.replace(temp_path, self.path)
+
+
+def list_directory(directory, matches):
+    """
+    Lists one directory like a single os.walk step: matching file names and
+    the subdirectories to descend into (symlinked directories are skipped).
+    """
+    files, subdirs = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                elif matches(entry.name):
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return files, subdirs
+
+
+def extension_matcher(extensions):
+    """
+    Returns a matcher that accepts file names ending in one of `extensions`
+    (compared case-insensitively, e.g. {'.mp4', '.mkv'}).
+    """
+    extensions = frozenset(ext.lower() for ext in extensions)
+    def matches(name):
+        return os.path.splitext(name)[1].lower() in extensions
+    return matches
+
+
+def _visit(directory, matches, old_entry):
+    """
+    Produces the snapshot entry for one directory. Returns (entry, listed)
+    or (None, False) if the directory cannot be read.
+    """
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return None, False
+    if old_entry is not None and old_entry['mtime'] == mtime:
+        return old_entry, False
+    try:
+        files, subdirs = list_directory(directory, matches)
+    except OSError:
+        return None, False
+    return {'mtime': mtime, 'files': files, 'subdirs': subdirs}, True
+
+
+def scan_trees(jobs, matches, workers=SCAN_THREADS):
+    """
+    Scans several trees at once on a bounded thread pool. Every directory is
+    its own task, so independent roots and large subtrees of one root are
+    listed concurrently; on network storage the time goes into waiting on
+    directory listings, which threads overlap well.
+
+    Args:
+        jobs (list): (key, root, previous_snapshot_or_None) tuples.
+        matches (callable): Takes a file name, returns True to keep it.
+        workers (int): Maximum number of directories listed at once.
+
+    Returns:
+        dict: key -> (DirectorySnapshot, stats) as returned by scan_tree().
+    """
+    results = {}
+    for key, root, previous in jobs:
+        results[key] = (DirectorySnapshot(root, {}, previous.path if previous else None),
+                        {'listed': 0, 'reused': 0})
+    old_dirs = {key: (previous.dirs if previous else {}) for key, _, previous in jobs}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {}
+
+        def submit(key, directory):
+            future = executor.submit(_visit, directory, matches, old_dirs[key].get(directory))
+            pending[future] = (key, directory)
+
+        for key, root, _ in jobs:
+            submit(key, root)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, directory = pending.pop(future)
+                entry, listed = future.result()
+                if entry is None:
+                    continue
+                snapshot, stats = results[key]
+                snapshot.dirs[directory] = entry
+                stats['listed' if listed else 'reused'] += 1
+                for name in entry['subdirs']:
+                    submit(key, os.path.join(directory, name))
+    return results
+
+
+def scan_tree(root, matches, previous=None, workers=SCAN_THREADS):
+    """
+    Walks `root` and returns (snapshot, stats). Directories whose mtime
+    matches the `previous` snapshot are reused without being listed.
+
+    Args:
+        root (str): The folder to scan.
+        matches (callable): Takes a file name, returns True to keep it.
+        previous (DirectorySnapshot): The last run's snapshot, if any.
+        workers (int): Maximum number of directories listed at once.
+
+    Returns:
+        tuple: The new DirectorySnapshot and a dict with the number of
+        directories 'listed' and 'reused'.
+    """
+    return scan_trees([(root, root, previous)], matches, workers)[root]
+
+
+def iter_files(root, matches):
+    """
+    Yields matching file paths under `root` as directories are listed, so a
+    consumer can start work before the whole tree has been walked.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            files, subdirs = list_directory(directory, matches)
+        except OSError:
+            continue
+        for name in files:
+            yield os.path.join(directory, name)
+        stack.extend(os.path.join(directory, name) for name in reversed(subdirs))
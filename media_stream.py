@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   media_stream.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Helpers behind OV.stream_with_range_support that do not depend on Flask:
+#  MIME type lookup, the chunked file reader used as the streaming fallback,
+#  the headers for handing a file off to a front proxy (nginx
+#  X-Accel-Redirect or Apache/lighttpd X-Sendfile), and the cache that
+#  resolves /stream/<table>/<id> without a database query.
+
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import quote
+import config
+from catalog import catalog_version
+
+# How file bodies are sent:
+#   'auto'             - use the server's wsgi.file_wrapper (gunicorn turns it
+#                        into os.sendfile) when available, else read_chunks()
+#   'generator'        - always read the file in Python with read_chunks()
+#   'x-accel-redirect' - let nginx send the file (needs STREAM_ACCEL_ROOTS)
+#   'x-sendfile'       - let Apache/lighttpd send the file
+STREAM_MODE = getattr(config, 'STREAM_MODE', 'auto')
+
+# For 'x-accel-redirect': pairs of (filesystem root, internal nginx location)
+STREAM_ACCEL_ROOTS = getattr(config, 'STREAM_ACCEL_ROOTS', [])
+
+# Cache-Control sent with /stream responses. Together with the ETag and
+# Last-Modified validators this lets browsers and Cloudflare reuse bytes they
+# already have; set to None to send no Cache-Control header.
+STREAM_CACHE_CONTROL = getattr(config, 'STREAM_CACHE_CONTROL', 'public, max-age=86400')
+
+# Base URL of stream_server.py (e.g. 'https://stream.example.com') when
+# streams are served by it instead of the Flask /stream route
+STREAM_BASE_URL = getattr(config, 'STREAM_BASE_URL', None)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Items /stream keeps resolved per worker, and for how many seconds. A
+# player sends many range requests for one file while seeking; with the
+# item cached each of them costs a stat() instead of a SELECT.
+STREAM_ITEM_CACHE_SIZE = getattr(config, 'STREAM_ITEM_CACHE_SIZE', 1024)
+STREAM_ITEM_CACHE_TTL = getattr(config, 'STREAM_ITEM_CACHE_TTL', 60)
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.wav', '.flac')
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov')
+
+# Fallback for items the sync probe has not filled mime_type in for yet
+EXTENSION_MIME_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.aac': 'audio/aac',
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg',
+    '.opus': 'audio/ogg',
+    '.mp4': 'video/mp4',
+    '.m4v': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+    '.flv': 'video/x-flv',
+    '.wmv': 'video/x-ms-wmv',
+    '.mpg': 'video/mpeg',
+    '.mpeg': 'video/mpeg',
+}
+
+# Types <video>/<audio> can be told about in a <source type=...> attribute.
+# Others (Matroska, AVI, ...) are left untyped so the browser tries the
+# stream instead of skipping it on a type it does not claim to support.
+PLAYER_SOURCE_TYPES = frozenset({
+    'video/mp4', 'video/webm', 'video/ogg',
+    'audio/mpeg', 'audio/mp4', 'audio/aac', 'audio/wav', 'audio/flac', 'audio/ogg', 'audio/webm',
+})
+
+def guess_mime_type(path):
+    """
+    Returns the Content-Type to serve a media file with, based on its extension.
+    """
+    file_extension = os.path.splitext(path)[1].lower()
+    return EXTENSION_MIME_TYPES.get(file_extension, 'application/octet-stream')
+
+def item_mime_type(item):
+    """
+    Returns the MIME type stored for a catalog row by the sync probe, or the
+    one guessed from its file extension.
+    """
+    return item.get('mime_type') or guess_mime_type(item.get('file_path') or '')
+
+def player_source_type(mime_type):
+    """
+    Returns the type to put on the player's <source> element, or None.
+    """
+    return mime_type if mime_type in PLAYER_SOURCE_TYPES else None
+
+def stream_url(table_name, item_id):
+    """
+    Returns the URL on STREAM_BASE_URL for an item, or None when streams are
+    served by the Flask app itself.
+    """
+    if not STREAM_BASE_URL:
+        return None
+    return f"{STREAM_BASE_URL.rstrip('/')}/stream/{quote(table_name)}/{item_id}"
+
+def read_chunks(file, start, length, chunk_size=STREAM_CHUNK_SIZE, close=True, shaper=None):
+    """
+    Yields `length` bytes of an open file starting at `start`. The file is
+    closed afterwards unless `close` is False.
+
+    With a bandwidth.Shaper the shaper picks each chunk's size and the
+    generator sleeps as long as its token bucket asks before reading; the
+    time until the next chunk is requested is taken as the time the server
+    needed to write the previous one.
+    """
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            size = min(remaining, shaper.chunk_size() if shaper else chunk_size)
+            if shaper:
+                wait = shaper.delay(size)
+                if wait:
+                    time.sleep(wait)
+            data = file.read(size)
+            if not data:
+                break
+            sent_at = time.monotonic()
+            yield data
+            if shaper:
+                shaper.sent(len(data), time.monotonic() - sent_at)
+            remaining -= len(data)
+    finally:
+        if close:
+            file.close()
+
+def accel_redirect_uri(path):
+    """
+    Maps a file path onto its internal nginx location, or None if the path
+    is not under any of the STREAM_ACCEL_ROOTS.
+    """
+    for root, location in STREAM_ACCEL_ROOTS:
+        root = root.rstrip('/') + '/'
+        if path.startswith(root):
+            return location.rstrip('/') + '/' + quote(path[len(root):])
+    return None
+
+def offload_headers(path):
+    """
+    Returns the headers that hand the file to the front proxy in the
+    configured STREAM_MODE, or None to serve it from the app.
+    """
+    if STREAM_MODE == 'x-sendfile':
+        return {'X-Sendfile': quote(path)}
+    if STREAM_MODE == 'x-accel-redirect':
+        uri = accel_redirect_uri(path)
+        if uri:
+            return {'X-Accel-Redirect': uri}
+    return None
+
+
+# A resolved /stream target: the catalog row's path, MIME type and bitrate
+# (bits/s, None if not probed) plus the file's os.stat() result (size,
+# mtime and the ETag inputs)
+StreamItem = namedtuple('StreamItem', 'path mime_type stat bitrate')
+
+def _same_file(a, b):
+    return (a.st_ino, a.st_size, a.st_mtime_ns) == (b.st_ino, b.st_size, b.st_mtime_ns)
+
+class StreamItemCache:
+    """
+    Process-wide LRU of (table, item_id) -> StreamItem.
+
+    Every hit re-stat()s the file: if its inode, size or mtime no longer
+    match, or it is gone, the entry is dropped and the row is read again.
+    Entries also expire after `ttl` seconds, and the whole cache is cleared
+    when the sync scripts bump the catalog stamp.
+    """
+    def __init__(self, loader, size=STREAM_ITEM_CACHE_SIZE, ttl=STREAM_ITEM_CACHE_TTL):
+        self.loader = loader    # loader(table, item_id) -> catalog row dict or None
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (StreamItem, loaded_at)
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.size > 0 and self.ttl > 0
+
+    def get(self, table_name, item_id):
+        """
+        Returns the StreamItem for a catalog row, or None if the row does not
+        exist or has no file path. Raises OSError if the file cannot be
+        stat()ed.
+        """
+        key = (table_name, item_id)
+        if self.enabled:
+            with self._lock:
+                version = catalog_version()
+                if version != self._version:
+                    self._items.clear()
+                    self._version = version
+                entry = self._items.get(key)
+                if entry and time.monotonic() - entry[1] < self.ttl:
+                    self._items.move_to_end(key)
+                    cached = entry[0]
+                else:
+                    cached = None
+            if cached is not None:
+                try:
+                    if _same_file(os.stat(cached.path), cached.stat):
+                        return cached
+                except OSError:
+                    pass
+                self.invalidate(table_name, item_id)
+
+        row = self.loader(table_name, item_id)
+        if not (row and row.get('file_path')):
+            return None
+        path = row['file_path']
+        item = StreamItem(path, item_mime_type(row), os.stat(path), row.get('bitrate'))
+        if self.enabled:
+            with self._lock:
+                self._items[key] = (item, time.monotonic())
+                self._items.move_to_end(key)
+                while len(self._items) > self.size:
+                    self._items.popitem(last=False)
+        return item
+
+    def invalidate(self, table_name=None, item_id=None):
+        """
+        Forgets one item, or everything when no item is given.
+        """
+        with self._lock:
+            if table_name is None:
+                self._items.clear()
+            else:
+                self._items.pop((table_name, item_id), None)
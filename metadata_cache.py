@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   metadata_cache.py
+#
+#  Copyright 2025 AL Haines
+#
+#  On-disk cache of per-file metadata (audio tags, media probe results) for
+#  the sync scripts. Entries are keyed by path and validated against the
+#  file's size, mtime and inode, so rebuilding or re-importing a table only
+#  costs a stat() per unchanged file instead of a full parse. Stored in a
+#  SQLite file next to config.py.
+
+import json
+import os
+import sqlite3
+import config
+
+METADATA_CACHE_FILE = getattr(
+    config, 'METADATA_CACHE_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(config.__file__)), 'metadata_cache.sqlite3'))
+
+
+def file_key(path):
+    """
+    Returns the (size, mtime_ns, inode) triple a cache entry is validated
+    against, or None if the file cannot be stat()ed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class MetadataCache:
+    """
+    A small SQLite table of (kind, path) -> metadata dict. `kind` separates
+    independent extractors, e.g. 'audio_tags' and 'mediainfo'.
+    """
+    def __init__(self, path=METADATA_CACHE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (kind, path)
+            )
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, path, key):
+        """
+        Returns the cached metadata for a file if `key` (from file_key())
+        still matches what was stored, else None.
+        """
+        if key is None:
+            self.misses += 1
+            return None
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, data FROM metadata WHERE kind = ? AND path = ?",
+            (kind, path)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[3])
+
+    def put(self, kind, path, key, data):
+        """
+        Stores metadata for a file. Call commit() to make a batch durable.
+        """
+        if key is None:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO metadata (kind, path, size, mtime_ns, inode, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, path) + tuple(key) + (json.dumps(data),))
+
+    def prune(self, kind, root, keep_paths):
+        """
+        Evicts entries under `root` whose file is no longer in `keep_paths`
+        (the files seen by the scan that just ran).
+
+        Returns:
+            int: The number of entries removed.
+        """
+        prefix = root.rstrip(os.sep) + os.sep
+        rows = self.conn.execute(
+            "SELECT path FROM metadata WHERE kind = ? AND substr(path, 1, ?) = ?",
+            (kind, len(prefix), prefix)).fetchall()
+        gone = [(kind, path) for (path,) in rows if path not in keep_paths]
+        self.conn.executemany("DELETE FROM metadata WHERE kind = ? AND path = ?", gone)
+        self.conn.commit()
+        return len(gone)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
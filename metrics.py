@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   metrics.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Counters, gauges and histograms for GET /metrics (Prometheus text
+#  format). Every process that records something (each gunicorn worker,
+#  stream_server.py, a sync_media.py run) keeps its values in memory and a
+#  background thread writes them every METRICS_FLUSH_INTERVAL seconds to
+#  METRICS_DIR/<pid>-<start>.json, plus once more at exit. /metrics adds up
+#  the files of all processes, so it shows the same totals whichever worker
+#  answers. Files of processes that have exited are folded into
+#  archive.json, keeping counters from going backwards when a worker is
+#  restarted. METRICS_DIR is a private directory (see private_files.py):
+#  files in it that are symlinks or belong to another user are ignored.
+#  All metrics are declared at the bottom of this module.
+
+import atexit
+import fcntl
+import json
+import math
+import os
+import sys
+import threading
+import time
+import config
+from private_files import RUNTIME_DIR, ensure_private_dir, open_private
+
+# Directory shared by the processes; '' keeps metrics per process only
+METRICS_DIR = getattr(config, 'METRICS_DIR', os.path.join(RUNTIME_DIR, 'metrics'))
+
+METRICS_FLUSH_INTERVAL = getattr(config, 'METRICS_FLUSH_INTERVAL', 5)
+
+ARCHIVE_FILE = 'archive.json'
+
+# Seconds; HTTP requests and DB calls
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        registry.metrics[name] = self
+
+    def _update(self, labels, update):
+        registry = self.registry
+        key = _label_key(labels)
+        with registry.lock:
+            values = registry.values.setdefault(self.name, {})
+            values[key] = update(values.get(key))
+            registry.dirty = True
+        registry.start()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._update(labels, lambda value: (value or 0) + amount)
+
+
+class Gauge(_Metric):
+    """
+    `merge` is how processes combine: 'sum' adds the values of running
+    processes (open streams), 'last' keeps the most recently written value,
+    including from processes that have exited (the last sync run).
+    """
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, merge='sum'):
+        super().__init__(registry, name, help)
+        self.merge = merge
+
+    def inc(self, amount=1, **labels):
+        self._update(labels, lambda value: (value or 0) + amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._update(labels, lambda _: value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, buckets):
+        super().__init__(registry, name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        # Stored as [count per bucket..., count above the last, sum]
+        def update(current):
+            current = current or [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    current[i] += 1
+                    break
+            else:
+                current[len(self.buckets)] += 1
+            current[-1] += value
+            return current
+        self._update(labels, update)
+
+
+class Registry:
+    def __init__(self, directory=METRICS_DIR, interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.metrics = {}
+        self.values = {}     # metric name -> {label key: value}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._thread = None
+        self._started_at = time.time()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked worker starts from zero and gets its own file and thread
+        self.lock = threading.Lock()
+        self.values = {}
+        self.dirty = False
+        self._thread = None
+        self._started_at = time.time()
+
+    def counter(self, name, help):
+        return Counter(self, name, help)
+
+    def gauge(self, name, help, merge='sum'):
+        return Gauge(self, name, help, merge)
+
+    def histogram(self, name, help, buckets=REQUEST_BUCKETS):
+        return Histogram(self, name, help, buckets)
+
+    # --- files shared between processes ---
+
+    def _path(self):
+        return os.path.join(self.directory, f"{os.getpid()}-{int(self._started_at * 1000)}.json")
+
+    def _snapshot(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                'pid': os.getpid(),
+                'written': time.time(),
+                'values': {name: [[list(map(list, key)), value] for key, value in values.items()]
+                           for name, values in self.values.items()},
+            }
+
+    def flush(self):
+        """
+        Writes this process's values to its file.
+        """
+        if not self.directory:
+            return
+        snapshot = self._snapshot()
+        try:
+            ensure_private_dir(self.directory)
+            _write_json(self._path(), snapshot)
+        except OSError as e:
+            print(f"Error writing metrics: {e}", file=sys.stderr)
+
+    def start(self):
+        # Started lazily so the thread lives in the process that records
+        if self._thread is not None or not self.directory:
+            return
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if self.dirty:
+                self.flush()
+
+    def _load_all(self):
+        """
+        Returns the snapshots of every process, folding those of exited
+        processes into the archive first.
+        """
+        if not self.directory:
+            return [self._snapshot()]
+        self.flush()
+        snapshots, dead = [], []
+        try:
+            ensure_private_dir(self.directory)
+            names = os.listdir(self.directory)
+        except OSError as e:
+            print(f"Error reading metrics: {e}", file=sys.stderr)
+            return [self._snapshot()]
+        for name in names:
+            if not name.endswith('.json') or name == ARCHIVE_FILE:
+                continue
+            path = os.path.join(self.directory, name)
+            snapshot = _read_json(path)
+            if snapshot is None:
+                continue
+            if _pid_alive(snapshot.get('pid')):
+                snapshots.append(snapshot)
+            else:
+                dead.append((path, snapshot))
+        archive = self._archive(dead)
+        if archive:
+            snapshots.append(archive)
+        return snapshots
+
+    def _archive(self, dead):
+        path = os.path.join(self.directory, ARCHIVE_FILE)
+        try:
+            with os.fdopen(open_private(os.path.join(self.directory, '.lock')), 'r') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                archive = _read_json(path) or {'pid': None, 'written': 0, 'values': {}}
+                # Another process may have archived some of them meanwhile
+                dead = [(dead_path, snapshot) for dead_path, snapshot in dead if os.path.exists(dead_path)]
+                if not dead:
+                    return archive
+                dead.sort(key=lambda entry: entry[1].get('written', 0))
+                merged = self._merge([archive] + [snapshot for _, snapshot in dead], live_only=False)
+                archive = {'pid': None, 'written': max(archive['written'], dead[-1][1].get('written', 0)),
+                           'values': {name: [[list(map(list, key)), value] for key, value in values.items()]
+                                      for name, values in merged.items()}}
+                _write_json(path, archive)
+                for dead_path, _ in dead:
+                    try:
+                        os.unlink(dead_path)
+                    except FileNotFoundError:
+                        pass
+                return archive
+        except OSError as e:
+            print(f"Error archiving metrics: {e}", file=sys.stderr)
+            return None
+
+    def _merge(self, snapshots, live_only=True):
+        """
+        Combines snapshots (oldest first) into {name: {label key: value}}.
+        'sum' gauges are only taken from running processes.
+        """
+        merged = {}
+        for snapshot in sorted(snapshots, key=lambda s: s.get('written', 0)):
+            is_archive = snapshot.get('pid') is None
+            for name, entries in snapshot.get('values', {}).items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in entries:
+                    key = tuple(tuple(pair) for pair in key)
+                    if metric.kind == 'gauge':
+                        if metric.merge == 'last':
+                            target[key] = value
+                        elif live_only and not is_archive:
+                            target[key] = target.get(key, 0) + value
+                    elif metric.kind == 'histogram':
+                        current = target.get(key)
+                        if current is None or len(current) != len(value):
+                            target[key] = list(value)
+                        else:
+                            target[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target[key] = target.get(key, 0) + value
+        return merged
+
+    def render(self):
+        """
+        Returns all metrics, combined across processes, in the Prometheus
+        text exposition format.
+        """
+        merged = self._merge(self._load_all())
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else repr(float(bound))
+                        lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(value[-1])}")
+                    lines.append(f"{name}_count{_labels(key)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    if not key:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path):
+    # Symlinks and files of other users are refused by open_private
+    try:
+        with os.fdopen(open_private(path, os.O_RDONLY), encoding='utf-8') as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _write_json(path, data):
+    # Readers never see a half-written file
+    temporary = f"{path}.tmp"
+    with os.fdopen(open_private(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC), 'w',
+                   encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+REGISTRY = Registry()
+
+# HTTP (app.py)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'mediaplayer_http_request_duration_seconds',
+    'Time until the response headers, by route, method and status.')
+
+# MySql.MySQL
+DB_CONNECT_SECONDS = REGISTRY.histogram(
+    'mediaplayer_db_connect_seconds',
+    'Time to check a connection out of the pool.', DB_BUCKETS)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'mediaplayer_db_query_duration_seconds',
+    'Time to execute a query and fetch its rows, by operation (get_data/put_data).', DB_BUCKETS)
+DB_ERRORS = REGISTRY.counter(
+    'mediaplayer_db_errors_total',
+    'Connection and query errors, by operation.')
+
+# /stream (OV.py, stream_server.py)
+STREAMS_ACTIVE = REGISTRY.gauge(
+    'mediaplayer_streams_active',
+    'Stream responses currently being sent, by server.')
+STREAM_BYTES = REGISTRY.counter(
+    'mediaplayer_stream_bytes_total',
+    'Body bytes sent by /stream, by server and category. Ranges the app hands to the '
+    'server for sendfile are counted whole when the response closes, even if the client '
+    'disconnected part way.')
+
+# sync_media.py
+SYNC_RUNS = REGISTRY.counter(
+    'mediaplayer_sync_runs_total',
+    'sync_media.py runs, by mode (incremental/full) and result.')
+SYNC_FILES = REGISTRY.counter(
+    'mediaplayer_sync_files_total',
+    'Files scanned, inserted, deleted and probed by sync_media.py, by table.')
+SYNC_LAST_FILES = REGISTRY.gauge(
+    'mediaplayer_sync_last_run_files',
+    'Files scanned, inserted, deleted and probed by the last sync of each table.', merge='last')
+SYNC_TABLE_SECONDS = REGISTRY.gauge(
+    'mediaplayer_sync_table_duration_seconds',
+    'Duration of the last sync of each table.', merge='last')
+SYNC_LAST_SECONDS = REGISTRY.gauge(
+    'mediaplayer_sync_last_run_duration_seconds',
+    'Duration of the last sync_media.py run.', merge='last')
+SYNC_LAST_TIMESTAMP = REGISTRY.gauge(
+    'mediaplayer_sync_last_run_timestamp_seconds',
+    'When the last sync_media.py run finished (Unix time).', merge='last')
+
+
+def instrument(app):
+    """
+    Records the latency of every request handled by a Flask app, including
+    ones that fail with an unhandled exception.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    def record(status):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    route=route, method=request.method, status=status)
+
+    @app.after_request
+    def _record_request(response):
+        # Time to the response headers, also for streamed bodies
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _record_failed_request(error):
+        # after_request is skipped when a view raises; those end up as 500s
+        record(500)
+
+    return app
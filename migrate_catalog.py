@@ -0,0 +1,151 @@
+#!/home/al/miniconda3/envs/py/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2025 AL Haines <alfredhaines@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   filename: migrate_catalog.py
+#
+"""
+One-time migration for existing media tables.
+
+Adds the indexed `folder` and `parent_dir` columns to every table in
+table_list and audio_table_list and backfills them from file_path, so the
+web app can look a folder's items up by equality instead of LIKE scans,
+indexes album where a table has one (player page playlists), then builds
+the folder/album directory index used by /get_folders and /get_albums.
+
+Also adds the media probe columns (duration, container, video_codec,
+audio_codec, bitrate, mime_type). Those are filled by the next
+sync_media.py run, which probes every row whose mime_type is still empty.
+
+Safe to run again: existing columns and indexes are left alone and only
+rows with an empty folder column are backfilled.
+
+Usage:
+    python3 migrate_catalog.py [table ...]
+"""
+
+import argparse
+import pymysql
+from config import mysql_config, table_list, audio_table_list
+from catalog import bump_catalog_version, folder_values, rebuild_directory_index, table_columns
+
+BATCH_SIZE = 1000
+
+COLUMN_DEFINITIONS = {
+    'folder': "ADD COLUMN folder VARCHAR(255) NULL",
+    'parent_dir': "ADD COLUMN parent_dir VARCHAR(1024) NULL",
+    'duration': "ADD COLUMN duration DOUBLE NULL",
+    'container': "ADD COLUMN container VARCHAR(64) NULL",
+    'video_codec': "ADD COLUMN video_codec VARCHAR(64) NULL",
+    'audio_codec': "ADD COLUMN audio_codec VARCHAR(64) NULL",
+    'bitrate': "ADD COLUMN bitrate BIGINT NULL",
+    'mime_type': "ADD COLUMN mime_type VARCHAR(100) NULL",
+}
+
+INDEX_DEFINITIONS = {
+    'idx_folder': "ADD INDEX idx_folder (folder)",
+    'idx_parent_dir': "ADD INDEX idx_parent_dir (parent_dir(255))",
+    # Lets the sync probe find unprobed rows without a table scan
+    'idx_mime_type': "ADD INDEX idx_mime_type (mime_type)",
+}
+
+# Added only to tables that have the column and no index starting with it
+OPTIONAL_INDEX_DEFINITIONS = {
+    # Album playlists on the player page are read by album
+    'idx_album': ('album', "ADD INDEX idx_album (album(191))"),
+}
+
+
+def table_indexes(cursor, table_name):
+    """Returns the set of index names defined on a table."""
+    cursor.execute(f"SHOW INDEX FROM `{table_name}`")
+    return {row[2] for row in cursor.fetchall()}
+
+
+def leading_index_columns(cursor, table_name):
+    """Returns the set of columns that are the first column of some index."""
+    cursor.execute(f"SHOW INDEX FROM `{table_name}`")
+    return {row[4] for row in cursor.fetchall() if row[3] == 1}
+
+
+def add_catalog_columns(connection, table_name):
+    """
+    Adds any missing folder/probe columns and indexes to a table.
+
+    Returns:
+        list: The ALTER clauses that were applied.
+    """
+    cursor = connection.cursor()
+    columns = table_columns(cursor, table_name)
+    clauses = [ddl for column, ddl in COLUMN_DEFINITIONS.items() if column not in columns]
+    indexes = table_indexes(cursor, table_name)
+    clauses += [ddl for index, ddl in INDEX_DEFINITIONS.items() if index not in indexes]
+    leading = leading_index_columns(cursor, table_name)
+    clauses += [ddl for index, (column, ddl) in OPTIONAL_INDEX_DEFINITIONS.items()
+                if column in columns and column not in leading and index not in indexes]
+    if clauses:
+        cursor.execute(f"ALTER TABLE `{table_name}` " + ", ".join(clauses))
+        connection.commit()
+    return clauses
+
+
+def backfill_folders(connection, folder_path, table_name):
+    """
+    Fills folder/parent_dir for rows that do not have them yet.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT id, file_path FROM `{table_name}` WHERE folder IS NULL AND file_path IS NOT NULL")
+    rows = cursor.fetchall()
+    updated = 0
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = [folder_values(folder_path, file_path) + (row_id,)
+                 for row_id, file_path in rows[i:i + BATCH_SIZE]]
+        cursor.executemany(f"UPDATE `{table_name}` SET folder = %s, parent_dir = %s WHERE id = %s", batch)
+        connection.commit()
+        updated += len(batch)
+    return updated
+
+
+def migrate(selected_tables=None):
+    try:
+        connection = pymysql.connect(**mysql_config)
+    except pymysql.Error as e:
+        print(f"Error: Unable to connect to the database. {e}")
+        return
+
+    changed = False
+    for folder_path, table_name in list(table_list) + list(audio_table_list):
+        if selected_tables and table_name not in selected_tables:
+            continue
+        try:
+            clauses = add_catalog_columns(connection, table_name)
+            if clauses:
+                print(f"{table_name}: applied {', '.join(clauses)}")
+            updated = backfill_folders(connection, folder_path, table_name)
+            print(f"{table_name}: backfilled folder columns for {updated} rows")
+            indexed = rebuild_directory_index(connection, table_name)
+            print(f"{table_name}: {indexed} directory index entries updated")
+            changed = changed or bool(clauses) or updated > 0 or indexed > 0
+        except pymysql.Error as e:
+            connection.rollback()
+            print(f"Error migrating {table_name}: {e}")
+
+    connection.close()
+    if changed:
+        bump_catalog_version()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tables', nargs='*', help="Only migrate these tables (default: all configured tables)")
+    args = parser.parse_args()
+    migrate(args.tables)
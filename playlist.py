@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   playlist.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Playlists for the player page. An item's playlist is its album, or else
+#  the directory it sits in. It is read with one indexed query, kept as
+#  compact tuples together with an id -> position map, and cached per
+#  (table, album/directory) until the sync scripts bump the catalog stamp.
+#  The player then gets only a window of entries around the current item
+#  plus the ids of the previous, next and a random item, so rendering costs
+#  the same for a 10-track album as for a 5000-file folder.
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import config
+from catalog import catalog_version
+
+# Entries sent to the player on each side of the current item
+PLAYLIST_WINDOW = getattr(config, 'PLAYLIST_WINDOW', 25)
+
+# Playlists cached per worker, and for how many seconds
+PLAYLIST_CACHE_SIZE = getattr(config, 'PLAYLIST_CACHE_SIZE', 256)
+PLAYLIST_CACHE_TTL = getattr(config, 'PLAYLIST_CACHE_TTL', 300)
+
+
+class Playlist:
+    """
+    One album or directory: parallel tuples of ids, titles and file paths in
+    play order, plus the position of each id.
+    """
+    def __init__(self, rows):
+        self.ids = tuple(row['id'] for row in rows)
+        self.titles = tuple(row['title'] for row in rows)
+        self.paths = tuple(row.get('file_path') for row in rows)
+        self.positions = {item_id: i for i, item_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def entry(self, i):
+        return {'id': self.ids[i], 'title': self.titles[i]}
+
+
+# What render_player_page needs: `entries` is the window of {'id', 'title'}
+# dicts starting at absolute position `offset`; `index` is the current
+# item's position (-1 if not found) and the *_id / *_path fields are None
+# when there is no such item.
+PlaylistView = namedtuple('PlaylistView', 'entries offset index total prev_id next_id random_id next_path random_path')
+
+EMPTY_VIEW = PlaylistView([], 0, -1, 0, None, None, None, None, None)
+
+
+def playlist_key(table_name, item, features):
+    """
+    Returns (cache key, query, params) for an item's playlist, or None if
+    it has neither an album nor a file path.
+    """
+    if item.get('album') is not None:
+        # FIX: Only order by track_number if the column exists in the table.
+        order_by_clause = "track_number, title ASC" if features['track_number'] else "title ASC"
+        query = f"SELECT id, title, file_path FROM `{table_name}` WHERE album = %s ORDER BY {order_by_clause}"
+        return (table_name, 'album', item['album']), query, (item['album'],)
+    file_path = item.get('file_path')
+    if not file_path:
+        return None
+    if features['parent_dir']:
+        # Everything in the same directory, via the indexed parent_dir column
+        directory = os.path.dirname(file_path)
+        query = f"SELECT id, title, file_path FROM `{table_name}` WHERE parent_dir = %s ORDER BY title ASC"
+        return (table_name, 'dir', directory), query, (directory,)
+    folder = os.path.basename(os.path.dirname(file_path))
+    query = f"SELECT id, title, file_path FROM `{table_name}` WHERE file_path LIKE %s ORDER BY title ASC"
+    return (table_name, 'folder', folder), query, (f'%/{folder}/%',)
+
+
+class PlaylistCache:
+    """
+    Process-wide LRU of playlists. Cleared when the catalog stamp moves;
+    entries also expire after `ttl` seconds.
+    """
+    def __init__(self, size=PLAYLIST_CACHE_SIZE, ttl=PLAYLIST_CACHE_TTL, window=PLAYLIST_WINDOW):
+        self.size = size
+        self.ttl = ttl
+        self.window = window
+        self._playlists = OrderedDict()  # key -> (Playlist, loaded_at)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            version = catalog_version()
+            if version != self._version:
+                self._playlists.clear()
+                self._version = version
+            entry = self._playlists.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self._playlists.move_to_end(key)
+                return entry[0]
+            return None
+
+    def _store(self, key, playlist):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._playlists[key] = (playlist, time.monotonic())
+            self._playlists.move_to_end(key)
+            while len(self._playlists) > self.size:
+                self._playlists.popitem(last=False)
+
+    def get(self, db, table_name, item):
+        """
+        Returns the Playlist for a catalog row, loading it through `db` on a
+        miss or when the cached copy does not contain the item yet.
+        """
+        spec = playlist_key(table_name, item, db.get_table_features(table_name))
+        if spec is None:
+            return None
+        key, query, params = spec
+        playlist = self._cached(key)
+        if playlist is None or item['id'] not in playlist.positions:
+            playlist = Playlist(db.get_data(query, params) or [])
+            self._store(key, playlist)
+        return playlist
+
+    def view(self, db, table_name, item):
+        """
+        Returns the PlaylistView around `item`.
+        """
+        playlist = self.get(db, table_name, item)
+        if not playlist:
+            return EMPTY_VIEW
+        total = len(playlist)
+        index = playlist.positions.get(item['id'], -1)
+
+        centre = max(index, 0)
+        start = max(0, centre - self.window)
+        end = min(total, centre + self.window + 1)
+        entries = [playlist.entry(i) for i in range(start, end)]
+
+        prev_index = index - 1 if index > 0 else None
+        next_index = index + 1 if -1 < index < total - 1 else None
+        # The Random button's pick: any other item, if there is one
+        if index > -1 and total > 1:
+            random_index = random.randrange(total - 1)
+            if random_index >= index:
+                random_index += 1
+        else:
+            random_index = random.randrange(total)
+
+        def field(values, i):
+            return values[i] if i is not None else None
+
+        return PlaylistView(entries, start, index, total,
+                            field(playlist.ids, prev_index), field(playlist.ids, next_index),
+                            field(playlist.ids, random_index),
+                            field(playlist.paths, next_index), field(playlist.paths, random_index))
+
+    def invalidate(self):
+        with self._lock:
+            self._playlists.clear()
+
+
+PLAYLISTS = PlaylistCache()
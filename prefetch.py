@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   prefetch.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Page cache warming for playlists. When the player page is rendered, the
+#  start of the next item (and of the item the Random button will pick) is
+#  queued here, and a background thread asks the kernel to read it ahead
+#  with posix_fadvise(WILLNEED). On spinning disks and NAS mounts the next
+#  episode then starts without waiting for the drive. So that a file
+#  already warmed is not hinted again on every page view, the regions
+#  hinted in the last PREFETCH_TTL seconds are remembered in an LRU of at
+#  most PREFETCH_BUDGET bytes; once forgotten, a file is warmed again the
+#  next time it is queued, in case the kernel has evicted it meanwhile.
+#  Nothing is ever dropped from the cache here: it is shared by every
+#  worker and stream_server.py, so evicting is left to the kernel, which
+#  knows what is still being read.
+
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+import config
+
+# Bytes warmed at the start of each prefetched file; 0 disables prefetching
+PREFETCH_BYTES = getattr(config, 'PREFETCH_BYTES', 16 * 1024 * 1024)
+
+# Most bytes of recently prefetched data remembered; a file in the LRU is
+# not warmed again
+PREFETCH_BUDGET = getattr(config, 'PREFETCH_BUDGET', 256 * 1024 * 1024)
+
+# Seconds a warmed file is remembered; after that it is warmed again
+PREFETCH_TTL = getattr(config, 'PREFETCH_TTL', 600)
+
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def advise_sequential(file, start, length):
+    """
+    Tells the kernel a stream will read this range of an open file in order,
+    so it reads further ahead. No-op where posix_fadvise is unavailable.
+    """
+    if _HAS_FADVISE:
+        try:
+            os.posix_fadvise(file.fileno(), start, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+class Prefetcher:
+    """
+    Warms the first `nbytes` of queued files on one daemon thread.
+    """
+    def __init__(self, nbytes=PREFETCH_BYTES, budget=PREFETCH_BUDGET, ttl=PREFETCH_TTL):
+        self.nbytes = nbytes
+        self.budget = budget
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=64)
+        self._warmed = OrderedDict()   # path -> (bytes hinted, monotonic time)
+        self._held = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.nbytes > 0 and self.budget > 0
+
+    def request(self, *paths):
+        """
+        Queues files to warm. Never blocks; requests are dropped if the
+        queue is full.
+        """
+        if not self.enabled:
+            return
+        self._ensure_started()
+        for path in paths:
+            if not path:
+                continue
+            with self._lock:
+                if self._remembered(path):
+                    self._warmed.move_to_end(path)
+                    continue
+            try:
+                self._queue.put_nowait(path)
+            except queue.Full:
+                break
+
+    def _remembered(self, path):
+        # Caller holds the lock; forgets the path once its TTL is over
+        entry = self._warmed.get(path)
+        if entry is None:
+            return False
+        if time.monotonic() - entry[1] < self.ttl:
+            return True
+        del self._warmed[path]
+        self._held -= entry[0]
+        return False
+
+    def _warm(self, path):
+        with self._lock:
+            if self._remembered(path):
+                return
+        try:
+            with open(path, 'rb') as file:
+                size = min(self.nbytes, os.fstat(file.fileno()).st_size)
+                if _HAS_FADVISE:
+                    os.posix_fadvise(file.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+                else:
+                    # Read it ourselves; the data lands in the page cache
+                    remaining = size
+                    while remaining > 0:
+                        data = file.read(min(remaining, 1024 * 1024))
+                        if not data:
+                            break
+                        remaining -= len(data)
+        except OSError:
+            return
+        with self._lock:
+            if path in self._warmed:
+                self._held -= self._warmed.pop(path)[0]
+            self._warmed[path] = (size, time.monotonic())
+            self._held += size
+            while self._held > self.budget and len(self._warmed) > 1:
+                _, (old_size, _) = self._warmed.popitem(last=False)
+                self._held -= old_size
+
+    def _ensure_started(self):
+        # Started lazily so the thread lives in the gunicorn worker
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._warm(path)
+            except Exception as e:
+                print(f"Error prefetching {path}: {e}", file=sys.stderr)
+
+
+PREFETCHER = Prefetcher()
@@ -24,9 +24,33 @@ FILES=(
   app.py
   OV.py
   MySql.py
+  catalog.py
+  recent_playback.py
+  resume_buffer.py
+  media_stream.py
+  bandwidth.py
+  prefetch.py
+  block_cache.py
+  playlist.py
+  search_index.py
+  metrics.py
+  query_trace.py
+  private_files.py
+  http_range.py
   wsgi.py
   requirements.txt
   sync_media.py
+  migrate_catalog.py
+  media_scanner.py
+  bulk_db.py
+  metadata_cache.py
+  media_probe.py
+  stream_server.py
+  mediaplayer-stream.service
+  bench/synthetic.py
+  bench/bench_http.py
+  bench/bench_sync.py
+  bench/bench_search.py
   prepare_repo.sh
   config.sample.py
   README.md
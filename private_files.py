@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   private_files.py
+#
+#  Copyright 2025 AL Haines
+#
+#  State files the app's processes share with each other (the resume spool,
+#  the bandwidth bucket, metrics snapshots). They live in RUNTIME_DIR, which
+#  must belong to the service user and be writable by nobody else, and are
+#  opened without following symlinks, so another local user can neither
+#  plant a link to a file of ours nor feed us forged state.
+
+import os
+import stat
+import config
+
+# Defaults to .runtime next to config.py; a systemd RuntimeDirectory such as
+# /run/mediaplayer works too
+RUNTIME_DIR = getattr(
+    config, 'RUNTIME_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(config.__file__)), '.runtime'))
+
+_checked = set()
+
+
+def ensure_private_dir(path):
+    """
+    Creates `path` with mode 0700 if it is missing. Raises PermissionError
+    unless it is a real directory owned by this user that neither group nor
+    others can write to.
+    """
+    if path in _checked:
+        return
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o022:
+        raise PermissionError(f"{path} must be a directory owned by this user and writable only by it")
+    _checked.add(path)
+
+
+def open_private(path, flags=os.O_RDWR | os.O_CREAT):
+    """
+    Opens a file in a private directory with O_NOFOLLOW, creating it with
+    mode 0600. Returns the file descriptor.
+    """
+    ensure_private_dir(os.path.dirname(os.path.abspath(path)))
+    fd = os.open(path, flags | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600)
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.geteuid():
+        os.close(fd)
+        raise PermissionError(f"{path} must be a regular file owned by this user")
+    return fd
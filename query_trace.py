@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   query_trace.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Opt-in query tracing for MySql.MySQL, to find out which queries a page
+#  really runs before adding an index for them.
+#
+#  With QUERY_TRACE on, every query an HTTP request runs is recorded with
+#  its shape (the SQL with literals and IN lists collapsed), number of
+#  parameters, duration and row count. A request that runs more than
+#  QUERY_TRACE_MAX_QUERIES queries, spends more than QUERY_TRACE_MAX_SECONDS
+#  in the database, or repeats one shape QUERY_TRACE_REPEAT times (an N+1
+#  loop) is written to the query log with a per-shape breakdown. Responses
+#  also get a Server-Timing header with the query count and DB time.
+#
+#  With SLOW_QUERY_SECONDS set, any query slower than that, traced request
+#  or not, is logged together with its EXPLAIN plan. Each shape is
+#  explained at most once per SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+#
+#  The log is QUERY_LOG, rotated at QUERY_LOG_BYTES with
+#  QUERY_LOG_BACKUPS old copies kept.
+
+import contextvars
+import logging
+import logging.handlers
+import re
+import threading
+import time
+from collections import namedtuple
+import config
+
+QUERY_TRACE = getattr(config, 'QUERY_TRACE', False)
+QUERY_TRACE_MAX_QUERIES = getattr(config, 'QUERY_TRACE_MAX_QUERIES', 20)
+QUERY_TRACE_MAX_SECONDS = getattr(config, 'QUERY_TRACE_MAX_SECONDS', 0.25)
+QUERY_TRACE_REPEAT = getattr(config, 'QUERY_TRACE_REPEAT', 5)
+
+# 0 disables the slow-query log
+SLOW_QUERY_SECONDS = getattr(config, 'SLOW_QUERY_SECONDS', 0)
+SLOW_QUERY_EXPLAIN_INTERVAL = getattr(config, 'SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+
+QUERY_LOG = getattr(config, 'QUERY_LOG', 'queries.log')
+QUERY_LOG_BYTES = getattr(config, 'QUERY_LOG_BYTES', 5 * 1024 * 1024)
+QUERY_LOG_BACKUPS = getattr(config, 'QUERY_LOG_BACKUPS', 3)
+
+# Checked by MySql.MySQL before timing anything
+ENABLED = bool(QUERY_TRACE or SLOW_QUERY_SECONDS)
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+QueryRecord = namedtuple('QueryRecord', 'shape params duration rows')
+
+_current = contextvars.ContextVar('query_trace', default=None)
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER = re.compile(r'(?<![\w`])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def shape(query):
+    """
+    The query with literals replaced by ? and IN lists by (...), so that
+    queries differing only in their values group together.
+    """
+    text = _STRING.sub('?', query)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('(...)', text)
+    return _SPACE.sub(' ', text).strip()
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def log():
+    """
+    The query logger, writing to the rotating QUERY_LOG.
+    """
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                logger = logging.getLogger('mediaplayer.queries')
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                handler = logging.handlers.RotatingFileHandler(
+                    QUERY_LOG, maxBytes=QUERY_LOG_BYTES, backupCount=QUERY_LOG_BACKUPS, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(asctime)s [%(process)d] %(message)s'))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+class RequestTrace:
+    """
+    The queries of one request.
+    """
+    def __init__(self, label):
+        self.label = label
+        self.queries = []
+
+    @property
+    def total(self):
+        return sum(q.duration for q in self.queries)
+
+    def by_shape(self):
+        """
+        Returns [(shape, count, seconds, rows)], slowest first.
+        """
+        groups = {}
+        for q in self.queries:
+            count, seconds, rows = groups.get(q.shape, (0, 0.0, 0))
+            groups[q.shape] = (count + 1, seconds + q.duration, rows + q.rows)
+        return sorted(((s,) + v for s, v in groups.items()), key=lambda g: -g[2])
+
+    def problems(self):
+        """
+        Returns the reasons this request went over budget, if any.
+        """
+        reasons = []
+        if QUERY_TRACE_MAX_QUERIES and len(self.queries) > QUERY_TRACE_MAX_QUERIES:
+            reasons.append(f"{len(self.queries)} queries (budget {QUERY_TRACE_MAX_QUERIES})")
+        total = self.total
+        if QUERY_TRACE_MAX_SECONDS and total > QUERY_TRACE_MAX_SECONDS:
+            reasons.append(f"{total:.3f} s in the database (budget {QUERY_TRACE_MAX_SECONDS} s)")
+        if QUERY_TRACE_REPEAT:
+            for query_shape, count, _, _ in self.by_shape():
+                if count >= QUERY_TRACE_REPEAT:
+                    reasons.append(f"{count}x the same query: {query_shape[:120]}")
+        return reasons
+
+    def report(self, reasons):
+        lines = [f"{self.label}: " + '; '.join(reasons)]
+        for query_shape, count, seconds, rows in self.by_shape():
+            lines.append(f"    {count:4d}x {seconds * 1000:9.2f} ms {rows:7d} rows  {query_shape}")
+        return '\n'.join(lines)
+
+
+def begin(label):
+    """
+    Starts tracing the queries of the current request (thread or task).
+    Returns a token for end().
+    """
+    return _current.set(RequestTrace(label))
+
+
+def end(token):
+    """
+    Stops tracing, logs the request if it went over budget and returns its
+    RequestTrace.
+    """
+    trace = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Ended from another context than it began in
+        _current.set(None)
+    if trace is not None:
+        reasons = trace.problems()
+        if reasons:
+            log().warning(trace.report(reasons))
+    return trace
+
+
+_explained = {}   # shape -> when it was last explained
+_explained_lock = threading.Lock()
+
+
+def _should_explain(query_shape):
+    now = time.monotonic()
+    with _explained_lock:
+        last = _explained.get(query_shape)
+        if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        if len(_explained) > 10000:
+            _explained.clear()
+        _explained[query_shape] = now
+        return True
+
+
+def _explain(cursor, query, params):
+    try:
+        cursor.execute('EXPLAIN ' + query, params)
+        plan = cursor.fetchall()
+    except Exception as e:
+        return [f"    (EXPLAIN failed: {e})"]
+    if not plan:
+        return []
+    columns = list(plan[0].keys())
+    rows = [[str(row.get(c)) for c in columns] for row in plan]
+    widths = [max(len(c), *(len(r[i]) for r in rows)) for i, c in enumerate(columns)]
+    return [('    ' + '  '.join(v.ljust(w) for v, w in zip(values, widths))).rstrip()
+            for values in [columns] + rows]
+
+
+def record(cursor, query, params, duration, rows):
+    """
+    Called by MySql.MySQL after each query, while `cursor` is still open.
+    """
+    query_shape = shape(query)
+    param_count = len(params) if isinstance(params, (list, tuple, dict)) else int(params is not None)
+    trace = _current.get()
+    if trace is not None:
+        trace.queries.append(QueryRecord(query_shape, param_count, duration, rows))
+    if SLOW_QUERY_SECONDS and duration >= SLOW_QUERY_SECONDS:
+        lines = [f"slow query {duration * 1000:.1f} ms, {rows} rows, {param_count} params"
+                 + (f" ({trace.label})" if trace else '') + f": {query_shape}"]
+        if query.lstrip()[:6].upper().startswith(EXPLAINABLE) and _should_explain(query_shape):
+            lines += _explain(cursor, query, params)
+        log().warning('\n'.join(lines))
+
+
+def instrument(app):
+    """
+    Traces every request handled by a Flask app when QUERY_TRACE is on.
+    """
+    if not QUERY_TRACE:
+        return app
+    from flask import g, request
+
+    @app.before_request
+    def _begin_trace():
+        g.query_trace_token = begin(f"{request.method} {request.full_path.rstrip('?')}")
+
+    @app.after_request
+    def _end_trace(response):
+        token = g.pop('query_trace_token', None)
+        if token is not None:
+            trace = end(token)
+            response.headers['Server-Timing'] = (
+                f'db;dur={trace.total * 1000:.2f};desc="{len(trace.queries)} queries"')
+        return response
+
+    return app
@@ -10,11 +10,24 @@
 #
 #   filename:  read_audio_to_mysql.py
 
+import argparse
 import os
 import pymysql
 import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from config import mysql_config, audio_table_list,Media # Import MySQL credentials from config.py
-from mutagen import mp3, flac, ogg  # Library for reading audio metadata
+import mutagen  # Library for reading audio metadata
+from bulk_db import BULK_CHUNK_SIZE, bulk_insert
+from catalog import bump_catalog_version, folder_values, rebuild_directory_index, table_columns, FOLDER_COLUMNS
+from media_scanner import iter_files
+from metadata_cache import MetadataCache, file_key
+
+# Processes used to read tags, and files handed to a process per task
+TAG_WORKERS = os.cpu_count() or 2
+TAG_BATCH_SIZE = 32
+
+# Metadata cache namespace for tags read by read_tags()
+TAG_CACHE_KIND = 'audio_tags'
 
 # Regex pattern for audio files
 audio_pattern = re.compile(r'.*(\.mp3|\.wav|\.flac|\.ogg|\.ape)$', re.IGNORECASE)
@@ -37,69 +50,178 @@ def get_existing_file_paths(connection, table_name):
     results = cursor.fetchall()
     return {row[0] for row in results}  # Return as a set for faster lookup
 
+# Tag extraction runs in worker processes; this must stay a top-level
+# function so it can be pickled.
+def read_tags(file_path):
+    """
+    Reads title, artist, album, track number and duration from an audio file
+    with mutagen's format-independent "easy" tags, falling back to the file
+    name and "Unknown" defaults.
+
+    Returns:
+        dict: The metadata, plus an 'error' message if the file could not be read.
+    """
+    metadata = {
+        'title': os.path.splitext(os.path.basename(file_path))[0],  # Extract title from filename (basic)
+        'artist': "Unknown Artist",  # Default value
+        'album': "Unknown Album",    # Default value
+        'track_number': None,
+        'duration': None,
+    }
+    try:
+        audio_file = mutagen.File(file_path, easy=True)
+        if audio_file is not None:
+            tags = audio_file.tags or {}
+            for key in ('title', 'artist', 'album'):
+                values = tags.get(key)
+                if values and str(values[0]).strip():
+                    metadata[key] = str(values[0]).strip()
+            track = tags.get('tracknumber')
+            if track:
+                number = str(track[0]).split('/')[0].strip()
+                if number.isdigit():
+                    metadata['track_number'] = int(number)
+            if getattr(audio_file, 'info', None) is not None and getattr(audio_file.info, 'length', None):
+                metadata['duration'] = round(float(audio_file.info.length), 3)
+    except Exception as e:
+        metadata['error'] = str(e)
+    return metadata
+
+def read_tags_batch(items):
+    """
+    Reads tags for a batch of (file_path, cache_key) pairs; one task per batch
+    keeps IPC cheap. Returns (file_path, cache_key, metadata) triples.
+    """
+    return [(file_path, key, read_tags(file_path)) for file_path, key in items]
+
 # Function to insert new files into the database
-def insert_new_files(connection, folder_path, table_name, pattern, existing_paths):
+def insert_new_files(connection, folder_path, table_name, pattern, existing_paths, workers=TAG_WORKERS, cache=None):
     """
     Scans the specified folder for audio files, extracts metadata,
     and inserts new file information into the database.
 
+    The walk, the tag reading and the database writes overlap: new paths are
+    handed to a process pool in small batches as directories are listed, at
+    most a few batches per worker are in flight (so a fast walker cannot
+    flood the pool), and finished rows are written in BULK_CHUNK_SIZE
+    batches. With a MetadataCache, files whose size/mtime/inode match a
+    cached entry skip tag reading entirely, and entries for files that are
+    gone are evicted after the walk.
+
     Args:
         connection: MySQL database connection object.
         folder_path: Path to the directory containing audio files.
         table_name: Name of the table in the database to insert data into.
         pattern: Regex pattern to match audio files.
         existing_paths: Set of existing file paths in the database.
+        workers: Number of tag reading processes.
+        cache: Optional metadata_cache.MetadataCache.
+
+    Returns:
+        int: The number of new files inserted.
     """
     cursor = connection.cursor()
     file_count = 0
     new_files_count = 0
+    table_cols = table_columns(cursor, table_name)
+    with_folders = set(FOLDER_COLUMNS) <= table_cols
+    optional = tuple(c for c in ('track_number', 'duration') if c in table_cols)
+    columns = ('title', 'file_path', 'category', 'artist', 'album') + optional + (FOLDER_COLUMNS if with_folders else ())
+    category = table_name.replace("audio_", "") # Extract category from table name
+    pending_rows = []  # written in batches of BULK_CHUNK_SIZE
+
+    def report(row, error):
+        print(f"Error inserting {row[1]}: {error}")
+
+    def flush():
+        inserted, _ = bulk_insert(connection, table_name, columns, pending_rows, on_error=report)
+        pending_rows.clear()
+        return inserted
+
+    def add_row(file_path, metadata):
+        row = (metadata['title'], file_path, category, metadata['artist'], metadata['album'])
+        row += tuple(metadata.get(c) for c in optional)
+        if with_folders:
+            row += folder_values(folder_path, file_path)
+        pending_rows.append(row)
+        if len(pending_rows) >= BULK_CHUNK_SIZE:
+            return flush()
+        return 0
+
+    def collect(future):
+        inserted = 0
+        for file_path, key, metadata in future.result():
+            if 'error' in metadata:
+                print(f"Error reading metadata from {file_path}: {metadata['error']}")
+            elif cache is not None:
+                cache.put(TAG_CACHE_KIND, file_path, key, metadata)
+            inserted += add_row(file_path, metadata)
+        return inserted
 
     print(f"Scanning files in: {folder_path} for table: {table_name}")
 
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if pattern is None or pattern.match(file):
-                file_path = os.path.join(root, file)
-                if file_path not in existing_paths:
-                    title = os.path.splitext(file)[0]  # Extract title from filename (basic)
-                    artist = "Unknown Artist"  # Default value
-                    album = "Unknown Album"    # Default value
-                    category = table_name.replace("audio_", "") # Extract category from table name
-
-                    # Extract metadata using mutagen (if needed)
-                    try:
-                        audio_file = mutagen.File(file_path)
-                        if audio_file:
-                            title = audio_file.get("TIT2", [title])[0]
-                            artist = audio_file.get("TPE1", [artist])[0]
-                            album = audio_file.get("TALB", [album])[0]
-                    except Exception as e:
-                        print(f"Error reading metadata from {file_path}: {e}")
-
-                    try:
-                        cursor.execute(
-                            f"INSERT INTO {table_name} (title, file_path, category, artist, album) VALUES (%s, %s, %s, %s, %s)",
-                            (title, file_path, category, artist, album),
-                        )
-                        new_files_count += 1
-                    except pymysql.Error as e:
-                        print(f"Error inserting {file_path}: {e}")
-                file_count += 1  # Increment total files processed
-            else:
-                pass  # Unmatched files are ignored now
-            #print(f"unmatched file {os.path.join(root,file)}")
-
-    connection.commit()
+    matches = pattern.match if pattern is not None else (lambda name: True)
+    seen = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        batch = []
+        for file_path in iter_files(folder_path, matches):
+            file_count += 1  # Increment total files processed
+            seen.add(file_path)
+            if file_path in existing_paths:
+                continue
+            key = None
+            if cache is not None:
+                key = file_key(file_path)
+                cached = cache.get(TAG_CACHE_KIND, file_path, key)
+                if cached is not None:
+                    new_files_count += add_row(file_path, cached)
+                    continue
+            batch.append((file_path, key))
+            if len(batch) < TAG_BATCH_SIZE:
+                continue
+            in_flight.add(executor.submit(read_tags_batch, batch))
+            batch = []
+            # Backpressure: wait for results before queueing more work
+            while len(in_flight) >= workers * 4:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    new_files_count += collect(future)
+        if batch:
+            in_flight.add(executor.submit(read_tags_batch, batch))
+        for future in as_completed(in_flight):
+            new_files_count += collect(future)
+
+    new_files_count += flush()
+    if cache is not None:
+        cache.prune(TAG_CACHE_KIND, folder_path, seen)
+        cache.commit()
     print(
         f"{table_name.capitalize()} cataloging completed. "
         f"Total files processed: {file_count}, New files inserted: {new_files_count}"
     )
+    return new_files_count
 
-if __name__ == "__main__":
+def import_audio_folders(workers=TAG_WORKERS, cache=None):
+    """
+    Catalogs the new files of every folder in audio_table_list, refreshes
+    the directory index of the tables that changed and bumps the catalog
+    stamp.
+
+    Args:
+        workers (int): Processes used to read tags.
+        cache (MetadataCache): Tags kept between runs, or None.
+
+    Returns:
+        int: The number of files inserted, or None if the database could
+        not be reached.
+    """
     # Connect to MySQL database
     db_connection = connect_to_db()
     if db_connection is None:
-        exit()  # Exit if database connection fails
+        return None
+
+    total_inserted = 0
 
     # Iterate through the table list
     for folder_path, table_name in audio_table_list:
@@ -107,11 +229,36 @@ if __name__ == "__main__":
             # Get existing file paths from the database
             existing_paths = get_existing_file_paths(db_connection, table_name)
             # Insert only the new files
-            insert_new_files(
-                db_connection, folder_path, table_name, audio_pattern, existing_paths
+            inserted = insert_new_files(
+                db_connection, folder_path, table_name, audio_pattern, existing_paths, workers=workers, cache=cache
             )
+            # Refresh the folder/album index read by the browse endpoints
+            if inserted:
+                rebuild_directory_index(db_connection, table_name)
+            total_inserted += inserted
         else:
             print(f"{folder_path} folder not found.")
 
     # Close the database connection
     db_connection.close()
+
+    # Tell the running web app to drop its cached schema/catalog data
+    if total_inserted:
+        bump_catalog_version()
+    return total_inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog audio folders into the MySQL database.")
+    parser.add_argument('--workers', type=int, default=TAG_WORKERS,
+                        help=f"Processes used to read tags (default: {TAG_WORKERS})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Ignore the on-disk metadata cache and read every file's tags")
+    args = parser.parse_args()
+    cache = None if args.no_cache else MetadataCache()
+    try:
+        if import_audio_folders(workers=args.workers, cache=cache) is None:
+            exit()  # Exit if database connection fails
+    finally:
+        if cache is not None:
+            cache.close()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   recent_playback.py
+#
+#  Copyright 2025 AL Haines
+#
+#  The "continue watching" list. Instead of a UNION over every media table on
+#  each index page load, update_resume_position/clear_resume_position keep a
+#  small indexed table of resumable items up to date, and the index page
+#  reads the newest rows straight from it.
+
+import threading
+import config
+
+RECENT_TABLE = 'recent_playback'
+RECENT_LIMIT = 20
+
+_ready = False
+_ready_lock = threading.Lock()
+
+def _album_select(db, table):
+    if db.get_table_features(table)['album']:
+        return "album COLLATE utf8mb4_unicode_ci"
+    return "CAST(NULL AS CHAR) COLLATE utf8mb4_unicode_ci"
+
+def ensure_table(db):
+    """
+    Creates the recent playback table on first use in this process and fills
+    it from the existing resume positions when it is new.
+    """
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        if RECENT_TABLE not in db.get_table_names():
+            db.put_data(f"""
+                CREATE TABLE IF NOT EXISTS `{RECENT_TABLE}` (
+                    category VARCHAR(64) NOT NULL,
+                    item_id INT NOT NULL,
+                    title VARCHAR(512) NULL,
+                    file_path VARCHAR(1024) NULL,
+                    album VARCHAR(512) NULL,
+                    resume_position DOUBLE NOT NULL DEFAULT 0,
+                    last_played DATETIME NOT NULL,
+                    PRIMARY KEY (category, item_id),
+                    KEY idx_last_played (last_played)
+                ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """)
+            if db.last_error is not None:
+                # Already printed by put_data; tried again on the next call
+                return
+            backfill(db)
+        _ready = True
+
+def backfill(db):
+    """
+    Copies every resumable item from the configured media tables into the
+    recent playback table. Only needed once, when the table is created.
+    """
+    config_tables = [row[1] for row in config.table_list]
+    tables = [t for t in db.get_table_names() if t in config_tables]
+    select_parts = []
+    for table in tables:
+        features = db.get_table_features(table)
+        if not (features['resume_position'] and features['last_played']):
+            continue
+        select_parts.append(f"""
+            (SELECT
+                '{table}',
+                id,
+                title COLLATE utf8mb4_unicode_ci,
+                file_path COLLATE utf8mb4_unicode_ci,
+                {_album_select(db, table)},
+                resume_position,
+                last_played
+            FROM `{table}`
+            WHERE resume_position > 0.1 AND last_played IS NOT NULL)
+        """.strip())
+    if not select_parts:
+        return 0
+    query = (f"INSERT IGNORE INTO `{RECENT_TABLE}` "
+             "(category, item_id, title, file_path, album, resume_position, last_played) "
+             + " UNION ALL ".join(select_parts))
+    return db.put_data(query)
+
+def record(db, table_name, item_id, position):
+    """
+    Upserts an item with its new resume position, or drops it from the list
+    when the position is (close to) zero.
+    """
+    ensure_table(db)
+    if position <= 0.1:
+        return remove(db, table_name, item_id)
+    query = f"""
+        INSERT INTO `{RECENT_TABLE}`
+            (category, item_id, title, file_path, album, resume_position, last_played)
+        SELECT %s, id, title, file_path, {_album_select(db, table_name)}, %s, NOW()
+        FROM `{table_name}` WHERE id = %s
+        ON DUPLICATE KEY UPDATE
+            resume_position = VALUES(resume_position),
+            last_played = VALUES(last_played)
+    """
+    return db.put_data(query, (table_name, position, item_id))
+
+def record_many(db, table_name, entries):
+    """
+    Batch form of record() used by the resume write buffer. `entries` is a
+    list of (item_id, position, played_at) with played_at a Unix timestamp;
+    items at position zero are dropped, the rest upserted in one statement.
+    """
+    ensure_table(db)
+    keep = [(item_id, position, played_at) for item_id, position, played_at in entries if position > 0.1]
+    drop = [item_id for item_id, position, _ in entries if position <= 0.1]
+    if drop:
+        remove_many(db, table_name, drop)
+    if not keep:
+        return 0
+    position_case = " ".join("WHEN %s THEN %s" for _ in keep)
+    played_case = " ".join("WHEN %s THEN FROM_UNIXTIME(%s)" for _ in keep)
+    id_list = ", ".join(["%s"] * len(keep))
+    query = f"""
+        INSERT INTO `{RECENT_TABLE}`
+            (category, item_id, title, file_path, album, resume_position, last_played)
+        SELECT %s, id, title, file_path, {_album_select(db, table_name)},
+               CASE id {position_case} END,
+               CASE id {played_case} END
+        FROM `{table_name}` WHERE id IN ({id_list})
+        ON DUPLICATE KEY UPDATE
+            resume_position = VALUES(resume_position),
+            last_played = VALUES(last_played)
+    """
+    params = [table_name]
+    for item_id, position, _ in keep:
+        params += [item_id, position]
+    for item_id, _, played_at in keep:
+        params += [item_id, played_at]
+    params += [item_id for item_id, _, _ in keep]
+    return db.put_data(query, params)
+
+def remove_many(db, table_name, item_ids):
+    """
+    Drops several items of one table from the continue watching list.
+    """
+    ensure_table(db)
+    id_list = ", ".join(["%s"] * len(item_ids))
+    return db.put_data(f"DELETE FROM `{RECENT_TABLE}` WHERE category = %s AND item_id IN ({id_list})",
+                       [table_name] + list(item_ids))
+
+def remove(db, table_name, item_id):
+    """
+    Drops an item from the continue watching list.
+    """
+    ensure_table(db)
+    return db.put_data(f"DELETE FROM `{RECENT_TABLE}` WHERE category = %s AND item_id = %s",
+                       (table_name, item_id))
+
+def get_recent(db, limit=RECENT_LIMIT):
+    """
+    Returns the most recently played resumable items, newest first, in the
+    same shape the old UNION query produced.
+    """
+    ensure_table(db)
+    query = f"""
+        SELECT item_id AS id, title, file_path, album, category, last_played, resume_position
+        FROM `{RECENT_TABLE}`
+        ORDER BY last_played DESC
+        LIMIT %s
+    """
+    return db.get_data(query, (limit,))
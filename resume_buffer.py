@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   resume_buffer.py
+#
+#  Copyright 2025 AL Haines
+#
+#  Write-behind buffer for resume positions. The player posts its position
+#  every few seconds; instead of one UPDATE and commit per post, the latest
+#  position per (table, item) is kept and written out in batches on a timer
+#  and when the worker exits.
+#
+#  The pending positions live in RESUME_SPOOL_FILE, shared by every gunicorn
+#  worker under an fcntl lock, so a page served by any worker sees them and
+#  whichever worker flushes next writes them all. Clears are written through
+#  to the database at once, serialized with flushes so an older position can
+#  never land on top of them. With RESUME_SPOOL_FILE = '' the positions stay
+#  in the memory of the worker that received them, and other workers only
+#  see them once flushed. The spool is a private file (see private_files.py)
+#  and entries read back from it are checked before they reach any SQL.
+
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import config
+import recent_playback
+from private_files import RUNTIME_DIR, open_private
+
+# Seconds between flushes; 0 writes every update straight through
+RESUME_FLUSH_INTERVAL = getattr(config, 'RESUME_FLUSH_INTERVAL', 5)
+
+# Shared by the workers; '' keeps pending positions per process
+RESUME_SPOOL_FILE = getattr(config, 'RESUME_SPOOL_FILE', os.path.join(RUNTIME_DIR, 'resume.json'))
+
+
+def _media_tables():
+    return {table_name for _, table_name in
+            list(getattr(config, 'table_list', [])) + list(getattr(config, 'audio_table_list', []))}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _decode(text):
+    """
+    Parses the spool, keeping only well-formed entries for configured media
+    tables.
+    """
+    if not text:
+        return {}
+    try:
+        entries = json.loads(text)
+    except ValueError as e:
+        print(f"Ignoring unreadable resume spool: {e}", file=sys.stderr)
+        return {}
+    tables = _media_tables()
+    pending = {}
+    for entry in entries if isinstance(entries, list) else ():
+        if not isinstance(entry, list) or len(entry) != 4:
+            continue
+        table_name, item_id, position, played_at = entry
+        if (table_name in tables and isinstance(item_id, int) and not isinstance(item_id, bool)
+                and _is_number(position) and (played_at is None or _is_number(played_at))):
+            pending[(table_name, item_id)] = (position, played_at)
+    return pending
+
+
+def _encode(pending):
+    return json.dumps([[table_name, item_id, position, played_at]
+                       for (table_name, item_id), (position, played_at) in pending.items()])
+
+
+class ResumeWriteBuffer:
+    """
+    Coalesces resume position writes. Each (table, item_id) keeps only its
+    newest (position, played_at) pair, where played_at is the Unix time of
+    the last update, or None if it was never touched by playback.
+    """
+    def __init__(self, db_factory, interval=RESUME_FLUSH_INTERVAL, spool_file=RESUME_SPOOL_FILE):
+        self.db_factory = db_factory
+        self.interval = interval
+        self.spool_file = spool_file
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    @contextlib.contextmanager
+    def _locked(self, write=True):
+        """
+        Yields the pending positions, held under the thread lock and, with a
+        spool file, an fcntl lock on it. Changes are saved when `write`.
+        """
+        with self._lock:
+            if not self.spool_file:
+                yield self._pending
+                return
+            with os.fdopen(open_private(self.spool_file), 'r+', encoding='utf-8') as file:
+                fcntl.flock(file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+                file.seek(0)
+                text = file.read()
+                pending = _decode(text)
+                yield pending
+                if write:
+                    updated = _encode(pending) if pending else ''
+                    if updated != text:
+                        file.seek(0)
+                        file.truncate()
+                        file.write(updated)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """
+        Held while positions are written to the database, by this process and,
+        with a spool file, by every other one.
+        """
+        with self._flush_lock:
+            if not self.spool_file:
+                yield
+                return
+            with os.fdopen(open_private(self.spool_file + '.lock'), 'r') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def put(self, table_name, item_id, position):
+        """
+        Records a new playback position.
+        """
+        with self._locked() as pending:
+            pending[(table_name, item_id)] = (position, time.time())
+        self._ensure_started()
+
+    def clear(self, db, table_name, item_id):
+        """
+        Drops any pending position of an item and writes its cleared position
+        straight through. Returns the number of rows updated.
+        """
+        with self._writing():
+            with self._locked() as pending:
+                pending.pop((table_name, item_id), None)
+            updated = db.put_data(f"UPDATE `{table_name}` SET resume_position = 0 WHERE id = %s", (item_id,))
+            recent_playback.remove(db, table_name, item_id)
+            return updated
+
+    def pending(self):
+        """
+        Returns a snapshot of the unflushed positions.
+        """
+        with self._locked(write=False) as pending:
+            return dict(pending)
+
+    def flush(self):
+        """
+        Writes every pending position: one multi-row UPDATE per table plus a
+        batched refresh of the continue watching list.
+        """
+        with self._writing():
+            with self._locked() as pending:
+                batch = dict(pending)
+                pending.clear()
+            if not batch:
+                return 0
+
+            by_table = {}
+            tables = _media_tables()
+            for (table_name, item_id), (position, played_at) in batch.items():
+                if table_name not in tables:
+                    print(f"Dropping resume position for unknown table '{table_name}'", file=sys.stderr)
+                    continue
+                by_table.setdefault(table_name, []).append((item_id, position, played_at))
+
+            db = self.db_factory()
+            written = 0
+            for table_name, entries in by_table.items():
+                try:
+                    count = self._flush_table(db, table_name, entries)
+                    if db.last_error is not None:
+                        raise db.last_error
+                except Exception as e:
+                    print(f"Error flushing resume positions for '{table_name}', retrying later: {e}",
+                          file=sys.stderr)
+                    self._requeue(table_name, entries)
+                    continue
+                written += count
+                recent_playback.record_many(db, table_name, entries)
+            return written
+
+    def _requeue(self, table_name, entries):
+        """
+        Puts the entries of a failed write back, unless a newer position for
+        the same item arrived meanwhile.
+        """
+        with self._locked() as pending:
+            for item_id, position, played_at in entries:
+                pending.setdefault((table_name, item_id), (position, played_at))
+
+    def _flush_table(self, db, table_name, entries):
+        position_case = " ".join("WHEN %s THEN %s" for _ in entries)
+        params = []
+        for item_id, position, _ in entries:
+            params += [item_id, position]
+
+        touched = [(item_id, played_at) for item_id, _, played_at in entries if played_at is not None]
+        played_clause = ""
+        if touched:
+            played_case = " ".join("WHEN %s THEN FROM_UNIXTIME(%s)" for _ in touched)
+            played_clause = f", last_played = CASE id {played_case} ELSE last_played END"
+            for item_id, played_at in touched:
+                params += [item_id, played_at]
+
+        id_list = ", ".join(["%s"] * len(entries))
+        params += [item_id for item_id, _, _ in entries]
+        query = (f"UPDATE `{table_name}` SET resume_position = CASE id {position_case} END"
+                 f"{played_clause} WHERE id IN ({id_list})")
+        return db.put_data(query, params)
+
+    def _ensure_started(self):
+        # Started lazily so the thread lives in the gunicorn worker, not in
+        # the parent process it was forked from.
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='resume-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
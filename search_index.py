@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+#  filename:   search_index.py
+#
+#  Copyright 2025 AL Haines
+#
+#  In-memory search over every media table for /search. Each worker loads
+#  title, album, artist and folder of all items with one query per table
+#  and indexes the trigrams of every word, padded with a leading space so
+#  that " st" marks a word starting with "st". A query word is looked up by
+#  its own trigrams: the shortest posting list (intersected with the next
+#  ones while it is still large) gives a few candidates, which are then
+#  checked and ranked. Query words therefore match the start of words in
+#  any field, so "star wa" finds "Star Wars" and "wars" finds it as well.
+#
+#  A short prefix such as "ka" can match tens of thousands of items, too
+#  many to check in time. So titles have posting lists of their own, which
+#  are searched first, and documents are numbered shortest title first, so
+#  every list runs in title length order. The check stops once SCAN_MATCHES
+#  documents have matched. Only when the titles give fewer than that are
+#  the other fields searched as well. Title matches outscore almost any
+#  other, so what is cut off is mostly longer titles.
+#
+#  The index is built in a background thread when the worker starts and
+#  rebuilt the same way when the sync scripts bump the catalog stamp;
+#  searches keep using the previous index until the new one is ready.
+#  Searches made before the first build finishes wait briefly, then get a
+#  503 rather than holding up the worker.
+
+import itertools
+import os
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+import config
+from catalog import browse_folder, catalog_version
+
+SEARCH_FIELDS = ('title', 'album', 'artist', 'folder')
+
+# Score for a query word starting a word in each field; a whole-word match
+# counts double
+FIELD_WEIGHTS = {'title': 4, 'artist': 3, 'album': 3, 'folder': 1}
+
+# Results returned when the request does not ask for a number, and the cap
+SEARCH_LIMIT = getattr(config, 'SEARCH_LIMIT', 50)
+MAX_SEARCH_LIMIT = getattr(config, 'MAX_SEARCH_LIMIT', 200)
+
+# Candidates are checked directly once a posting list is this short
+VERIFY_THRESHOLD = 2000
+
+# Matches collected before a search stops checking candidates; bounds the
+# time of very common prefixes (at least the requested limit is collected)
+SCAN_MATCHES = 500
+
+# Seconds a search waits for the first build; well below gunicorn's timeout
+FIRST_BUILD_WAIT = 2
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    Lower-cases text and strips accents, so "Beyoncé" matches "beyonce".
+    """
+    if not text:
+        return ''
+    text = str(text)
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def words(text):
+    return _WORD.findall(normalize(text))
+
+
+def word_trigrams(word):
+    """
+    Trigrams of ' ' + word: the first one anchors the word start.
+    """
+    padded = ' ' + word
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Index:
+    """
+    One immutable snapshot of the search index.
+    """
+    def __init__(self):
+        self.tables = []        # table names; docs refer to them by position
+        self.doc_table = array('H')
+        self.doc_id = array('q')
+        self.display = []       # per doc: (title, album, artist, folder) as stored
+        self.fields = []        # per doc: the fields as ' word word ' strings
+        self.postings = {}      # trigram -> array('I') of doc numbers, ascending
+        self.title_postings = {}  # the same for the words of titles only
+
+    def add(self, table_index, item_id, values):
+        self.doc_table.append(table_index)
+        self.doc_id.append(item_id)
+        self.display.append(tuple(values))
+        self.fields.append(tuple(' ' + ' '.join(words(value)) + ' ' for value in values))
+
+    def finish(self):
+        """
+        Renumbers the documents shortest title first and builds the posting
+        lists. Called once, after the last add().
+        """
+        order = sorted(range(len(self.doc_id)), key=lambda doc: len(self.fields[doc][0]))
+        self.doc_table = array('H', (self.doc_table[doc] for doc in order))
+        self.doc_id = array('q', (self.doc_id[doc] for doc in order))
+        self.display = [self.display[doc] for doc in order]
+        self.fields = [self.fields[doc] for doc in order]
+
+        memo = {}   # the same words recur a lot
+
+        def grams_of(text):
+            grams = set()
+            for word in set(text.split()):
+                word_grams = memo.get(word)
+                if word_grams is None:
+                    word_grams = memo[word] = word_trigrams(word)
+                grams |= word_grams
+            return grams
+
+        for doc, fields in enumerate(self.fields):
+            title_grams = grams_of(fields[0])
+            for postings, grams in ((self.title_postings, title_grams),
+                                    (self.postings, title_grams | grams_of(' '.join(fields[1:])))):
+                for gram in grams:
+                    posting = postings.get(gram)
+                    if posting is None:
+                        posting = postings[gram] = array('I')
+                    posting.append(doc)
+
+    def candidates(self, query_words, postings=None):
+        if postings is None:
+            postings = self.postings
+        grams = set()
+        for word in query_words:
+            if len(word) >= 2:
+                grams |= word_trigrams(word)
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                return []
+            lists.append(posting)
+        lists.sort(key=len)
+        if len(lists[0]) <= VERIFY_THRESHOLD:
+            return lists[0]
+        if len(query_words) == 1:
+            # The trigrams of one word mostly occur together, so the head of
+            # a long list is checked directly; for a common prefix it fills
+            # the results and the rest is never intersected
+            return itertools.chain(lists[0][:VERIFY_THRESHOLD],
+                                   _intersection([lists[0][VERIFY_THRESHOLD:]] + lists[1:]))
+        return _intersection(lists)
+
+    def search(self, query, limit, tables=None):
+        query_words = words(query)
+        wanted = None
+        if tables:
+            wanted = {i for i, name in enumerate(self.tables) if name in tables}
+        phrase = ' ' + ' '.join(query_words)
+        enough = max(limit, SCAN_MATCHES)
+
+        scored, matched = [], set()
+        title_hits = 0
+        # Titles first; the other fields only if too few titles match every
+        # query word
+        for postings in (self.title_postings, self.postings):
+            if title_hits >= limit:
+                break
+            candidates = self.candidates(query_words, postings)
+            if candidates is None:
+                return []
+            for doc in candidates:
+                if doc in matched or (wanted is not None and self.doc_table[doc] not in wanted):
+                    continue
+                fields = self.fields[doc]
+                title = fields[0]
+                score = 0
+                in_title = True
+                for word in query_words:
+                    prefix, whole = ' ' + word, ' ' + word + ' '
+                    best = 0
+                    for name, text in zip(SEARCH_FIELDS, fields):
+                        if prefix in text:
+                            weight = FIELD_WEIGHTS[name] * (2 if whole in text else 1)
+                            best = max(best, weight)
+                    if not best:
+                        break
+                    score += best
+                    in_title = in_title and prefix in title
+                else:
+                    if title.startswith(phrase):
+                        score += 5
+                    elif phrase in title:
+                        score += 2
+                    scored.append((-score, len(title), doc))
+                    matched.add(doc)
+                    title_hits += in_title
+                    if (title_hits if postings is self.title_postings else len(scored)) >= enough:
+                        break
+        scored.sort()
+        results = []
+        for _, _, doc in scored[:limit]:
+            title, album, artist, folder = self.display[doc]
+            results.append({'category': self.tables[self.doc_table[doc]], 'id': self.doc_id[doc],
+                            'title': title, 'album': album, 'artist': artist, 'folder': folder})
+        return results
+
+
+def _intersection(lists):
+    """
+    Yields the documents of the first list found in the others, in
+    ascending order (shortest title first). Runs on the first next().
+    """
+    candidates = lists[0]
+    for posting in lists[1:]:
+        if len(candidates) <= VERIFY_THRESHOLD:
+            break
+        candidates = set(candidates).intersection(posting)
+    yield from candidates if isinstance(candidates, array) else sorted(candidates)
+
+
+def _media_tables():
+    """
+    (root, table) pairs of every configured media table.
+    """
+    return list(config.table_list) + list(getattr(config, 'audio_table_list', []))
+
+
+def build_index(db):
+    """
+    Reads every media table once and returns a new index.
+    """
+    index = _Index()
+    available = set(db.get_table_names())
+    for root, table_name in _media_tables():
+        if table_name not in available:
+            continue
+        columns = set(db.get_field_names(table_name))
+        select = ['id', 'title']
+        select += [c for c in ('album', 'artist', 'folder') if c in columns]
+        if 'folder' not in columns:
+            select.append('file_path')
+        rows = db.get_data(f"SELECT {', '.join(select)} FROM `{table_name}`") or []
+        index.tables.append(table_name)
+        table_index = len(index.tables) - 1
+        for row in rows:
+            folder = row.get('folder')
+            if folder is None and row.get('file_path'):
+                folder = browse_folder(root, row['file_path'])
+            index.add(table_index, row['id'],
+                      (row.get('title') or '', row.get('album') or '', row.get('artist') or '', folder or ''))
+    index.finish()
+    return index
+
+
+class SearchIndex:
+    """
+    The worker's search index, (re)built in the background.
+    """
+    def __init__(self, db_factory):
+        self.db_factory = db_factory
+        self._index = None
+        self._version = None
+        self._building = False
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A build thread does not survive the fork; start over in the child
+        self._lock = threading.Lock()
+        if self._building:
+            self._building = False
+            self.refresh()
+
+    def refresh(self):
+        """
+        Starts a build if there is no index yet or the catalog changed.
+        """
+        version = catalog_version()
+        with self._lock:
+            if self._building or (self._index is not None and version == self._version):
+                return
+            self._building = True
+        threading.Thread(target=self._build, args=(version,), name='search-index', daemon=True).start()
+
+    def _build(self, version):
+        try:
+            index = build_index(self.db_factory())
+            with self._lock:
+                self._index, self._version = index, version
+            self._ready.set()
+        except Exception as e:
+            print(f"Error building search index: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._building = False
+
+    def search(self, query, limit=None, tables=None, wait=FIRST_BUILD_WAIT):
+        """
+        Returns ranked matches, waiting up to `wait` seconds for the first
+        build. Returns None if no index is available yet.
+        """
+        self.refresh()
+        if not self._ready.wait(wait):
+            return None
+        limit = max(1, min(limit or SEARCH_LIMIT, MAX_SEARCH_LIMIT))
+        return self._index.search(query, limit, tables)
+
+    def stats(self):
+        index = self._index
+        return {
+            'ready': index is not None,
+            'documents': len(index.doc_id) if index else 0,
+            'trigrams': len(index.postings) if index else 0,
+            'building': self._building,
+        }
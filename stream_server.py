@@ -0,0 +1,385 @@
+#!/home/al/miniconda3/envs/py/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2025 AL Haines <alfredhaines@gmail.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   filename: stream_server.py
+#
+"""
+Asynchronous server for /stream/<table>/<id>, run next to the gunicorn app.
+
+A gunicorn sync worker is tied up for as long as a client keeps a stream
+open, so a few viewers watching films can starve the browse and resume
+endpoints. This server answers only the stream URLs, with the same
+semantics as OV.stream_with_range_support: conditional requests, single
+and multi-range responses, ETag/Last-Modified and the stored MIME type. It
+runs on one asyncio event loop. File bodies go out with loop.sendfile()
+(os.sendfile, or chunked reads in a thread with write backpressure where
+sendfile is unavailable), so one process can hold hundreds of open
+streams while the Flask routes keep running under gunicorn unchanged.
+
+Files are opened and stat'ed in the default executor, but os.sendfile()
+itself runs on the loop: when the range is not in the page cache, the
+kernel reads it from disk before returning, and every other stream waits
+meanwhile. Each call is bounded to STREAM_CHUNK_SIZE bytes (and to what the
+socket buffer takes), with sequential readahead advised for the range, so
+one cold read stalls the loop for at most about one chunk of disk I/O. On
+slow or network disks, enable the block cache (block_cache.py), whose
+misses are read in executor threads.
+Bandwidth limits from bandwidth.py apply here as well, and GET /stats
+returns the shaping counters.
+
+Point the player at it by setting STREAM_BASE_URL in config.py, or route
+/stream/ to STREAM_SERVER_PORT in the front proxy / Cloudflare tunnel.
+
+Usage:
+    python3 stream_server.py [--host HOST] [--port PORT]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import unquote
+import config
+import bandwidth
+import block_cache
+import http_range
+import media_stream
+import metrics
+import prefetch
+from MySql import MySQL
+
+STREAM_SERVER_HOST = getattr(config, 'STREAM_SERVER_HOST', '0.0.0.0')
+STREAM_SERVER_PORT = getattr(config, 'STREAM_SERVER_PORT', 5052)
+
+# Seconds an idle keep-alive connection is held open between requests
+STREAM_SERVER_KEEPALIVE = getattr(config, 'STREAM_SERVER_KEEPALIVE', 75)
+
+MAX_HEADER_BYTES = 16 * 1024
+
+REASONS = {
+    200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+    404: 'Not Found', 405: 'Method Not Allowed', 412: 'Precondition Failed',
+    416: 'Range Not Satisfiable', 500: 'Internal Server Error',
+}
+
+# Only configured media tables can be streamed; the name goes into SQL
+STREAM_TABLES = frozenset(table for _, table in
+                          list(config.table_list) + list(getattr(config, 'audio_table_list', [])))
+
+
+def _get_item_details(table_name, item_id):
+    db = MySQL(**config.mysql_config)
+    results = db.get_data(f"SELECT * FROM `{table_name}` WHERE id = %s", (item_id,))
+    return results[0] if results else None
+
+
+STREAM_ITEMS = media_stream.StreamItemCache(_get_item_details)
+
+
+class Headers(dict):
+    """
+    Request headers with case-insensitive get(), as http_range.evaluate()
+    expects.
+    """
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class BadRequest(Exception):
+    pass
+
+
+async def read_request(reader):
+    """
+    Reads one request head. Returns (method, target, version, headers), or
+    None if the client closed the connection or stayed idle too long.
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), STREAM_SERVER_KEEPALIVE)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest("request head too large")
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise BadRequest("malformed request line")
+    headers = Headers()
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise BadRequest("malformed header")
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise BadRequest("request bodies are not supported")
+    length = headers.get('Content-Length')
+    if length:
+        try:
+            await reader.readexactly(int(length))
+        except (ValueError, asyncio.IncompleteReadError):
+            raise BadRequest("bad Content-Length")
+    return method, target, version, headers
+
+
+def parse_target(target):
+    """
+    Maps /stream/<table>/<id> onto (table, id), or None.
+    """
+    path = target.split('?', 1)[0]
+    parts = path.split('/')
+    if len(parts) != 4 or parts[0] != '' or parts[1] != 'stream':
+        return None
+    table_name = unquote(parts[2])
+    if table_name not in STREAM_TABLES or not parts[3].isdigit():
+        return None
+    return table_name, int(parts[3])
+
+
+class StreamConnection:
+    """
+    One client connection; serves requests until either side closes it.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.body_bytes = 0   # file bytes sent for the current request
+
+    async def send_head(self, status, headers, keep_alive):
+        lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                 f'Date: {http_range.http_date(time.time())}',
+                 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await self.writer.drain()
+
+    async def send_error(self, status, message, keep_alive, extra=None):
+        body = message.encode('utf-8')
+        headers = {'Content-Type': 'text/plain; charset=utf-8', 'Content-Length': str(len(body))}
+        headers.update(extra or {})
+        await self.send_head(status, headers, keep_alive)
+        self.writer.write(body)
+        await self.writer.drain()
+
+    async def send_file_range(self, file, start, length, shaper):
+        prefetch.advise_sequential(file, start, length)
+        if block_cache.BLOCK_CACHE.enabled:
+            await self.send_cached_range(file, start, length, shaper)
+            return
+        # sendfile() waits for the socket to accept more data, and the
+        # fallback (TLS, non-Linux) reads in a thread and awaits drain()
+        if shaper is None or not shaper.rate:
+            # Bounded calls, so a cold range is read from disk one chunk at
+            # a time between turns of the loop (see the module docstring)
+            for offset in range(start, start + length, media_stream.STREAM_CHUNK_SIZE):
+                await self._sendfile(file, offset, min(media_stream.STREAM_CHUNK_SIZE, start + length - offset))
+            bandwidth.SCHEDULER.record_sendfile(length)
+            return
+        # Paced: one sendfile() per chunk, sized and spaced by the shaper
+        end = start + length
+        while start < end:
+            size = min(end - start, shaper.chunk_size())
+            wait = shaper.delay(size)
+            if wait:
+                await asyncio.sleep(wait)
+            sent_at = time.monotonic()
+            await self._sendfile(file, start, size)
+            shaper.sent(size, time.monotonic() - sent_at)
+            start += size
+
+    async def _sendfile(self, file, start, length):
+        file.seek(start)
+        try:
+            await self.loop.sendfile(self.writer.transport, file, start, length)
+        finally:
+            # The file position is updated even when sendfile() raises, so
+            # a disconnected client's partial range is counted too
+            self.body_bytes += file.tell() - start
+
+    async def send_cached_range(self, file, start, length, shaper):
+        # Blocks come from the shared cache; misses are read in a thread,
+        # and concurrent readers of the same block share that read
+        cache = block_cache.BLOCK_CACHE
+        st = await self.loop.run_in_executor(None, os.fstat, file.fileno())
+        position, end = start, start + length
+        while position < end:
+            offset = position - position % cache.block_size
+            data = cache.peek(st, offset)
+            if data is None:
+                data = await self.loop.run_in_executor(None, cache.block, file, st, offset)
+            begin = position - offset
+            stop = min(len(data), end - offset)
+            if stop <= begin:
+                break
+            if shaper:
+                wait = shaper.delay(stop - begin)
+                if wait:
+                    await asyncio.sleep(wait)
+            sent_at = time.monotonic()
+            self.writer.write(memoryview(data)[begin:stop])
+            await self.writer.drain()
+            self.body_bytes += stop - begin
+            if shaper:
+                shaper.sent(stop - begin, time.monotonic() - sent_at)
+            position = offset + stop
+
+    async def serve(self):
+        try:
+            while True:
+                try:
+                    request = await read_request(self.reader)
+                except BadRequest as e:
+                    await self.send_error(400, str(e), keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, target, version, headers = request
+                connection = (headers.get('Connection') or '').lower()
+                if version == 'HTTP/1.1':
+                    keep_alive = connection != 'close'
+                else:
+                    keep_alive = connection == 'keep-alive'
+                try:
+                    await self.respond(method, target, headers, keep_alive)
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    print(f"Error serving {target}: {e}", file=sys.stderr)
+                    await self.send_error(500, "Internal server error", keep_alive=False)
+                    return
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    async def respond(self, method, target, headers, keep_alive):
+        if method not in ('GET', 'HEAD'):
+            await self.send_error(405, "Method not allowed", keep_alive, {'Allow': 'GET, HEAD'})
+            return
+        if target.split('?', 1)[0] == '/stats':
+            stats = dict(bandwidth.SCHEDULER.stats(), block_cache=block_cache.BLOCK_CACHE.stats())
+            body = json.dumps(stats).encode('utf-8')
+            await self.send_head(200, {'Content-Type': 'application/json',
+                                       'Content-Length': str(len(body))}, keep_alive)
+            if method == 'GET':
+                self.writer.write(body)
+                await self.writer.drain()
+            return
+        key = parse_target(target)
+        if key is None:
+            await self.send_error(404, "Not found", keep_alive)
+            return
+        try:
+            item = await self.loop.run_in_executor(None, STREAM_ITEMS.get, *key)
+        except OSError:
+            await self.send_error(404, "File on disk not found", keep_alive)
+            return
+        if item is None:
+            await self.send_error(404, "File path not found", keep_alive)
+            return
+
+        path, mime_type, st, bitrate = item
+        file_size = st.st_size
+        etag = http_range.make_etag(st)
+        validators = {
+            'ETag': etag,
+            'Last-Modified': http_range.http_date(st.st_mtime),
+            'Accept-Ranges': 'bytes',
+        }
+        if media_stream.STREAM_CACHE_CONTROL:
+            validators['Cache-Control'] = media_stream.STREAM_CACHE_CONTROL
+
+        decision = http_range.evaluate(method, headers, file_size, st.st_mtime, etag)
+
+        if decision.status in (304, 412):
+            await self.send_head(decision.status, dict(validators, **{'Content-Length': '0'}), keep_alive)
+            return
+        if decision.status == 416:
+            await self.send_head(416, dict(validators, **{'Content-Length': '0',
+                                                          'Content-Range': f'bytes */{file_size}'}), keep_alive)
+            return
+
+        if method == 'HEAD':
+            shaper = None
+        else:
+            shaper = bandwidth.SCHEDULER.open(bitrate)
+        self.body_bytes = 0
+        metrics.STREAMS_ACTIVE.inc(server='stream_server')
+        try:
+            # open() can wait on the disk (or a network mount); not on the loop
+            with await self.loop.run_in_executor(None, open, path, 'rb') as file:
+                await self.send_body(method, file, decision, validators, file_size, mime_type, keep_alive, shaper)
+        finally:
+            if shaper is not None:
+                shaper.close()
+            metrics.STREAMS_ACTIVE.dec(server='stream_server')
+            metrics.STREAM_BYTES.inc(self.body_bytes, server='stream_server', category=key[0])
+
+    async def send_body(self, method, file, decision, validators, file_size, mime_type, keep_alive, shaper):
+        """
+        Sends a 200/206 response for an open file.
+        """
+        if decision.is_multipart:
+            boundary = http_range.new_boundary()
+            parts, trailer, total = http_range.multipart_layout(decision.ranges, file_size, mime_type, boundary)
+            await self.send_head(206, dict(validators, **{
+                'Content-Type': f'multipart/byteranges; boundary={boundary}',
+                'Content-Length': str(total)}), keep_alive)
+            if method == 'HEAD':
+                return
+            for header, start, length in parts:
+                self.writer.write(header)
+                await self.send_file_range(file, start, length, shaper)
+            self.writer.write(trailer)
+            await self.writer.drain()
+            return
+
+        if decision.status == 206:
+            start, end = decision.ranges[0]
+            length = end - start + 1
+            head = dict(validators, **{'Content-Range': http_range.content_range(start, end, file_size)})
+        else:
+            start, length = 0, file_size
+            head = dict(validators)
+        head['Content-Type'] = mime_type
+        head['Content-Length'] = str(length)
+        await self.send_head(decision.status, head, keep_alive)
+        if method != 'HEAD' and length:
+            await self.send_file_range(file, start, length, shaper)
+
+
+async def handle_client(reader, writer):
+    await StreamConnection(reader, writer).serve()
+
+
+async def serve(host=STREAM_SERVER_HOST, port=STREAM_SERVER_PORT):
+    server = await asyncio.start_server(handle_client, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Streaming on {', '.join(str(s.getsockname()) for s in server.sockets)}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=STREAM_SERVER_HOST, help="Address to listen on")
+    parser.add_argument('--port', type=int, default=STREAM_SERVER_PORT, help="Port to listen on")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
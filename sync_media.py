@@ -20,27 +20,46 @@ Standalone CLI script to sync media folders with MySQL database.
 Scans folders from table_list in config.py, inserts new files, deletes stale entries,
 and displays results using the rich library.
 
+By default the sync is incremental: the directory state saved by the last
+run (see media_scanner.py) lets unchanged directories be skipped, and only
+the files added or removed since then are written to the database. The
+first run for a table, or --full, rescans everything and diffs against the
+database.
+
+New files (and any row without a mime_type) are then probed with
+pymediainfo for duration, container, codecs, bitrate and MIME type, when
+the table has those columns (see migrate_catalog.py). --no-probe skips
+this stage.
+
 Usage:
-    python3 sync_media.py
+    python3 sync_media.py [--full] [--no-probe]
     or
     ./sync_media.py (if executable)
 """
 
+import argparse
 import pymysql
 import os
-import re
+import time
 from datetime import datetime
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich import box
 from config import mysql_config, table_list
+from catalog import bump_catalog_version, folder_values, rebuild_directory_index, table_columns, FOLDER_COLUMNS
+from bulk_db import BULK_CHUNK_SIZE, bulk_delete, bulk_delete_by_join, bulk_insert, bulk_update
+from media_scanner import DirectorySnapshot, extension_matcher, scan_tree, scan_trees
+from media_probe import PROBE_CACHE_KIND, PROBE_COLUMNS, available as probe_available, probe_files
+from metadata_cache import MetadataCache
+import metrics
 
 # Initialize rich console
 console = Console()
 
-# Regex pattern for video files (expanded to include more formats)
-VIDEO_PATTERN = re.compile(r'.*(\.mp4|\.mkv|\.avi|\.webm|\.mov|\.flv|\.wmv|\.m4v|\.mpg|\.mpeg)$', re.IGNORECASE)
+# Video file extensions (checked against a set instead of a regex per file)
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.mkv', '.avi', '.webm', '.mov', '.flv', '.wmv', '.m4v', '.mpg', '.mpeg'})
+is_video_file = extension_matcher(VIDEO_EXTENSIONS)
 
 
 def connect_to_db():
@@ -58,24 +77,21 @@ def connect_to_db():
         return None
 
 
-def scan_folder(folder_path, pattern):
+def scan_folder(folder_path, extensions=VIDEO_EXTENSIONS):
     """
-    Scans a folder recursively for files matching the specified pattern.
+    Scans a folder recursively for files with one of the given extensions.
 
     Args:
         folder_path (str): The path to the folder to scan.
-        pattern (re.Pattern): A regular expression pattern to match filenames.
+        extensions (set): Lower-case file extensions to keep, e.g. {'.mp4'}.
 
     Returns:
         list: A list of absolute file paths found in the folder.
     """
-    files = []
-    if os.path.exists(folder_path):
-        for root, _, filenames in os.walk(folder_path):
-            for filename in filenames:
-                if pattern.match(filename):
-                    files.append(os.path.join(root, filename))
-    return files
+    if not os.path.exists(folder_path):
+        return []
+    snapshot, _ = scan_tree(folder_path, extension_matcher(extensions))
+    return sorted(snapshot.files())
 
 
 def get_existing_file_paths(connection, table_name):
@@ -95,52 +111,115 @@ def get_existing_file_paths(connection, table_name):
     return {row[0] for row in results}
 
 
-def insert_new_files(connection, table_name, new_files):
+def insert_new_files(connection, table_name, new_files, folder_path=None):
     """
-    Inserts new file paths into the database for a given table.
+    Inserts new file paths into the database for a given table, in batched
+    multi-row INSERTs (see bulk_db.py).
 
     Args:
         connection (pymysql.Connection): A connection object to the database.
         table_name (str): The name of the database table.
         new_files (list): A list of file paths to insert.
+        folder_path (str): The table's root folder. When given and the table
+            has the folder/parent_dir columns, they are filled in too.
 
     Returns:
-        int: The number of files successfully inserted.
+        tuple: (inserted_count, failed_count)
     """
     if not new_files:
-        return 0
+        return 0, 0
         
     cursor = connection.cursor()
-    inserted_count = 0
-    failed_count = 0
-    
+    with_folders = folder_path is not None and set(FOLDER_COLUMNS) <= table_columns(cursor, table_name)
+    columns = ('title', 'file_path') + (FOLDER_COLUMNS if with_folders else ())
+
+    rows = []
     for file_path in new_files:
         title = os.path.splitext(os.path.basename(file_path))[0]
-        try:
-            # Insert without specifying id - let AUTO_INCREMENT handle it
-            cursor.execute(
-                f"INSERT INTO {table_name} (title, file_path) VALUES (%s, %s)",
-                (title, file_path),
-            )
-            inserted_count += 1
-        except pymysql.Error as e:
-            failed_count += 1
-            if failed_count <= 3:  # Only show first 3 errors to avoid spam
-                console.print(f"[yellow]Warning:[/yellow] Error inserting into {table_name}: {e}")
-            elif failed_count == 4:
-                console.print(f"[yellow]Warning:[/yellow] Suppressing further insertion errors for {table_name}...")
-    
-    connection.commit()
+        row = (title, file_path)
+        if with_folders:
+            row += folder_values(folder_path, file_path)
+        rows.append(row)
+
+    errors = []
+    def report(row, error):
+        errors.append(error)
+        if len(errors) <= 3:  # Only show first 3 errors to avoid spam
+            console.print(f"[yellow]Warning:[/yellow] Error inserting {row[1]} into {table_name}: {error}")
+        elif len(errors) == 4:
+            console.print(f"[yellow]Warning:[/yellow] Suppressing further insertion errors for {table_name}...")
+
+    # Insert without specifying id - let AUTO_INCREMENT handle it
+    inserted_count, failed_count = bulk_insert(connection, table_name, columns, rows, on_error=report)
     
     if failed_count > 0:
         console.print(f"[bold red]Error:[/bold red] {failed_count} files failed to insert in {table_name}.")
     
-    return inserted_count
+    return inserted_count, failed_count
+
+
+def _delete_error_reporter():
+    """
+    Returns an on_error callback for the bulk deletes that prints the error
+    and counts it in its `failed` attribute.
+    """
+    def report(row, error):
+        report.failed += 1
+        if report.failed <= 3:
+            console.print(f"[yellow]Warning:[/yellow] Error deleting {row[0]}: {error}")
+    report.failed = 0
+    return report
+
+
+def forget_recent_playback(connection, table_name, file_paths):
+    """
+    Removes deleted files from the web app's continue watching list.
+    """
+    file_paths = list(file_paths)
+    cursor = connection.cursor()
+    try:
+        for i in range(0, len(file_paths), BULK_CHUNK_SIZE):
+            batch = file_paths[i:i + BULK_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                f"DELETE FROM recent_playback WHERE category = %s AND file_path IN ({placeholders})",
+                [table_name] + batch,
+            )
+        connection.commit()
+    except pymysql.Error:
+        connection.rollback()  # recent_playback only exists once the web app has created it
+
+
+def delete_files(connection, table_name, file_paths):
+    """
+    Deletes the given file paths from the database for a given table.
+    Small sets use chunked IN lists; larger ones are joined against a
+    staging table so file_path does not need an index.
+
+    Args:
+        connection (pymysql.Connection): A connection object to the database.
+        table_name (str): The name of the database table.
+        file_paths (iterable): The file paths to delete.
+
+    Returns:
+        tuple: (deleted_count, failed_count)
+    """
+    file_paths = list(file_paths)
+    if not file_paths:
+        return 0, 0
+    report = _delete_error_reporter()
+    if len(file_paths) > BULK_CHUNK_SIZE:
+        deleted_count = bulk_delete_by_join(connection, table_name, 'file_path', file_paths, on_error=report)
+    else:
+        deleted_count = bulk_delete(connection, table_name, 'file_path', file_paths, on_error=report)
+    forget_recent_playback(connection, table_name, file_paths)
+    return deleted_count, report.failed
 
 
 def delete_stale_files(connection, table_name, current_files_set):
     """
     Deletes stale file paths from the database (files that no longer exist on disk).
+    Stale rows are deleted by primary key in chunks.
 
     Args:
         connection (pymysql.Connection): A connection object to the database.
@@ -148,32 +227,181 @@ def delete_stale_files(connection, table_name, current_files_set):
         current_files_set (set): A set of file paths that currently exist on disk.
 
     Returns:
-        int: The number of files successfully deleted.
+        tuple: (deleted_count, failed_count)
     """
     cursor = connection.cursor()
-    cursor.execute(f"SELECT file_path FROM {table_name}")
-    db_files = {row[0] for row in cursor.fetchall()}
-    stale_files = db_files - current_files_set
-    deleted_count = 0
-    for file_path in stale_files:
-        try:
-            cursor.execute(f"DELETE FROM {table_name} WHERE file_path = %s", (file_path,))
-            deleted_count += 1
-        except pymysql.Error as e:
-            console.print(f"[yellow]Warning:[/yellow] Error deleting {file_path}: {e}")
-    connection.commit()
-    return deleted_count
+    cursor.execute(f"SELECT id, file_path FROM {table_name}")
+    stale = [(row_id, file_path) for row_id, file_path in cursor.fetchall()
+             if file_path not in current_files_set]
+    if not stale:
+        return 0, 0
+    report = _delete_error_reporter()
+    deleted_count = bulk_delete(connection, table_name, 'id', [row_id for row_id, _ in stale], on_error=report)
+    forget_recent_playback(connection, table_name, [file_path for _, file_path in stale])
+    return deleted_count, report.failed
 
 
-def sync_media_folders():
+def filter_known_paths(connection, table_name, file_paths, batch_size=500):
+    """
+    Returns the subset of file_paths that are not in the table yet, looking
+    up only those paths rather than reading the whole table.
+    """
+    cursor = connection.cursor()
+    file_paths = list(file_paths)
+    known = set()
+    for i in range(0, len(file_paths), batch_size):
+        batch = file_paths[i:i + batch_size]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cursor.execute(f"SELECT file_path FROM {table_name} WHERE file_path IN ({placeholders})", batch)
+        known.update(row[0] for row in cursor.fetchall())
+    return [f for f in file_paths if f not in known]
+
+
+def probe_media(connection, table_name, cache=None):
+    """
+    Fills the probe columns of every row whose mime_type is still NULL: rows
+    just inserted and rows from before the columns existed. Files are probed
+    in parallel (see media_probe.py) and written back in batched UPDATEs.
+
+    Args:
+        connection (pymysql.Connection): A connection object to the database.
+        table_name (str): The name of the database table.
+        cache (MetadataCache): Earlier probe results, reused for unchanged files.
+
+    Returns:
+        int: The number of rows updated (0 if the table lacks the columns).
+    """
+    cursor = connection.cursor()
+    if not set(PROBE_COLUMNS) <= table_columns(cursor, table_name):
+        return 0
+    cursor.execute(f"SELECT id, file_path FROM {table_name} WHERE mime_type IS NULL AND file_path IS NOT NULL")
+    ids_by_path = {}
+    for row_id, file_path in cursor.fetchall():
+        ids_by_path.setdefault(file_path, []).append(row_id)
+    if not ids_by_path:
+        return 0
+
+    rows, errors = [], 0
+    for file_path, metadata in probe_files(list(ids_by_path), cache):
+        if 'error' in metadata:
+            # Left with mime_type NULL so the next sync probes it again; the
+            # app guesses the MIME type from the extension meanwhile
+            errors += 1
+            if errors <= 3:
+                console.print(f"[yellow]Warning:[/yellow] Could not probe {file_path}: {metadata['error']}")
+            continue
+        values = tuple(metadata.get(c) for c in PROBE_COLUMNS)
+        rows.extend(values + (row_id,) for row_id in ids_by_path[file_path])
+
+    def report(row, error):
+        console.print(f"[yellow]Warning:[/yellow] Error saving probe results for id {row[-1]}: {error}")
+
+    updated, _ = bulk_update(connection, table_name, 'id', PROBE_COLUMNS, rows, on_error=report)
+    return updated
+
+
+def scan_tables(entries, full=False):
+    """
+    Scans the folders of several tables concurrently.
+
+    Args:
+        entries (list): (folder_path, table_name) pairs.
+        full (bool): Ignore saved snapshots and list every directory.
+
+    Returns:
+        dict: table_name -> (previous_snapshot, new_snapshot, incremental)
+    """
+    previous = {table_name: DirectorySnapshot.for_table(table_name, folder_path)
+                for folder_path, table_name in entries}
+    incremental = {table_name: not full and not snapshot.is_empty
+                   for table_name, snapshot in previous.items()}
+    jobs = [(table_name, folder_path, previous[table_name] if incremental[table_name] else None)
+            for folder_path, table_name in entries]
+    scanned = scan_trees(jobs, is_video_file)
+    results = {}
+    for _, table_name in entries:
+        snapshot = scanned[table_name][0]
+        # Full scans start without a previous snapshot; save to the same file
+        snapshot.path = previous[table_name].path
+        results[table_name] = (previous[table_name], snapshot, incremental[table_name])
+    return results
+
+
+def sync_table(connection, folder_path, table_name, full=False, scanned=None, probe=False, cache=None):
+    """
+    Syncs one folder with its table.
+
+    Incremental when a snapshot from an earlier run exists and `full` is not
+    set: only directories that changed are listed and only the added and
+    removed files touch the database. Otherwise every file is scanned and
+    compared with the table. The snapshot is saved once the database is
+    up to date, and not at all if any insert or delete failed.
+
+    Args:
+        scanned (tuple): This table's entry from scan_tables(), if the
+            folder was already scanned.
+        probe (bool): Run the media probe stage afterwards.
+        cache (MetadataCache): Probe results kept between runs.
+
+    Returns:
+        tuple: (scanned_count, inserted_count, deleted_count, incremental,
+        probed_count)
+    """
+    if scanned is None:
+        scanned = scan_tables([(folder_path, table_name)], full)[table_name]
+    previous, snapshot, incremental = scanned
+    scanned_files = snapshot.files()
+
+    if incremental:
+        previous_files = previous.files()
+        added = sorted(scanned_files - previous_files)
+        new_files = filter_known_paths(connection, table_name, added)
+        inserted_count, insert_failed = insert_new_files(connection, table_name, new_files, folder_path)
+        deleted_count, delete_failed = delete_files(connection, table_name, previous_files - scanned_files)
+    else:
+        existing_paths = get_existing_file_paths(connection, table_name)
+        new_files = sorted(f for f in scanned_files if f not in existing_paths)
+        inserted_count, insert_failed = insert_new_files(connection, table_name, new_files, folder_path)
+        deleted_count, delete_failed = delete_stale_files(connection, table_name, scanned_files)
+
+    # Refresh the folder/album index read by the browse endpoints
+    if inserted_count or deleted_count:
+        rebuild_directory_index(connection, table_name)
+
+    probed_count = 0
+    if probe:
+        probed_count = probe_media(connection, table_name, cache)
+        if cache is not None and (deleted_count or not incremental):
+            cache.prune(PROBE_CACHE_KIND, folder_path, scanned_files)
+
+    # The next incremental run diffs against the saved snapshot, not the
+    # table, so keep the old one while rows are missing or left over: the
+    # failed files then show up as added or removed again and are retried.
+    if insert_failed or delete_failed:
+        console.print(f"[yellow]Warning:[/yellow] Not saving the scan state of {table_name}; "
+                      f"failed files will be retried on the next run.")
+    else:
+        snapshot.save()
+    return len(scanned_files), inserted_count, deleted_count, incremental, probed_count
+
+
+def sync_media_folders(full=False, probe=True):
     """
     Main function to sync media folders with the database.
     Scans all folders in table_list, compares with database, and updates accordingly.
+
+    Args:
+        full (bool): Rescan every directory instead of syncing incrementally.
+        probe (bool): Probe new files for duration, codecs and MIME type.
     """
+    started = time.monotonic()
+    mode = 'full' if full else 'incremental'
+
     # Display header
     console.print(Panel.fit(
         "[bold cyan]Media Manager - Database Sync[/bold cyan]\n"
-        f"[dim]Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}[/dim]",
+        f"[dim]Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        f" ({'full rescan' if full else 'incremental'})[/dim]",
         border_style="cyan"
     ))
     
@@ -181,7 +409,16 @@ def sync_media_folders():
     db_connection = connect_to_db()
     if not db_connection:
         console.print("[bold red]Sync aborted due to database connection failure.[/bold red]")
+        metrics.SYNC_RUNS.inc(mode=mode, result='failed')
+        metrics.REGISTRY.flush()
         return
+
+    cache = None
+    if probe and not probe_available():
+        console.print("[yellow]Warning:[/yellow] pymediainfo/libmediainfo not available, skipping the probe stage.")
+        probe = False
+    if probe:
+        cache = MetadataCache()
     
     # Create results table
     results_table = Table(
@@ -196,16 +433,26 @@ def sync_media_folders():
     results_table.add_column("Scanned", justify="right", style="blue")
     results_table.add_column("Inserted", justify="right", style="green")
     results_table.add_column("Deleted", justify="right", style="red")
+    results_table.add_column("Probed", justify="right", style="magenta")
     results_table.add_column("Status", justify="center")
     
     # Track totals
     total_scanned = 0
     total_inserted = 0
     total_deleted = 0
+    total_probed = 0
     total_errors = 0
     
     # Process each folder/table pair
     with console.status("[bold green]Syncing media folders...") as status:
+        # Scan every reachable folder up front; the roots are walked in parallel
+        status.update("[bold green]Scanning media folders...")
+        scans = {}
+        try:
+            scans = scan_tables([(f, t) for f, t in table_list if os.path.exists(f)], full)
+        except Exception as e:
+            console.print(f"[yellow]Warning:[/yellow] Parallel scan failed, scanning tables one by one: {e}")
+
         for folder_path, table_name in table_list:
             status.update(f"[bold green]Processing: {table_name}...")
             
@@ -216,31 +463,28 @@ def sync_media_folders():
                     "-",
                     "-",
                     "-",
+                    "-",
                     "[bold red]✗ Folder Not Found[/bold red]"
                 )
                 total_errors += 1
                 continue
             
             try:
-                # Scan folder for video files
-                scanned_files = scan_folder(folder_path, VIDEO_PATTERN)
-                scanned_count = len(scanned_files)
-                
-                # Get existing paths from database
-                existing_paths = get_existing_file_paths(db_connection, table_name)
-                
-                # Find new files to insert
-                new_files = [f for f in scanned_files if f not in existing_paths]
-                
-                # Insert new files
-                inserted_count = insert_new_files(db_connection, table_name, new_files)
-                
-                # Delete stale entries
-                deleted_count = delete_stale_files(db_connection, table_name, set(scanned_files))
+                # Scan the folder and apply the differences to the table
+                table_started = time.monotonic()
+                scanned_count, inserted_count, deleted_count, _, probed_count = sync_table(
+                    db_connection, folder_path, table_name, full=full, scanned=scans.get(table_name),
+                    probe=probe, cache=cache
+                )
+                metrics.SYNC_TABLE_SECONDS.set(time.monotonic() - table_started, table=table_name)
+                for action, count in (('scanned', scanned_count), ('inserted', inserted_count),
+                                      ('deleted', deleted_count), ('probed', probed_count)):
+                    metrics.SYNC_FILES.inc(count, table=table_name, action=action)
+                    metrics.SYNC_LAST_FILES.set(count, table=table_name, action=action)
                 
                 # Add row to results table
                 status_text = "[bold green]✓ Success[/bold green]"
-                if inserted_count > 0 or deleted_count > 0:
+                if inserted_count > 0 or deleted_count > 0 or probed_count > 0:
                     status_text = f"[bold yellow]✓ Updated[/bold yellow]"
                 
                 results_table.add_row(
@@ -249,6 +493,7 @@ def sync_media_folders():
                     str(scanned_count),
                     str(inserted_count),
                     str(deleted_count),
+                    str(probed_count),
                     status_text
                 )
                 
@@ -256,6 +501,7 @@ def sync_media_folders():
                 total_scanned += scanned_count
                 total_inserted += inserted_count
                 total_deleted += deleted_count
+                total_probed += probed_count
                 
             except Exception as e:
                 results_table.add_row(
@@ -264,12 +510,25 @@ def sync_media_folders():
                     "-",
                     "-",
                     "-",
+                    "-",
                     f"[bold red]✗ Error: {str(e)[:30]}[/bold red]"
                 )
                 total_errors += 1
     
     # Close database connection
     db_connection.close()
+    if cache is not None:
+        cache.close()
+
+    # Tell the running web app to drop its cached schema/catalog data
+    if total_inserted or total_deleted or total_probed:
+        bump_catalog_version()
+
+    # Picked up by /metrics of the web app
+    metrics.SYNC_RUNS.inc(mode=mode, result='error' if total_errors else 'ok')
+    metrics.SYNC_LAST_SECONDS.set(time.monotonic() - started)
+    metrics.SYNC_LAST_TIMESTAMP.set(time.time())
+    metrics.REGISTRY.flush()
     
     # Display results table
     console.print()
@@ -290,6 +549,8 @@ def sync_media_folders():
     summary_table.add_row("Total Files Scanned", f"[blue]{total_scanned}[/blue]")
     summary_table.add_row("Total Files Inserted", f"[green]{total_inserted}[/green]")
     summary_table.add_row("Total Files Deleted", f"[red]{total_deleted}[/red]")
+    if probe:
+        summary_table.add_row("Total Files Probed", f"[magenta]{total_probed}[/magenta]")
     if total_errors > 0:
         summary_table.add_row("Errors", f"[bold red]{total_errors}[/bold red]")
     
@@ -310,8 +571,14 @@ def sync_media_folders():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync media folders with the MySQL database.")
+    parser.add_argument('--full', action='store_true',
+                        help="Rescan every directory and diff against the database instead of syncing incrementally")
+    parser.add_argument('--no-probe', action='store_true',
+                        help="Skip probing new files for duration, codecs and MIME type")
+    args = parser.parse_args()
     try:
-        sync_media_folders()
+        sync_media_folders(full=args.full, probe=not args.no_probe)
     except KeyboardInterrupt:
         console.print("\n[bold red]Sync interrupted by user.[/bold red]")
     except Exception as e: